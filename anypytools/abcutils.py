@@ -15,26 +15,48 @@ import os
 import io
 import sys
 import time
-import copy
 import types
 import ctypes
+import random
 import shelve
 import atexit
 import logging
+import heapq
+import itertools
 import collections
-from subprocess import Popen
+from subprocess import Popen, PIPE, STDOUT
+try:
+    from subprocess import TimeoutExpired
+except ImportError:  # Python 2
+    TimeoutExpired = None
 from tempfile import NamedTemporaryFile
-from threading import Thread, RLock
-from queue import Queue
+from threading import Thread, RLock, Condition
+from queue import Queue, Empty
+try:
+    from time import monotonic as _monotonic
+except ImportError:  # Python 2
+    from time import time as _monotonic
+try:
+    from concurrent.futures import ProcessPoolExecutor
+except ImportError:  # Python 2 without the futures backport
+    ProcessPoolExecutor = None
+try:
+    from multiprocessing import shared_memory, resource_tracker
+except ImportError:  # Python < 3.8
+    shared_memory = None
 
 import numpy as np
 from future.utils import text_to_native_str
 from past.builtins import basestring as string_types
 
-from .tools import (make_hash, AnyPyProcessOutputList, parse_anybodycon_output,
-                    getsubdirs, get_anybodycon_path,
-                    AnyPyProcessOutput, run_from_ipython, get_ncpu, silentremove)
-from .macroutils import AnyMacro, MacroCommand
+from .tools import (make_hash, make_digest, AnyPyProcessOutputList, parse_anybodycon_output,
+                    AnyBodyConOutputParser, getsubdirs, get_anybodycon_path,
+                    AnyPyProcessOutput, run_from_ipython, get_ncpu, silentremove,
+                    _with_exit, _without_exit)
+from .macroutils import AnyMacro, MacroCommand, MacroSequence
+from .resultstore import ResultStore, is_result_store
+from .runtimehistory import predict_makespan
+from .resultcache import LOAD_COMMAND_RE
 
 try:
     from IPython.display import HTML, display
@@ -48,11 +70,27 @@ logger = logging.getLogger('abt.anypytools')
 _thread_lock = RLock()
 _KILLED_BY_ANYPYTOOLS = 10
 _NO_LICENSES_AVAILABLE = -22
+# Seconds between reading the log file of running processes
+_TAIL_INTERVAL = 0.2
+# Key of the journal record, which identifies the batch of the journal
+_JOURNAL_HEADER_KEY = -1
+# Seconds to wait before the first retry of a task which did not get a
+# license. The wait is doubled for every retry up to the maximum.
+_LICENSE_BACKOFF = 2.0
+_MAX_LICENSE_BACKOFF = 60.0
 
 
 class _SubProcessContainer(object):
     """Class to hold a record of process pids from Popen.
 
+    Parameters
+    ----------
+    parent: _SubProcessContainer, optional
+        Container which also records the processes, e.g. the global
+        container which kills any remaining processes at exit. Stopping
+        the processes of this container does not stop the other processes
+        of the parent.
+
     Properties
     ----------
     stop_all: boolean
@@ -69,17 +107,22 @@ class _SubProcessContainer(object):
 
     """
 
-    def __init__(self):
+    def __init__(self, parent=None):
         self._pids = set()
         self._stop_all = False
+        self._parent = parent
 
     def add(self, pid):
+        if self._parent is not None:
+            self._parent.add(pid)
         with _thread_lock:
             self._pids.add(pid)
         if self.stop_all:
             self._kill_running_processes()
 
     def remove(self, pid):
+        if self._parent is not None:
+            self._parent.remove(pid)
         with _thread_lock:
             try:
                 self._pids.remove(pid)
@@ -124,8 +167,29 @@ def _display(line, *args, **kwargs):
         print(line, *args, **kwargs)
 
 
+def _wait_for_process(proc, timeout):
+    """Wait for a process to finish.
+
+    Returns True if the process finished before the timeout
+    and False otherwise.
+    """
+    if TimeoutExpired is not None:
+        try:
+            proc.wait(timeout=timeout)
+        except TimeoutExpired:
+            return False
+        return True
+    # Python 2 can not wait with a timeout. Poll the process instead.
+    timeout_time = _monotonic() + timeout
+    while proc.poll() is None:
+        if _monotonic() > timeout_time:
+            return False
+        time.sleep(0.05)
+    return True
+
+
 def execute_anybodycon(macro, logfile=None, anybodycon_path=None, timeout=3600,
-                       keep_macrofile=False, env=None):
+                       keep_macrofile=False, env=None, output_handler=None):
     """Launch a single AnyBodyConsole applicaiton.
 
     This is a low level function to start a AnyBody Console process
@@ -143,14 +207,20 @@ def execute_anybodycon(macro, logfile=None, anybodycon_path=None, timeout=3600,
         case the default installed AnyBody installation will be looked up
         in the Windows registry.
     timeout : int, optional
-        Timeout before the process is killed autmotically. Defaults to
-        3600 seconds (1 hour).
+        Timeout before the process is killed autmotically. The timeout is
+        measured in wall clock time. Defaults to 3600 seconds (1 hour).
     keep_macrofile : bool, optional
         Set to True to prevent the temporary macro file from beeing deleted.
         (Defaults to False)
     env: dict
         Environment varaibles which are passed to the started AnyBody console
         application.
+    output_handler : callable, optional
+        Function which is called with the new text in the log file while the
+        AnyBody Console application is running, and once with the remaining
+        text after it has finished. If the function returns True the
+        application is stopped. Requires a `logfile` with a file name.
+        (Defaults to None)
 
     Returns
     -------
@@ -158,9 +228,75 @@ def execute_anybodycon(macro, logfile=None, anybodycon_path=None, timeout=3600,
         The return code from the AnyBody Console application.
 
     """
+    return _execute_anybodycon(macro, logfile, anybodycon_path, timeout,
+                               keep_macrofile, env, output_handler,
+                               _subprocess_container)
+
+
+def _execute_anybodycon(macro, logfile, anybodycon_path, timeout,
+                        keep_macrofile, env, output_handler, processes):
+    """Launch the AnyBody console and record its pid in `processes`."""
     if logfile is None:
         logfile = sys.stdout
 
+    anybodycmd, subprocess_flags, macro_filename = _prepare_anybodycon(
+        macro, logfile, anybodycon_path)
+    reader = None
+    if output_handler is not None:
+        # Use a separate file handle to read what AnyBody writes to the log
+        reader = io.open(logfile.name, 'r')
+    try:
+        proc = Popen(anybodycmd,
+                     stdout=logfile,
+                     stderr=logfile,
+                     creationflags=subprocess_flags,
+                     env=env)
+        processes.add(proc.pid)
+        aborted = False
+        if reader is None:
+            finished = _wait_for_process(proc, timeout)
+        else:
+            deadline = _monotonic() + timeout
+            while True:
+                remaining = max(deadline - _monotonic(), 0)
+                finished = _wait_for_process(
+                    proc, min(remaining, _TAIL_INTERVAL))
+                if finished or remaining == 0:
+                    break
+                if output_handler(reader.read()):
+                    aborted = True
+                    break
+        if not finished:
+            proc.terminate()
+            proc.communicate()
+            if aborted:
+                _write_abort_message(logfile)
+            else:
+                _write_timeout_message(logfile, timeout)
+            proc.returncode = 0
+        processes.remove(proc.pid)
+        retcode = ctypes.c_int32(proc.returncode).value
+        _write_returncode_message(logfile, retcode)
+        if reader is not None:
+            logfile.flush()
+            output_handler(reader.read())
+    finally:
+        if reader is not None:
+            reader.close()
+        if not keep_macrofile:
+            silentremove(macro_filename)
+    return retcode
+
+
+def _prepare_anybodycon(macro, logfile, anybodycon_path=None):
+    """Write the macro file and create the AnyBody console command.
+
+    Returns
+    -------
+    tuple
+        The command, the process creation flags and the macro filename.
+
+    """
     try:
         macro_filename = os.path.splitext(logfile.name)[0] + '.anymcr'
     except AttributeError:
@@ -169,8 +305,7 @@ def execute_anybodycon(macro, logfile=None, anybodycon_path=None, timeout=3600,
     if anybodycon_path is None:
         anybodycon_path = get_anybodycon_path()
 
-    if macro and macro[-1] != 'exit':
-        macro.append('exit')
+    _with_exit(macro)
 
     if not os.path.isfile(anybodycon_path):
         raise IOError("Can not find anybodycon.exe: " + anybodycon_path)
@@ -190,30 +325,23 @@ def execute_anybodycon(macro, logfile=None, anybodycon_path=None, timeout=3600,
         subprocess_flags = 0x8000000  # win32con.CREATE_NO_WINDOW?
     else:
         subprocess_flags = 0
-    # Check global module flag to avoid starting processes after
-    # the user cancelled the processes
-    timeout_time = time.clock() + timeout
-    proc = Popen(anybodycmd,
-                 stdout=logfile,
-                 stderr=logfile,
-                 creationflags=subprocess_flags,
-                 env=env)
-    _subprocess_container.add(proc.pid)
-    while proc.poll() is None:
-        if time.clock() > timeout_time:
-            proc.terminate()
-            proc.communicate()
-            try:
-                logfile.seek(0, os.SEEK_END)
-            except io.UnsupportedOperation:
-                pass
-            logfile.write(
-                '\nERROR: AnyPyTools : Timeout after {:d} sec.'.format(int(timeout)))
-            proc.returncode = 0
-            break
-        time.sleep(0.05)
-    _subprocess_container.remove(proc.pid)
-    retcode = ctypes.c_int32(proc.returncode).value
+    return anybodycmd, subprocess_flags, macro_file.name
+
+
+def _write_timeout_message(logfile, timeout):
+    try:
+        logfile.seek(0, os.SEEK_END)
+    except io.UnsupportedOperation:
+        pass
+    logfile.write(
+        '\nERROR: AnyPyTools : Timeout after {:d} sec.'.format(int(timeout)))
+
+
+def _write_abort_message(logfile):
+    logfile.write('\nAnybodycon.exe was stopped by AnyPyTools after an error')
+
+
+def _write_returncode_message(logfile, retcode):
     if retcode == _KILLED_BY_ANYPYTOOLS:
         logfile.write('\nAnybodycon.exe was interrupted by AnyPyTools')
     elif retcode == _NO_LICENSES_AVAILABLE:
@@ -224,9 +352,230 @@ def execute_anybodycon(macro, logfile=None, anybodycon_path=None, timeout=3600,
     elif retcode:
         logfile.write('\nERROR: AnyPyTools : anybodycon.exe exited unexpectedly.'
                       ' Return code: ' + str(retcode))
-    if not keep_macrofile:
-        silentremove(macro_file.name)
-    return retcode
+
+
+# Line in the log files between the macro and the output of the console
+_LOG_OUTPUT_HEADER = '######### OUTPUT LOG ##########'
+# Command which marks the end of the commands of a task in a session, and
+# the start of the commands of each task in a fused macro. The
+# console echoes every macro command, which the output parser also relies on
+# for Dump commands, and then prints the dumped value. A dump of the built-in
+# constant pi works in every model and does not change it.
+_MARKER_VARIABLE = 'Global.pi'
+_MARKER_COMMAND = 'classoperation {} "Dump"'.format(_MARKER_VARIABLE)
+
+
+def _is_marker(line):
+    """Return True for the echo of the marker command in the console output."""
+    return '#### Macro command' in line and line.rstrip().endswith(
+        _MARKER_COMMAND)
+
+
+def _is_marker_value(line):
+    """Return True for the value printed by the marker command."""
+    return line.startswith(_MARKER_VARIABLE)
+
+
+def _split_session_macro(macro):
+    """Split a macro in the commands which load the model and the rest.
+
+    Returns
+    -------
+    tuple
+        The commands up to and including the last ``load`` command, and a
+        list of the remaining commands.
+
+    """
+    macro = _without_exit(macro)
+    n_setup = 0
+    for i, line in enumerate(macro):
+        if LOAD_COMMAND_RE.match(line):
+            n_setup = i + 1
+    return tuple(macro[:n_setup]), macro[n_setup:]
+
+
+class _AnyBodyConSession(object):
+    """AnyBody console application which reads macro commands from stdin.
+
+    The model is loaded once with the `setup` commands, and the session can
+    then run the commands of many tasks. The output of each call to `run`
+    is found by sending a marker command after the commands, and waiting
+    until the console echoes it and prints the dumped value. The marker and
+    its value are not written to the log.
+
+    Parameters
+    ----------
+    anybodycon_path : str
+        Path to the AnyBody console application.
+    folder : str
+        Working folder of the console application.
+    setup : tuple of str
+        Commands which load the model.
+    env : dict, optional
+        Environment variables of the console application.
+    timeout : int, optional
+        Seconds to wait for the setup commands.
+    deadline : float, optional
+        Time (from `_monotonic`) at which the setup is stopped. It is shared
+        with the commands of the first task. (Defaults to `timeout` seconds
+        from now)
+    processes : _SubProcessContainer, optional
+        Record of the process ids, which is used to stop the console.
+    errors_to_ignore : list of str, optional
+        Errors which do not count as errors of the session, like the
+        ``ignore_errors`` of `AnyPyProcess`.
+
+    """
+
+    def __init__(self, anybodycon_path, folder, setup, env=None,
+                 timeout=3600, deadline=None, processes=_subprocess_container,
+                 errors_to_ignore=None):
+        self.key = (anybodycon_path, folder, setup)
+        self._processes = processes
+        self._errors_to_ignore = errors_to_ignore
+        self.n_tasks = 0
+        self.has_error = False
+        if sys.platform.startswith("win"):
+            subprocess_flags = 0x8000000  # win32con.CREATE_NO_WINDOW?
+        else:
+            subprocess_flags = 0
+        self._proc = Popen([os.path.realpath(anybodycon_path), '/ni'],
+                           stdin=PIPE, stdout=PIPE, stderr=STDOUT,
+                           cwd=folder, env=env, universal_newlines=True,
+                           creationflags=subprocess_flags)
+        self._processes.add(self._proc.pid)
+        self._lines = Queue()
+        reader = Thread(target=self._read_output)
+        reader.daemon = True
+        reader.start()
+        # The output of the setup is added to the log of the first task
+        self._setup_log = io.StringIO()
+        self._setup_retcode = self.run(list(setup), self._setup_log,
+                                       timeout=timeout, deadline=deadline)
+
+    @property
+    def alive(self):
+        return self._proc is not None
+
+    def _read_output(self):
+        for line in iter(self._proc.stdout.readline, ''):
+            self._lines.put(line)
+        self._lines.put(None)
+
+    def run(self, commands, logfile, output_handler=None, timeout=3600,
+            deadline=None):
+        """Run macro commands and write their output to `logfile`.
+
+        The commands are stopped after `timeout` seconds, or at the
+        `deadline` if it is given.
+
+        Returns
+        -------
+        int
+            The return code of the console application if it stopped,
+            and otherwise 0.
+
+        """
+        # Errors are found like in the output of the task
+        errors = AnyBodyConOutputParser(self._errors_to_ignore)
+
+        def write(text):
+            logfile.write(text)
+            errors.feed(text)
+            if errors.has_error:
+                self.has_error = True
+            return output_handler is not None and output_handler(text)
+
+        if self._setup_log is not None and logfile is not self._setup_log:
+            setup_log, self._setup_log = self._setup_log.getvalue(), None
+            aborted = write(setup_log)
+            if aborted or self.has_error or not self.alive:
+                # Don't run the commands if the model was not loaded
+                return self._setup_retcode
+        try:
+            self._proc.stdin.write(
+                '\n'.join(list(commands) + [_MARKER_COMMAND, '']))
+            self._proc.stdin.flush()
+        except (IOError, OSError):
+            pass  # The console has stopped. The output is read below.
+        if deadline is None:
+            deadline = _monotonic() + timeout
+        marker_seen = False
+        while True:
+            try:
+                line = self._lines.get(
+                    timeout=min(max(deadline - _monotonic(), 0), 1))
+            except Empty:
+                if _monotonic() < deadline:
+                    continue
+                self.close(kill=True)
+                message = io.StringIO()
+                _write_timeout_message(message, timeout)
+                write(message.getvalue())
+                return 0
+            if line is None:
+                return self._stopped(write, self._proc.wait())
+            if marker_seen:
+                # The dumped value of the marker ends the commands. Anything
+                # else, e.g. an error from the marker, is kept in the log.
+                if not _is_marker_value(line):
+                    write(line)
+                return 0
+            if _is_marker(line):
+                marker_seen = True
+                continue
+            if write(line):
+                self.close(kill=True)
+                write('\nAnybodycon.exe was stopped by AnyPyTools '
+                      'after an error')
+                return 0
+
+    def _stopped(self, write, retcode):
+        """Handle a console which stopped before the commands finished."""
+        self.close()
+        retcode = ctypes.c_int32(retcode).value
+        if self._processes.stop_all:
+            retcode = _KILLED_BY_ANYPYTOOLS
+        message = io.StringIO()
+        _write_returncode_message(message, retcode)
+        if not retcode:
+            message.write('\nERROR: AnyPyTools : The AnyBody console '
+                          'session stopped unexpectedly.')
+        write(message.getvalue())
+        return retcode
+
+    def close(self, kill=False):
+        """Stop the console application.
+
+        The console exits when its stdin is closed. With ``kill=True``, or
+        if it does not exit within a second, it is killed.
+        """
+        proc, self._proc = self._proc, None
+        if proc is None:
+            return
+        self._processes.remove(proc.pid)
+        try:
+            proc.stdin.close()
+        except (IOError, OSError):
+            pass
+        if kill or not _wait_for_process(proc, 1):
+            proc.kill()
+            proc.wait()
+        proc.stdout.close()
+
+
+def _get_folderlist(folderlist=None, search_subdirs=None):
+    """Check the folderlist input argument and expand it with subdirs."""
+    if not folderlist:
+        folderlist = [os.getcwd()]
+    if not isinstance(folderlist, list):
+        raise TypeError('folderlist must be a list of folders')
+    # Extend the folderlist if search_subdir is given
+    if (isinstance(search_subdirs, string_types) and
+            isinstance(folderlist[0], string_types)):
+        folderlist = sum([getsubdirs(d, search_subdirs)
+                          for d in folderlist], [])
+    return folderlist
 
 
 class _Task(object):
@@ -243,6 +592,7 @@ class _Task(object):
     def __init__(self, folder=None, macro=None,
                  taskname=None, number=1):
         """Init the Task class with the class attributes."""
+        self._rendered = None
         self.folder = folder
         if not folder:
             self.folder = os.getcwd()
@@ -254,12 +604,67 @@ class _Task(object):
         self.number = number
         self.logfile = ""
         self.processtime = 0
+        self.retcode = None
         self.name = taskname
         if not taskname:
             head, folder = os.path.split(folder)
             parentfolder = os.path.basename(head)
             self.name = parentfolder + '/' + folder
 
+    @property
+    def macro(self):
+        """The macro commands of the task.
+
+        Tasks created from a `MacroSequence` create their macro when it is
+        used, so the macros of large studies are not kept in memory. The
+        macro is kept while the task is processed, see `_render_macro`.
+        """
+        if self._macro is not None:
+            return self._macro
+        if self._rendered is not None:
+            return self._rendered
+        sequence, index = self._macro_source
+        return _with_exit(sequence[index])
+
+    @macro.setter
+    def macro(self, macro):
+        self._macro = macro
+        self._macro_source = None
+
+    def _render_macro(self):
+        """Prepare the macro before the task is processed.
+
+        The macro gets the exit command, which the console needs, and the
+        macro of a lazy task is created once and kept until
+        `_release_macro` is called.
+        """
+        if self._macro is None:
+            if self._rendered is None:
+                self._rendered = self.macro
+        else:
+            _with_exit(self._macro)
+
+    def _release_macro(self):
+        """Let a lazy task create its macro on demand again."""
+        self._rendered = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        if state['_macro'] is None:
+            state['_macro'] = self.macro
+            state['_macro_source'] = None
+            state['_rendered'] = None
+        return state
+
+    def __setstate__(self, state):
+        if 'macro' in state:
+            # Tasks pickled by earlier versions
+            state['_macro'] = state.pop('macro')
+            state['_macro_source'] = None
+        state.setdefault('retcode', None)
+        state.setdefault('_rendered', None)
+        self.__dict__.update(state)
+
     @property
     def has_error(self):
         return 'ERROR' in self.output
@@ -273,12 +678,13 @@ class _Task(object):
     def get_output(self, include_task_info=True):
         out = self.output
         if include_task_info:
-            out['task_macro_hash'] = make_hash(self.macro)
+            macro = self.macro
+            out['task_macro_hash'] = make_hash(macro)
             out['task_id'] = self.number
             out['task_work_dir'] = self.folder
             out['task_name'] = self.name
             out['task_processtime'] = self.processtime
-            out['task_macro'] = self.macro
+            out['task_macro'] = macro
             out['task_logfile'] = self.logfile
         return out
 
@@ -304,10 +710,40 @@ class _Task(object):
     def from_macrofolderlist(cls, macrolist, folderlist):
         if not macrolist:
             raise StopIteration
+        if isinstance(macrolist, MacroSequence):
+            # Keep a reference to the sequence instead of the macros
+            indices = range(len(macrolist))
+            for i, (j, folder) in enumerate((j, f) for f in folderlist
+                                            for j in indices):
+                task = cls(folder, number=i)
+                task._macro = None
+                task._macro_source = (macrolist, j)
+                yield task
+            return
         macrofolderlist = ((m, f) for f in folderlist for m in macrolist)
         for i, (macro, folder) in enumerate(macrofolderlist):
             yield cls(folder, macro, number=i)
 
+    @classmethod
+    def from_macro_iterable(cls, macros, folderlist):
+        """Create tasks lazily from an iterable of macros.
+
+        The elements of `macros` can be single macros or batches of macros
+        as created by ``AnyMacro.create_macros(batch_size=...)``. Each macro
+        is run in all the folders of `folderlist`.
+        """
+        numbers = itertools.count()
+        for elem in macros:
+            if elem and isinstance(elem[0], list):
+                batch = elem
+            else:
+                batch = [elem]
+            for macro in batch:
+                macro = [mc.get_macro(index=0) if isinstance(mc, MacroCommand)
+                         else mc for mc in macro]
+                for folder in folderlist:
+                    yield cls(folder, macro, number=next(numbers))
+
     @staticmethod
     def is_valid(output_elem):
         keys = ('task_macro_hash', 'task_id', 'task_work_dir', 'task_name',
@@ -315,6 +751,92 @@ class _Task(object):
         return all(k in output_elem for k in keys)
 
 
+class _FusedTask(_Task):
+    """Tasks which load the same model, combined to run in one console.
+
+    The macro loads the model once, and then runs the remaining commands of
+    each task after a marker Dump command. The output is split at the
+    echoes of the markers, so each task gets the output of the model loading
+    and of its own commands.
+
+    Parameters
+    ----------
+    tasks : list of _Task
+        The tasks to combine. They must run in the same folder.
+    setup : tuple of str
+        The commands which load the model, which are the same for all tasks.
+
+    """
+
+    def __init__(self, tasks, setup):
+        self.tasks = tasks
+        macro = list(setup)
+        for task in tasks:
+            macro.append(_MARKER_COMMAND)
+            macro.extend(_split_session_macro(task.macro)[1])
+        super(_FusedTask, self).__init__(tasks[0].folder, macro,
+                                         taskname=tasks[0].name,
+                                         number=tasks[0].number)
+
+    def split_output(self, log, retcode, errors_to_ignore=None,
+                     warnings_to_include=None):
+        """Parse the log of the fused macro into the output of each task."""
+        n_tasks = len(self.tasks)
+        for task in self.tasks:
+            task.retcode = retcode
+            task.processtime = self.processtime / n_tasks
+        self.output = AnyPyProcessOutput()
+        if retcode in (_KILLED_BY_ANYPYTOOLS, _NO_LICENSES_AVAILABLE):
+            for task in self.tasks + [self]:
+                task.processtime = 0
+                task.add_error('Error: Non zero return code: '
+                               '{}'.format(retcode))
+            return
+        # Skip the macro, which is written at the top of the log file
+        head, sep, log = log.partition(_LOG_OUTPUT_HEADER)
+        if not sep:
+            log = head
+        # Output of the model loading, followed by the output of each task
+        segments = [[] for _ in range(n_tasks + 1)]
+        n_reached = 0
+        after_marker = False
+        for line in log.splitlines():
+            if after_marker and _is_marker_value(line):
+                after_marker = False
+                continue
+            after_marker = _is_marker(line) and n_reached < n_tasks
+            if after_marker:
+                n_reached += 1
+            else:
+                segments[n_reached].append(line)
+        for i, (task, segment) in enumerate(zip(self.tasks, segments[1:])):
+            if i >= n_reached:
+                # The console stopped before it reached the task. The error
+                # is reported for the task which was running.
+                task.add_error('ERROR: AnyPyTools : The task was not run, '
+                               'since the fused macro stopped before it.')
+                continue
+            task.output = parse_anybodycon_output(
+                '\n'.join(segments[0] + segment), errors_to_ignore,
+                warnings_to_include)
+        n_errors = sum(task.has_error for task in self.tasks)
+        if n_errors:
+            self.add_error('{} of the fused tasks failed'.format(n_errors))
+
+    def _release_macro(self):
+        for task in self.tasks:
+            task._release_macro()
+
+    def finish(self):
+        """Pass the log file and any other errors on to the tasks."""
+        for task in self.tasks:
+            task.process_number = self.process_number
+            task.logfile = self.logfile
+            if not task.output and self.has_error:
+                # E.g. the macro could not be started
+                task.output['ERROR'] = list(self.output['ERROR'])
+
+
 class _Summery(object):
     """Class to display the summery of task."""
 
@@ -377,6 +899,368 @@ class _Summery(object):
         self._display('Total time: {:.1f} seconds'.format(total_process_time))
 
 
+class _WorkerPool(object):
+    """Fixed size pool of long lived threads which process tasks.
+
+    The worker threads pull tasks from a queue and put the processed tasks
+    on a result queue. With zero workers the tasks are processed directly
+    in the calling thread when they are submitted.
+
+    Parameters
+    ----------
+    worker : callable
+        Function called as ``worker(task, result_queue)`` for every task.
+    num_workers : int
+        Number of worker threads to start.
+
+    """
+
+    def __init__(self, worker, num_workers):
+        self._worker = worker
+        self.num_workers = num_workers
+        self._pending = Queue()
+        self._done = Queue()
+        self._threads = []
+        for _ in range(num_workers):
+            t = Thread(target=self._run)
+            t.daemon = True
+            t.start()
+            self._threads.append(t)
+
+    def _run(self):
+        while True:
+            task = self._pending.get()
+            if task is None:
+                return
+            self._worker(task, self._done)
+
+    def submit(self, task):
+        """Queue a task for processing."""
+        if self._threads:
+            self._pending.put(task)
+        else:
+            self._worker(task, self._done)
+
+    def get(self):
+        """Block until a task is processed and return it."""
+        while True:
+            try:
+                # Wake up now and then. Otherwise, the wait can not be
+                # interrupted with ctrl-c on Windows.
+                return self._done.get(timeout=1)
+            except Empty:
+                continue
+
+    def close(self):
+        """Stop the worker threads when they have finished their tasks."""
+        for _ in self._threads:
+            self._pending.put(None)
+        self._threads = []
+
+
+class _LicenseThrottle(object):
+    """Limit the number of AnyBody processes when the licenses run out.
+
+    The limit is halved when a process fails to get a license, and
+    increased by one again after `limit` processes in a row got a license
+    (additive increase, multiplicative decrease). This keeps a shared
+    license server busy without starting processes which fail at once.
+
+    Parameters
+    ----------
+    max_running : int
+        The highest limit, i.e. the number of worker threads.
+
+    """
+
+    def __init__(self, max_running):
+        self.max_running = max(max_running, 1)
+        self.limit = self.max_running
+        self._running = 0
+        self._successes = 0
+        # Incremented when the limit is lowered. Failures of processes
+        # started before that are part of the same overload.
+        self._epoch = 0
+        self._condition = Condition()
+
+    def acquire(self):
+        """Wait until a process can be started, and return the epoch."""
+        with self._condition:
+            while self._running >= self.limit:
+                self._condition.wait(1)
+            self._running += 1
+            return self._epoch
+
+    def try_acquire(self):
+        """Return the epoch if a process can be started now, or None."""
+        with self._condition:
+            if self._running >= self.limit:
+                return None
+            self._running += 1
+            return self._epoch
+
+    def release(self, epoch, got_license):
+        """Report that a process started in `epoch` has finished."""
+        with self._condition:
+            self._running -= 1
+            if not got_license:
+                if epoch == self._epoch:
+                    self.limit = max(self.limit // 2, 1)
+                    self._epoch += 1
+                    logger.debug('No license available. Running at most '
+                                 '{} processes'.format(self.limit))
+                self._successes = 0
+            elif self.limit < self.max_running:
+                self._successes += 1
+                if self._successes >= self.limit:
+                    self.limit += 1
+                    self._successes = 0
+            self._condition.notify_all()
+
+
+def _license_backoff(retry):
+    """Seconds to wait before retry number `retry` of a task."""
+    delay = min(_LICENSE_BACKOFF * 2 ** retry, _MAX_LICENSE_BACKOFF)
+    # Spread the retries, so the tasks do not ask for licenses at once
+    return delay * random.uniform(0.5, 1.0)
+
+
+# Alignment of the arrays in the shared memory block of a parsed log file
+_SHARED_ALIGNMENT = 64
+
+
+def _parse_logfile(filename, errors_to_ignore=None, warnings_to_include=None):
+    """Parse a log file in a process of the parse pool.
+
+    The numeric arrays of the output are copied to a single shared memory
+    block, so only their layout is pickled and sent back to the main process.
+
+    Returns
+    -------
+    tuple
+        The name of the shared memory block (or None), the layout of the
+        arrays as ``(key, dtype, shape, offset)`` and the output, where the
+        arrays in the shared memory block are replaced with None.
+
+    """
+    with io.open(filename, 'r', errors='replace') as f:
+        output = parse_anybodycon_output(f.read(), errors_to_ignore,
+                                         warnings_to_include)
+    if shared_memory is None:
+        return None, [], output
+    layout = []
+    size = 0
+    for key, value in output.items():
+        if isinstance(value, np.ndarray) and value.dtype.kind in 'biuf':
+            layout.append((key, value.dtype.str, value.shape, size))
+            size += -(-value.nbytes // _SHARED_ALIGNMENT) * _SHARED_ALIGNMENT
+    if size == 0:
+        return None, [], output
+    shm = shared_memory.SharedMemory(create=True, size=size)
+    try:
+        for key, dtype, shape, offset in layout:
+            value = output[key]
+            target = np.ndarray(shape, dtype, buffer=shm.buf, offset=offset)
+            target[...] = value
+            del target
+            output[key] = None
+    except BaseException:
+        # The block never reaches the main process, so it is removed here
+        shm.unlink()
+        raise
+    finally:
+        shm.close()
+    # The main process owns the block and unlinks it. Otherwise the
+    # resource tracker of the pool process would remove it again.
+    if os.name == 'posix':
+        # The tracker knows the block by its POSIX name with a leading slash
+        resource_tracker.unregister('/' + shm.name, 'shared_memory')
+    return shm.name, layout, output
+
+
+def _unpack_parsed_output(shm_name, layout, output):
+    """Copy the arrays of a parsed log file out of shared memory."""
+    if shm_name is None:
+        return output
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        for key, dtype, shape, offset in layout:
+            output[key] = np.ndarray(shape, dtype, buffer=shm.buf,
+                                     offset=offset).copy()
+    finally:
+        shm.close()
+        shm.unlink()
+    return output
+
+
+def _as_single_macro(macro):
+    """Convert the different ways to specify one macro to a list of str."""
+    if isinstance(macro, AnyMacro):
+        macros = macro.create_macros(lazy=True)
+        if len(macros) != 1:
+            raise ValueError('The AnyMacro object must create a single macro')
+        return macros[0]
+    if isinstance(macro, (string_types, MacroCommand)):
+        macro = [macro]
+    return [mc.get_macro(index=0) if isinstance(mc, MacroCommand) else mc
+            for mc in macro]
+
+
+class MacroPool(object):
+    """Run macros on the workers of an AnyPyProcess as they are submitted.
+
+    The pool is created with `AnyPyProcess.open_pool`. New macros can be
+    submitted at any time, also while earlier macros are running, so the
+    workers are kept busy without waiting for a whole batch to finish. The
+    results are returned by `get` in the order the tasks finish, or passed
+    to a callback.
+
+    Attributes
+    ----------
+    num_workers : int
+        Number of macros which run in parallel.
+
+    """
+
+    def __init__(self, app, callback=None):
+        self._app = app
+        self._callback = callback
+        self._numbers = itertools.count()
+        self._results = Queue()
+        self._n_running = 0
+        self._in_callback = False
+        self._closed = False
+        self._condition = Condition()
+        app._processes.stop_all = False
+        if app.executor is not None:
+            self._pool = app.executor
+            self._pool.start(app)
+        else:
+            self._pool = _WorkerPool(app._worker, max(app.num_processes, 1))
+        self.num_workers = self._pool.num_workers
+        self._collector = Thread(target=self._collect)
+        self._collector.daemon = True
+        self._collector.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close(cancel=exc_type is not None)
+
+    @property
+    def n_running(self):
+        """Number of submitted macros which have not finished."""
+        return self._n_running
+
+    @property
+    def free_workers(self):
+        """Number of workers which are not running a macro."""
+        return max(self.num_workers - self._n_running, 0)
+
+    def submit(self, macro, folder=None):
+        """Start a macro when a worker is available.
+
+        Parameters
+        ----------
+        macro : list of str, list of macro commands or AnyMacro
+            The macro to run. An `AnyMacro` object must create a single macro.
+        folder : str, optional
+            The folder to run the macro in. Defaults to the current
+            working directory.
+
+        Returns
+        -------
+        int
+            The id of the task, which is returned together with its output.
+
+        """
+        if self._closed:
+            raise ValueError('The pool is closed')
+        task = _Task(folder or os.getcwd(), _as_single_macro(macro),
+                     number=next(self._numbers))
+        with self._condition:
+            self._n_running += 1
+            self._condition.notify_all()
+        self._pool.submit(task)
+        return task.number
+
+    def get(self, timeout=None):
+        """Return the ``(task_id, output)`` of the next finished macro.
+
+        Raises ``queue.Empty`` if no macro finishes within `timeout` seconds.
+        Not used if the pool has a callback.
+        """
+        if timeout is not None:
+            return self._results.get(timeout=timeout)
+        while True:
+            try:
+                # Wake up now and then, so ctrl-c works on Windows.
+                return self._results.get(timeout=1)
+            except Empty:
+                continue
+
+    def wait(self):
+        """Block until all submitted macros have finished."""
+        with self._condition:
+            # A running callback may still submit new macros
+            while self._n_running or self._in_callback:
+                self._condition.wait(1)
+
+    def close(self, cancel=False):
+        """Wait for the running macros and stop the workers.
+
+        With ``cancel=True`` the running AnyBody processes are killed.
+        """
+        if self._closed:
+            return
+        if cancel:
+            # Only stop the processes of this pool's AnyPyProcess
+            self._app._processes.stop_all = True
+        self.wait()
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        self._collector.join()
+        self._pool.close()
+        self._app._close_parse_pool()
+        self._app._close_sessions()
+        self._app._processes.stop_all = False
+
+    def _collect(self):
+        """Pass the finished tasks to the callback or the result queue."""
+        app = self._app
+        while True:
+            with self._condition:
+                while not self._n_running and not self._closed:
+                    self._condition.wait()
+                if not self._n_running:
+                    return
+            task = self._pool.get()
+            if app.summery is not None:
+                app.summery.task_summery(task)
+            result = (task.number,
+                      task.get_output(include_task_info=app.return_task_info))
+            task._release_macro()
+            # Count the task as finished before it is published, so a
+            # consumer which submits a new macro sees a free worker.
+            with self._condition:
+                self._n_running -= 1
+                self._in_callback = self._callback is not None
+                self._condition.notify_all()
+            if self._callback is None:
+                self._results.put(result)
+                continue
+            try:
+                self._callback(*result)
+            except Exception:
+                logger.exception('Error in the callback of the MacroPool')
+            finally:
+                with self._condition:
+                    self._in_callback = False
+                    self._condition.notify_all()
+
+
 class AnyPyProcess(object):
     """
     Class for configuring batch process jobs of AnyBody models.
@@ -422,6 +1306,74 @@ class AnyPyProcess(object):
         should use for Python Hooks. This will added the ``PYTHONHOME`` environment variable and
         prepended to the ``PATH`` before starting the AnyBody Console application.
         (Defaults to None, which will use the default Python installation on the computer.)
+    executor : object, optional
+        Executor used to run the tasks instead of the local worker threads.
+        E.g. a :class:`anypytools.distributed.RemoteExecutor`, which runs the
+        tasks on worker agents on other computers. An executor must implement
+        the ``start(app)``, ``submit(task)``, ``get()`` and ``close()`` methods
+        and the ``num_workers`` attribute. (Defaults to None)
+    result_cache : ResultCache, optional
+        A :class:`anypytools.resultcache.ResultCache` used to store the output
+        of successful tasks. Tasks with a macro and model files identical to
+        a stored task return the stored output without running AnyBody.
+        (Defaults to None)
+    abort_on_error : bool, optional
+        Stop the AnyBody console application as soon as an error, which is not
+        in `ignore_errors`, is written to the log file. Otherwise the macro is
+        run to the end. (Defaults to False)
+    max_errors : int, optional
+        Stop the batch when this number of tasks have failed. No new tasks are
+        started and the running AnyBody processes are killed. The results of
+        the finished tasks are still returned, and the remaining tasks can be
+        run later by calling `start_macro()` without arguments. Use
+        ``max_errors=1`` to stop at the first error.
+        (Defaults to None, which runs all tasks)
+    journal : str, optional
+        File where `start_macro` records every successful task as soon as it
+        finishes. If the Python process is stopped, e.g. by a crash, calling
+        `start_macro` again with the same arguments and journal file only
+        runs the tasks which are missing from the journal. The journal can
+        also be read with `load_results`. (Defaults to None)
+    parse_processes : int, optional
+        Parse the log files in a pool of this many processes instead of in
+        the worker threads. Use it with many parallel processes, where the
+        parsing of the output would otherwise be limited by the Python GIL.
+        The numeric arrays are returned from the pool through shared memory
+        (Python 3.8 and later). Can not be combined with `abort_on_error`.
+        (Defaults to None)
+    license_retries : int, optional
+        Number of times a task is retried, when the AnyBody console
+        application can not get a license. The retries wait with an
+        exponential backoff, and the number of AnyBody processes running at
+        the same time is lowered while licenses are missing and raised again
+        when processes get licenses. Use it with a shared license server.
+        (Defaults to 0, where tasks without a license fail)
+    runtime_history : RuntimeHistory, optional
+        A :class:`anypytools.runtimehistory.RuntimeHistory` where the run
+        time of every successful task is recorded. `start_macro` then starts
+        the tasks which are expected to run longest first, so the batch
+        finishes sooner, and stores the predicted and actual duration of the
+        batch in the ``last_makespan`` attribute. (Defaults to None)
+    session_tasks : int, optional
+        Run up to this number of tasks in the same AnyBody console
+        application. The macro commands are sent to the console on stdin.
+        The commands up to and including the ``load`` command are only run
+        when a session is started, and the following tasks with the same
+        ``load`` commands and folder only run their remaining commands on the
+        loaded model. This saves the load time in parameter studies with
+        large models, but the model keeps the state from the earlier tasks
+        of the session, so every task must set all the values it depends
+        on. A session is restarted after an error. (Defaults to None, which
+        starts a new console for every task)
+    fuse_tasks : int, optional
+        Let `start_macro` combine up to this number of tasks, which load the
+        same model in the same folder, into a single macro. The model is
+        loaded once, and the output is split back into the output of each
+        task. Higher values save more start up and load time, but if the
+        console application crashes, the remaining tasks of the fused macro
+        fail as well. The tasks share the log file, and the process time is
+        divided equally between them. Can not be combined with
+        `abort_on_error` or `session_tasks`. (Defaults to None)
 
 
     Returns
@@ -453,13 +1405,32 @@ class AnyPyProcess(object):
                  return_task_info=False,
                  keep_logfiles=False,
                  logfile_prefix=None,
-                 python_env=None):
+                 python_env=None,
+                 executor=None,
+                 result_cache=None,
+                 abort_on_error=False,
+                 max_errors=None,
+                 journal=None,
+                 parse_processes=None,
+                 license_retries=0,
+                 runtime_history=None,
+                 session_tasks=None,
+                 fuse_tasks=None):
         if not isinstance(ignore_errors, (list, type(None))):
             raise ValueError('ignore_errors must be a list of strings')
 
         if not isinstance(warnings_to_include, (list, type(None))):
             raise ValueError('warnings_to_include must be a list of strings')
 
+        if parse_processes and abort_on_error:
+            raise ValueError('abort_on_error can not be used with '
+                             'parse_processes, since the errors are found '
+                             'after the macro has finished')
+
+        if fuse_tasks and (abort_on_error or session_tasks):
+            raise ValueError('fuse_tasks can not be used with abort_on_error '
+                             'or session_tasks')
+
         if anybodycon_path is None:
             self.anybodycon_path = get_anybodycon_path()
         elif os.path.exists(anybodycon_path):
@@ -489,6 +1460,29 @@ class AnyPyProcess(object):
             self.env = env
         else:
             self.env = None
+        self.executor = executor
+        self.result_cache = result_cache
+        self.abort_on_error = abort_on_error
+        self.max_errors = max_errors
+        # The running processes of this instance. They are stopped without
+        # affecting other instances.
+        self._processes = _SubProcessContainer(parent=_subprocess_container)
+        self.journal = journal
+        self._arg_digest = None
+        if parse_processes and ProcessPoolExecutor is None:
+            logger.warning('parse_processes requires the concurrent.futures '
+                           'module. The log files are parsed in the worker '
+                           'threads.')
+            parse_processes = None
+        self.parse_processes = parse_processes
+        self._parse_pool = None
+        self.license_retries = license_retries
+        self._license_throttle = _LicenseThrottle(num_processes)
+        self.runtime_history = runtime_history
+        self.last_makespan = None
+        self.session_tasks = session_tasks
+        self._idle_sessions = []
+        self.fuse_tasks = fuse_tasks
         logging.debug('\nAnyPyProcess initialized')
 
     def save_results(self, filename, append=False):
@@ -503,7 +1497,8 @@ class AnyPyProcess(object):
             filename of the file where processing was stored.
         append : bool
             If true append data to what ever is already saved. This allows
-            for saving data in batches.
+            for saving data in batches. Only the new results are written to
+            the file, so appending does not slow down as the file grows.
 
         Returns
         -------
@@ -516,16 +1511,25 @@ class AnyPyProcess(object):
         >>> app.save_results('saved_data.db')
 
         """
-        if self.cached_tasklist:
-            savekey = text_to_native_str('processed_tasks')
-            db = shelve.open(text_to_native_str(filename), writeback=True)
-            if not append or savekey not in db:
-                db[savekey] = self.cached_tasklist
-            else:
-                db[savekey].extend(self.cached_tasklist)
-            db.close()
-        else:
+        if not self.cached_tasklist:
             raise ValueError('Noting to save')
+        if append and os.path.exists(filename) and not is_result_store(filename):
+            # Convert results saved by earlier versions of AnyPyTools
+            previous = self._load_legacy_results(filename)
+            mode = 'w'
+        else:
+            previous = []
+            mode = 'a' if append else 'w'
+        with ResultStore(filename, mode) as store:
+            # The task numbers start from zero in every batch. Offset them,
+            # so the keys of appended batches are unique.
+            offset = store.next_key()
+            for task in previous:
+                store.append(offset + task.number, task)
+            if previous:
+                offset = store.next_key()
+            for task in self.cached_tasklist:
+                store.append(offset + task.number, task)
 
     def save_to_hdf5(self, filename, batch_name=None):
         """Save cached results to hdf5 file.
@@ -545,6 +1549,11 @@ class AnyPyProcess(object):
         -------
             None
 
+        See Also
+        --------
+        anypytools.h5py_writer.HDF5Writer : Write the results to an HDF5 file
+            while the tasks run.
+
         """
         import h5py
 
@@ -611,18 +1620,36 @@ class AnyPyProcess(object):
         >>> app.load_results('unfinished_results.db')
         >>> results = app.start_macro() # rerun unfinished
 
+        See Also
+        --------
+        anypytools.resultstore.ResultStore : Read single tasks from
+            the file without loading all results.
+
         """
+        if is_result_store(filename):
+            with ResultStore(filename, 'r') as store:
+                # Skip the header record of journal files
+                loaded_data = [task for task in store
+                               if isinstance(task, _Task)]
+        else:
+            loaded_data = self._load_legacy_results(filename)
+        self.cached_tasklist = loaded_data
+        results = [task.get_output(True) for task in loaded_data]
+        return AnyPyProcessOutputList(results)
+
+    @staticmethod
+    def _load_legacy_results(filename):
+        """Load results saved with shelve by earlier versions."""
         loadkey = text_to_native_str('processed_tasks')
-        db = shelve.open(text_to_native_str(filename))
+        db = shelve.open(text_to_native_str(filename), flag='r')
         loaded_data = db[loadkey]
         db.close()
         # Hack to help Enrico convert data to the new structured
-        if not isinstance(loaded_data[0].output, AnyPyProcessOutput):
+        if loaded_data and not isinstance(loaded_data[0].output,
+                                          AnyPyProcessOutput):
             for task in loaded_data:
                 task.output = AnyPyProcessOutput(task.output)
-        self.cached_tasklist = loaded_data
-        results = [task.get_output(True) for task in loaded_data]
-        return AnyPyProcessOutputList(results)
+        return loaded_data
 
     def start_macro(self, macrolist=None, folderlist=None, search_subdirs=None,
                     **kwargs):
@@ -663,11 +1690,182 @@ class AnyPyProcess(object):
         >>> app.start_macro(macro, folderlist, search_subdirs = "*.main.any")
 
         """
+        tasklist = self._create_tasklist(macrolist, folderlist, search_subdirs)
+
+        self.summery = _Summery(have_ipython=run_from_ipython(),
+                                silent=self.silent)
+
+        journal = self._open_journal(tasklist)
+        # Start the scheduler
+        try:
+            process_time = self._schedule_processes(tasklist, self._worker,
+                                                    journal)
+        finally:
+            if journal is not None:
+                journal.close()
+        self.cleanup_logfiles(tasklist)
+        # Cache the processed tasklist for restarting later
+        self.cached_tasklist = tasklist
+        self.summery.final_summery(process_time, tasklist)
+        task_output = [task.get_output(include_task_info=self.return_task_info)
+                       for task in tasklist]
+        return AnyPyProcessOutputList(task_output)
+
+    def imap_macro(self, macrolist, folderlist=None, search_subdirs=None):
+        """Run macros and yield the output of each task as soon as it finishes.
+
+        This is a streaming version of `start_macro`, similar to
+        ``multiprocessing.Pool.imap_unordered``. The macros are taken from
+        `macrolist` when a worker becomes available, and the outputs are
+        not kept by the AnyPyProcess object. Hence, neither the macros nor
+        the results of a study need to fit in memory.
+
+        Parameters
+        ----------
+        macrolist : iterable
+            A single macro, a list of macros, an `AnyMacro` object or any
+            iterable (e.g. a generator) of macros. The iterable may also yield
+            batches of macros like the generator returned by
+            ``AnyMacro.create_macros(batch_size=...)``.
+        folderlist : list of str, optional
+            List of folders in which to excute the macro commands. If `None` the
+            current working directory is used. Every macro is run in all the
+            folders before the next macro is taken from `macrolist`.
+        search_subdirs : str, optional
+            Regular expression used to extend the folderlist with all the
+            subdirectories that match the regular expression.
+            Defaults to None: No subdirectories are included.
+
+        Yields
+        ------
+        AnyPyProcessOutput
+            The output of each task in the order the tasks finish. Use
+            ``return_task_info=True`` to get the 'task_id' of the outputs.
+
+        Examples
+        --------
+        >>> mg = AnyMacro(Load('model.main.any'), number_of_macros=10000)
+        >>> for output in app.imap_macro(mg.create_macros(batch_size=100)):
+        ...     process_result(output)
+
+        """
+        if isinstance(macrolist, AnyMacro):
+            macrolist = macrolist.create_macros(lazy=True)
+        elif isinstance(macrolist, string_types):
+            macrolist = [[macrolist]]
+        elif (isinstance(macrolist, list) and macrolist and
+                isinstance(macrolist[0], (string_types, MacroCommand))):
+            macrolist = [macrolist]
+        folderlist = _get_folderlist(folderlist, search_subdirs)
+        tasks = _Task.from_macro_iterable(macrolist, folderlist)
+        self.summery = _Summery(have_ipython=run_from_ipython(),
+                                silent=self.silent)
+        num_workers = self.num_processes if self.num_processes > 1 else 0
+        processed = self._process_tasks(tasks, self._worker, num_workers)
+        try:
+            for task in processed:
+                self.summery.task_summery(task)
+                yield task.get_output(include_task_info=self.return_task_info)
+        finally:
+            # Stop the running consoles if the caller stops early
+            processed.close()
+
+    def open_pool(self, callback=None):
+        """Open a pool which runs macros as they are submitted.
+
+        This is an ask/tell interface for sequential designs, e.g. Bayesian
+        optimization or adaptive refinement. New macros are submitted while
+        earlier macros are running, so the workers never wait for the
+        slowest task of a round.
+
+        Parameters
+        ----------
+        callback : callable, optional
+            Called as ``callback(task_id, output)`` from a background thread
+            when a macro finishes. Without a callback the results are
+            returned by ``pool.get()``.
+
+        Returns
+        -------
+        MacroPool
+            The pool. Use it as a context manager, or call its ``close()``
+            method when done.
+
+        Examples
+        --------
+        >>> with app.open_pool() as pool:
+        ...     points = {}
+        ...     for x in optimizer.ask(pool.num_workers):
+        ...         points[pool.submit(make_macro(x))] = x
+        ...     while not optimizer.converged():
+        ...         task_id, output = pool.get()
+        ...         optimizer.tell(points.pop(task_id), output['Main.Result'])
+        ...         x = optimizer.ask()
+        ...         points[pool.submit(make_macro(x))] = x
+
+        """
+        self.summery = _Summery(have_ipython=run_from_ipython(),
+                                silent=self.silent)
+        return MacroPool(self, callback)
+
+    def start_macro_async(self, macrolist=None, folderlist=None,
+                          search_subdirs=None):
+        """Start a batch processing job from an asyncio event loop.
+
+        The method takes the same arguments as `start_macro`, but returns
+        an asynchronous generator, which yields the output of each task as
+        soon as the task finishes. The AnyBody console applications are
+        started with ``asyncio.create_subprocess_exec``, so no threads are
+        used and a single event loop can run many tasks. At most
+        `num_processes` tasks run at the same time.
+
+        Requires Python 3.6 or newer. On Windows the event loop must support
+        subprocesses (i.e. the ``ProactorEventLoop``, which is the default
+        from Python 3.8). The `session_tasks` and `executor` options are not
+        supported, and like `imap_macro` the tasks are not fused.
+
+        Parameters
+        ----------
+        macrolist : list of macrocommands, optional
+            List of anyscript macro commands. This may also be obmitted in
+            which case the previous macros will be re-run.
+        folderlist : list of str, optional
+            List of folders in which to excute the macro commands. If `None` the
+            current working directory is used.
+        search_subdirs : str, optional
+            Regular expression used to extend the folderlist with all the
+            subdirectories that match the regular expression.
+            Defaults to None: No subdirectories are included.
+
+        Returns
+        -------
+        async generator
+            Yields the output of each task in the order the tasks finish.
+
+        Examples
+        --------
+        >>> async def run_models(app, macro):
+        ...     async for output in app.start_macro_async(macro):
+        ...         print(output['task_id'])
+
+        """
+        if sys.version_info < (3, 6):
+            raise RuntimeError('start_macro_async requires Python 3.6')
+        if self.session_tasks or self.executor is not None:
+            raise ValueError('start_macro_async can not be used with '
+                             'session_tasks or an executor')
+        from .asyncutils import process_tasks_async
+        tasklist = self._create_tasklist(macrolist, folderlist, search_subdirs)
+        return process_tasks_async(self, tasklist)
+
+    def _create_tasklist(self, macrolist=None, folderlist=None,
+                         search_subdirs=None):
+        """Create the list of tasks from the arguments to `start_macro`."""
         # Handle different input types
         if isinstance(macrolist, types.GeneratorType):
             macrolist = list(macrolist)
         if isinstance(macrolist, AnyMacro):
-            macrolist = macrolist.create_macros()
+            macrolist = macrolist.create_macros(lazy=True)
         elif isinstance(macrolist, list) and len(macrolist):
             if isinstance(macrolist[0], string_types):
                 macrolist = [macrolist]
@@ -683,21 +1881,22 @@ class AnyPyProcess(object):
                 macrolist = [macrolist.split(', ')]
             else:
                 macrolist = [[macrolist]]
-        elif isinstance(macrolist, (type(None), AnyPyProcessOutputList)):
+        elif isinstance(macrolist, (type(None), AnyPyProcessOutputList,
+                                    MacroSequence)):
             pass
         else:
             raise ValueError('Wrong input argument for macrolist')
-        # Check folderlist input argument
-        if not folderlist:
-            folderlist = [os.getcwd()]
-        if not isinstance(folderlist, list):
-            raise TypeError('folderlist must be a list of folders')
-        # Extend the folderlist if search_subdir is given
-        if (isinstance(search_subdirs, string_types) and
-                isinstance(folderlist[0], string_types)):
-            folderlist = sum([getsubdirs(d, search_subdirs)
-                              for d in folderlist], [])
+        folderlist = _get_folderlist(folderlist, search_subdirs)
+        self._arg_digest = None
         # Check the input arguments and generate the tasklist
+        # A lazy macro sequence renders the macro on each lookup, and its
+        # macros are always lists
+        if isinstance(macrolist, MacroSequence):
+            first = []
+        elif macrolist is not None:
+            first = macrolist[0]
+        else:
+            first = None
         if macrolist is None:
             if self.cached_tasklist:
                 tasklist = self.cached_tasklist
@@ -705,10 +1904,16 @@ class AnyPyProcess(object):
                 raise ValueError('macrolist argument can only be ommitted if '
                                  'the AnyPyProcess object has cached output '
                                  'to process')
-        elif isinstance(macrolist[0], collections.Mapping):
+        elif isinstance(first, collections.Mapping):
             tasklist = list(_Task.from_output_list(macrolist))
-        elif isinstance(macrolist[0], list):
+        elif isinstance(first, list):
             arg_hash = make_hash([macrolist, folderlist, search_subdirs])
+            if self.journal is not None:
+                # The exit command is appended to the macros when they run,
+                # so it is removed to get the same digest for a rerun.
+                self._arg_digest = make_digest(
+                    [(_without_exit(macro) for macro in macrolist),
+                     folderlist, search_subdirs])
             if self.cached_tasklist and self.cached_arg_hash == arg_hash:
                 tasklist = self.cached_tasklist
             else:
@@ -718,141 +1923,498 @@ class AnyPyProcess(object):
         else:
             raise ValueError('Nothing to process for ' + str(macrolist))
 
-        self.summery = _Summery(have_ipython=run_from_ipython(),
-                                silent=self.silent)
-
         if self.logfile_prefix is None:
             self.logfile_prefix = str(self.cached_arg_hash)[:4] + '_'
+        return tasklist
 
-        # Start the scheduler
-        process_time = self._schedule_processes(tasklist, self._worker)
-        self.cleanup_logfiles(tasklist)
-        # Cache the processed tasklist for restarting later
-        self.cached_tasklist = tasklist
-        self.summery.final_summery(process_time, tasklist)
-        task_output = [task.get_output(include_task_info=self.return_task_info)
-                       for task in tasklist]
-        return AnyPyProcessOutputList(task_output)
+    def _open_journal(self, tasklist):
+        """Open the journal and restore tasks finished by an earlier run.
+
+        The journal is only used if the tasks were created from a list of
+        macros, i.e. when the arguments of `start_macro` can be compared with
+        those of the run which wrote the journal.
+        """
+        if self.journal is None or self._arg_digest is None:
+            return None
+        journal = ResultStore(self.journal, 'a')
+        header = journal.get(_JOURNAL_HEADER_KEY)
+        if header is not None and header['arg_digest'] == self._arg_digest:
+            for i, task in enumerate(tasklist):
+                saved = journal.get(task.number)
+                if saved is not None and not self._is_processed(task):
+                    tasklist[i] = saved
+            return journal
+        if len(journal):
+            logger.warning('The journal {} is from a different batch and is '
+                           'overwritten'.format(self.journal))
+        journal.close()
+        journal = ResultStore(self.journal, 'w')
+        journal.append(_JOURNAL_HEADER_KEY, dict(arg_digest=self._arg_digest))
+        journal.flush(fsync=True)
+        return journal
+
+    @staticmethod
+    def _record_in_journal(journal, task):
+        """Write a successful task to the journal and force it to disk."""
+        if task.has_error or task.processtime <= 0 or task.number in journal:
+            return
+        journal.append(task.number, task)
+        journal.flush(fsync=True)
 
     def _worker(self, task, task_queue):
         """Handle processing of the tasks."""
         with _thread_lock:
             task.process_number = self.counter
             self.counter += 1
-        if task.output:
-            if not task.has_error and task.processtime > 0:
-                if not os.path.isfile(task.logfile):
-                    task.logfile = ""
-                task_queue.put(task)
-                return
+        if self._is_processed(task):
+            task_queue.put(task)
+            return
         try:
+            task._render_macro()
             if not os.path.exists(task.folder):
                 task.add_error('Could not find folder: {}'.format(task.folder))
                 task.logfile = ""
-            else:
-                tmp_kwargs = dict(mode='a+', prefix=self.logfile_prefix,
-                                  suffix='.log', dir=task.folder, delete=False)
-                with NamedTemporaryFile(**tmp_kwargs) as logfile:
-                    logfile.write('########### MACRO #############\n')
-                    logfile.write("\n".join(task.macro))
-                    logfile.write('\n\n######### OUTPUT LOG ##########')
-                    logfile.flush()
-                    task.logfile = logfile.name
-                    starttime = time.clock()
-                    exe_args = dict(macro=task.macro,
-                                    logfile=logfile,
-                                    anybodycon_path=self.anybodycon_path,
-                                    timeout=self.timeout,
-                                    keep_macrofile=self.keep_logfiles,
-                                    env=self.env)
-                    try:
-                        retcode = execute_anybodycon(**exe_args)
-                    finally:
-                        endtime = time.clock()
-                        logfile.seek(0)
-                        task.processtime = endtime - starttime
-                    if retcode in (_KILLED_BY_ANYPYTOOLS, _NO_LICENSES_AVAILABLE):
-                        task.processtime = 0
-                        task.add_error('Error: Non zero return code: {}'.format(retcode))
-                        return
-                    task.output = parse_anybodycon_output(
-                        logfile.read(),
-                        self.ignore_errors,
-                        self.warnings_to_include)
+            elif not self._load_cached_result(task):
+                with self._create_logfile(task) as logfile:
+                    log_start = logfile.tell()
+                    for retry in itertools.count():
+                        retcode, parser = self._run_task(task, logfile)
+                        if (retcode != _NO_LICENSES_AVAILABLE or
+                                retry >= self.license_retries or
+                                not self._wait_for_license(retry)):
+                            break
+                        # Only keep the log of the last try
+                        logfile.seek(log_start)
+                        logfile.truncate()
+                    task.retcode = retcode
+                    self._read_task_output(task, retcode, logfile, parser)
+                if not isinstance(task, _FusedTask):
+                    # The run times of the fused tasks are not known
+                    self._record_runtime(task)
+                for done in getattr(task, 'tasks', [task]):
+                    self._store_cached_result(done)
         except Exception as e:
-            exc_type, exc_obj, exc_tb = sys.exc_info()
-            fname = os.path.split(exc_tb.tb_frame.f_code.co_filename)[1]
-            task.add_error(str(exc_type) + '\n' + str(fname) +
-                           '\n' + str(exc_tb.tb_lineno))
-            logger.debug(str(e))
+            self._add_exception_error(task, e)
         finally:
-            if not self.keep_logfiles and not task.has_error:
-                try:
-                    silentremove(logfile.name)
-                    task.logfile = ""
-                except OSError as e:
-                    pass  # Ignore if AnyBody has not released the log file.
+            self._remove_task_logfile(task)
+            if isinstance(task, _FusedTask):
+                task.finish()
             task_queue.put(task)
 
-    def _schedule_processes(self, tasklist, _worker):
-        # Reset the global flag that allows
-        global _stop_all_processes
-        _subprocess_container.stop_all = False
-        # Make a shallow copy of the task list,
-        # so we don't mess with the callers list.
-        tasklist = copy.copy(tasklist)
+    def _run_task(self, task, logfile):
+        """Run the macro of a task once and return the return code.
+
+        Returns
+        -------
+        tuple
+            The return code of the AnyBody console application, and the
+            parser which was fed the output, or None.
+
+        """
+        parser = output_handler = None
+        timeout = self.timeout
+        if isinstance(task, _FusedTask):
+            # The output is split into the tasks when the macro has finished
+            timeout *= len(task.tasks)
+        else:
+            parser, output_handler = self._create_parser()
+        exe_args = dict(macro=task.macro,
+                        logfile=logfile,
+                        anybodycon_path=self.anybodycon_path,
+                        timeout=timeout,
+                        keep_macrofile=self.keep_logfiles,
+                        env=self.env,
+                        output_handler=output_handler)
+        throttle = self._license_throttle if self.license_retries else None
+        epoch = throttle.acquire() if throttle else None
+        retcode = None
+        starttime = _monotonic()
+        try:
+            if self.session_tasks:
+                retcode = self._run_in_session(task, logfile, output_handler)
+            else:
+                retcode = _execute_anybodycon(processes=self._processes,
+                                              **exe_args)
+        finally:
+            endtime = _monotonic()
+            task.processtime = endtime - starttime
+            if throttle:
+                throttle.release(epoch, retcode != _NO_LICENSES_AVAILABLE)
+        return retcode, parser
+
+    def _create_parser(self):
+        """Create a parser which is fed the log file while AnyBody is running.
+
+        Returns
+        -------
+        tuple
+            The parser and the output handler for `execute_anybodycon`. Both
+            are None if the log files are parsed in the parse pool.
+
+        """
+        if self.parse_processes:
+            return None, None
+        parser = AnyBodyConOutputParser(self.ignore_errors,
+                                        self.warnings_to_include)
+
+        def output_handler(text):
+            parser.feed(text)
+            return self.abort_on_error and parser.has_error
+        return parser, output_handler
+
+    def _run_in_session(self, task, logfile, output_handler):
+        """Run a task in an idle session which has loaded the same model.
+
+        A new session is started if there is no such session. The session
+        is kept for the next tasks unless it has run `session_tasks` tasks
+        or an error occurred.
+        """
+        # Loading the model and running the commands share the timeout
+        deadline = _monotonic() + self.timeout
+        setup, commands = _split_session_macro(task.macro)
+        key = (self.anybodycon_path, os.path.abspath(task.folder), setup)
+        session = None
+        with _thread_lock:
+            for i, idle in enumerate(self._idle_sessions):
+                if idle.key == key:
+                    session = self._idle_sessions.pop(i)
+                    break
+        if session is None:
+            session = _AnyBodyConSession(*key, env=self.env,
+                                         timeout=self.timeout,
+                                         deadline=deadline,
+                                         processes=self._processes,
+                                         errors_to_ignore=self.ignore_errors)
+        try:
+            retcode = session.run(commands, logfile, output_handler,
+                                  timeout=self.timeout, deadline=deadline)
+        except BaseException:
+            session.close()
+            raise
+        session.n_tasks += 1
+        if (not session.alive or session.has_error or
+                session.n_tasks >= self.session_tasks):
+            session.close()
+            return retcode
+        with _thread_lock:
+            self._idle_sessions.append(session)
+            # Keep at most one idle session for each worker
+            n_extra = len(self._idle_sessions) - max(self.num_processes, 1)
+            extra = self._idle_sessions[:max(n_extra, 0)]
+            del self._idle_sessions[:len(extra)]
+        for session in extra:
+            session.close()
+        return retcode
+
+    def _close_sessions(self):
+        with _thread_lock:
+            sessions, self._idle_sessions = self._idle_sessions, []
+        for session in sessions:
+            session.close()
+
+    def _wait_for_license(self, retry):
+        """Wait before a task is retried. Returns False if stopped."""
+        deadline = _monotonic() + _license_backoff(retry)
+        while _monotonic() < deadline:
+            if self._processes.stop_all:
+                return False
+            time.sleep(min(0.1, max(deadline - _monotonic(), 0)))
+        return not self._processes.stop_all
+
+    @staticmethod
+    def _is_processed(task):
+        """Check if a task has already been processed without errors."""
+        if task.output:
+            if not task.has_error and task.processtime > 0:
+                if not os.path.isfile(task.logfile):
+                    task.logfile = ""
+                return True
+        return False
+
+    def _cache_key(self, task):
+        return self.result_cache.key(
+            task.macro, task.folder, self.anybodycon_path,
+            options=(self.ignore_errors, self.warnings_to_include))
+
+    def _in_result_cache(self, task):
+        """Check if a task is in the result cache without loading it."""
+        return (self.result_cache is not None and
+                self._cache_key(task) in self.result_cache)
+
+    def _load_cached_result(self, task):
+        """Load the output of a task from the result cache if possible."""
+        if self.result_cache is None or isinstance(task, _FusedTask):
+            # Fused tasks are only created for tasks which are not cached
+            return False
+        cached = self.result_cache.get(self._cache_key(task))
+        if cached is None:
+            return False
+        task.output, task.processtime = cached
+        task.logfile = ""
+        return True
+
+    def _record_runtime(self, task):
+        if self.runtime_history is not None and not task.has_error:
+            self.runtime_history.record(task.macro, task.folder,
+                                        task.processtime)
+
+    def _store_cached_result(self, task):
+        if self.result_cache is not None and not task.has_error:
+            self.result_cache.put(self._cache_key(task), task.output,
+                                  task.processtime)
+
+    def _create_logfile(self, task):
+        """Create the log file of a task and write the macro to it."""
+        tmp_kwargs = dict(mode='a+', prefix=self.logfile_prefix,
+                          suffix='.log', dir=task.folder, delete=False)
+        logfile = NamedTemporaryFile(**tmp_kwargs)
+        logfile.write('########### MACRO #############\n')
+        logfile.write("\n".join(task.macro))
+        logfile.write('\n\n' + _LOG_OUTPUT_HEADER)
+        logfile.flush()
+        task.logfile = logfile.name
+        return logfile
+
+    def _read_task_output(self, task, retcode, logfile, parser=None):
+        """Parse the output of a task from its log file.
+
+        If a `parser` is given, it has already been fed the content of
+        the log file, and the file is not read again.
+        """
+        if isinstance(task, _FusedTask):
+            logfile.seek(0)
+            task.split_output(logfile.read(), retcode, self.ignore_errors,
+                              self.warnings_to_include)
+            return
+        if self._failed_to_run(task, retcode):
+            return
+        if parser is not None:
+            task.output = parser.close()
+            return
+        if self.parse_processes:
+            future = self._parse_in_pool(logfile)
+            task.output = _unpack_parsed_output(*future.result())
+            return
+        logfile.seek(0)
+        task.output = parse_anybodycon_output(
+            logfile.read(),
+            self.ignore_errors,
+            self.warnings_to_include)
+
+    @staticmethod
+    def _failed_to_run(task, retcode):
+        """Add an error if AnyBody was killed or did not get a license."""
+        if retcode in (_KILLED_BY_ANYPYTOOLS, _NO_LICENSES_AVAILABLE):
+            task.processtime = 0
+            task.add_error('Error: Non zero return code: {}'.format(retcode))
+            return True
+        return False
+
+    def _parse_in_pool(self, logfile):
+        """Start parsing a log file in the parse pool, and return the future."""
+        logfile.flush()
+        return self._get_parse_pool().submit(
+            _parse_logfile, logfile.name, self.ignore_errors,
+            self.warnings_to_include)
+
+    def _get_parse_pool(self):
+        """Return the process pool for parsing, and start it if necessary."""
+        with _thread_lock:
+            if self._parse_pool is None:
+                self._parse_pool = ProcessPoolExecutor(self.parse_processes)
+            return self._parse_pool
+
+    def _close_parse_pool(self):
+        with _thread_lock:
+            if self._parse_pool is not None:
+                self._parse_pool.shutdown()
+                self._parse_pool = None
+
+    @staticmethod
+    def _add_exception_error(task, e):
+        exc_type, exc_obj, exc_tb = sys.exc_info()
+        fname = os.path.split(exc_tb.tb_frame.f_code.co_filename)[1]
+        task.add_error(str(exc_type) + '\n' + str(fname) +
+                       '\n' + str(exc_tb.tb_lineno))
+        logger.debug(str(e))
+
+    def _remove_task_logfile(self, task):
+        if not self.keep_logfiles and not task.has_error and task.logfile:
+            try:
+                silentremove(task.logfile)
+                task.logfile = ""
+            except OSError as e:
+                pass  # Ignore if AnyBody has not released the log file.
+
+    def _schedule_processes(self, tasklist, _worker, journal=None):
         number_tasks = len(tasklist)
         if number_tasks == 0:
             totaltime = 0
             return totaltime
         use_threading = (number_tasks > 1 and self.num_processes > 1)
-        starttime = time.clock()
-        task_queue = Queue()
+        num_workers = min(self.num_processes, number_tasks) if use_threading else 0
+        tasks = tasklist
+        predicted_makespan = None
+        if self.runtime_history is not None:
+            tasks, predicted_makespan = self._longest_first(
+                tasklist, max(num_workers, 1))
+        starttime = _monotonic()
         pbar = _ProgressBar(number_tasks, self.silent)
         pbar.animate(0)
-        processed_tasks = []
+        n_processed = 0
         n_errors = 0
-        threads = []
+        if self.fuse_tasks and self.fuse_tasks > 1:
+            tasks = self._fuse(tasks)
+        for processed in self._process_tasks(tasks, _worker, num_workers):
+            for task in getattr(processed, 'tasks', [processed]):
+                if task.has_error:
+                    n_errors += 1
+                if journal is not None:
+                    self._record_in_journal(journal, task)
+                self.summery.task_summery(task)
+                n_processed += 1
+            pbar.animate(n_processed, n_errors)
+        totaltime = _monotonic() - starttime
+        if self.runtime_history is not None:
+            self.last_makespan = dict(predicted=predicted_makespan,
+                                      actual=totaltime)
+            if predicted_makespan is not None and not self.silent:
+                _display('Predicted time: {:.1f} seconds, actual time: {:.1f} '
+                         'seconds'.format(predicted_makespan, totaltime))
+        return totaltime
+
+    def _fuse(self, tasks):
+        """Combine consecutive tasks which load the same model.
+
+        Tasks without a ``load`` command, and tasks which are already
+        processed or in the result cache, are not combined.
+        """
+        group, group_key = [], None
+        for task in tasks:
+            task._render_macro()
+            setup = _split_session_macro(task.macro)[0]
+            if (not setup or self._is_processed(task) or
+                    self._in_result_cache(task)):
+                yield task
+                continue
+            key = (os.path.abspath(task.folder), setup)
+            if group and (key != group_key or len(group) >= self.fuse_tasks):
+                yield self._fused(group, group_key[1])
+                group = []
+            group_key = key
+            group.append(task)
+        if group:
+            yield self._fused(group, group_key[1])
+
+    @staticmethod
+    def _fused(tasks, setup):
+        return tasks[0] if len(tasks) == 1 else _FusedTask(tasks, setup)
+
+    def _longest_first(self, tasklist, num_workers):
+        """Order the tasks by their expected run time, the longest first.
+
+        Tasks without a run time in the history are started first, and
+        tasks which are already processed last.
+
+        Returns
+        -------
+        tasks : generator
+            The tasks in the order they should be started.
+        predicted_makespan : float
+            The expected time to process all tasks, or None if no tasks
+            are in the history.
+
+        """
+        heap = []
+        for task in tasklist:
+            if self._is_processed(task):
+                expected = 0.0
+            else:
+                expected = self.runtime_history.predict(task.macro,
+                                                        task.folder)
+            # Unknown tasks first, ties in the order of the list
+            priority = -expected if expected is not None else float('-inf')
+            heap.append((priority, task.number, len(heap), task))
+        heapq.heapify(heap)
+        known = [-item[0] for item in heap if item[0] != float('-inf')]
+        predicted_makespan = None
+        if known:
+            # Unknown tasks are predicted as the average task
+            average = sum(known) / len(known)
+            durations = sorted(known, reverse=True)
+            durations[:0] = [average] * (len(heap) - len(known))
+            predicted_makespan = predict_makespan(durations, num_workers)
+
+        def tasks():
+            while heap:
+                yield heapq.heappop(heap)[-1]
+        return tasks(), predicted_makespan
+
+    def _process_tasks(self, tasks, _worker, num_workers):
+        """Process tasks on a pool of workers and yield them as they finish.
+
+        The tasks can be any iterable. It is consumed lazily, i.e. a new task
+        is only taken from the iterable when a worker becomes available.
+        With zero workers the tasks are processed in the calling thread.
+        """
+        # Reset the flag which stops the processes of this instance
+        self._processes.stop_all = False
+        # Iterate over the tasks instead of popping them from a list,
+        # so we don't mess with the callers list.
+        tasks = iter(tasks)
+        if self.executor is not None:
+            pool = self.executor
+            pool.start(self)
+            num_workers = pool.num_workers
+        else:
+            pool = _WorkerPool(_worker, num_workers)
         try:
-            # run while there is still threads, tasks or stuff in the queue
-            # to process
-            while threads or tasklist or task_queue.qsize():
-                # if we aren't using all the processors AND there is still
-                # data left to compute, then spawn another thread
-                if (len(threads) < self.num_processes) and tasklist:
-                    if use_threading:
-                        t = Thread(target=_worker,
-                                   args=tuple([tasklist.pop(0), task_queue]))
-                        t.daemon = True
-                        t.start()
-                        threads.append(t)
-                    else:
-                        _worker(tasklist.pop(0), task_queue)
-                else:
-                    # In the case that we have the maximum number
-                    # of running threads or we run out tasks.
-                    # Check if any of them are done
-                    for thread in threads:
-                        if not thread.isAlive():
-                            threads.remove(thread)
-                while task_queue.qsize():
-                    task = task_queue.get()
-                    if task.has_error:
-                        n_errors += 1
-                    self.summery.task_summery(task)
-                    processed_tasks.append(task)
-                    pbar.animate(len(processed_tasks), n_errors)
-
-                time.sleep(0.01)
+            # Keep every worker busy with one task. A new task is only
+            # submitted when a processed task is returned from the pool.
+            n_running = 0
+            n_errors = 0
+            stopped = False
+            for task in itertools.islice(tasks, max(num_workers, 1)):
+                pool.submit(task)
+                n_running += 1
+            while n_running:
+                task = pool.get()
+                n_running -= 1
+                if task.has_error and not stopped:
+                    # Every failed task of a fused task counts
+                    n_errors += max(sum(t.has_error for t in
+                                        getattr(task, 'tasks', [task])), 1)
+                    if self.max_errors is not None and n_errors >= self.max_errors:
+                        stopped = True
+                        if not self.silent:
+                            _display('Stopping after {:d} errors'.format(n_errors))
+                        # Kill the running processes. The tasks are still
+                        # returned from the pool.
+                        self._processes.stop_all = True
+                next_task = None if stopped else next(tasks, None)
+                if next_task is not None:
+                    pool.submit(next_task)
+                    n_running += 1
+                yield task
+                task._release_macro()
+            if stopped:
+                self._processes.stop_all = False
+        except GeneratorExit:
+            # The caller stopped early. Kill the running processes, so the
+            # workers finish their tasks.
+            self._processes.stop_all = True
+            raise
         except KeyboardInterrupt:
             _display('Processing interrupted')
-            _subprocess_container.stop_all = True
+            self._processes.stop_all = True
             # Add a small delay here. It allows the user to press ctrl-c twice
             # to escape this try-catch. This is usefull when if the code is
             # run in an outer loop which we want to excape as well.
             time.sleep(1)
-        totaltime = time.clock() - starttime
-        return totaltime
+        finally:
+            pool.close()
+            self._close_parse_pool()
+            self._close_sessions()
 
     def cleanup_logfiles(self, tasklist):
         for task in tasklist:
@@ -0,0 +1,258 @@
+# -*- coding: utf-8 -*-
+"""
+Asyncio support for running AnyBody console applications.
+
+The functions in this module are used by `AnyPyProcess.start_macro_async`
+and require Python 3.6 or newer.
+"""
+import io
+import os
+import ctypes
+import asyncio
+import itertools
+
+from .tools import silentremove
+from .abcutils import (_subprocess_container, _prepare_anybodycon, _monotonic,
+                       _write_timeout_message, _write_abort_message,
+                       _write_returncode_message, _thread_lock, _display,
+                       _unpack_parsed_output, _license_backoff,
+                       _NO_LICENSES_AVAILABLE, _TAIL_INTERVAL)
+
+
+async def execute_anybodycon_async(macro, logfile, anybodycon_path=None,
+                                   timeout=3600, keep_macrofile=False, env=None,
+                                   output_handler=None):
+    """Launch a single AnyBodyConsole applicaiton from a coroutine.
+
+    This is the asyncio version of `execute_anybodycon`. It takes the
+    same arguments except that `logfile` must be an open file.
+
+    Returns
+    -------
+    int
+        The return code from the AnyBody Console application.
+
+    """
+    return await _execute_anybodycon_async(
+        macro, logfile, anybodycon_path, timeout, keep_macrofile, env,
+        output_handler, _subprocess_container)
+
+
+async def _execute_anybodycon_async(macro, logfile, anybodycon_path, timeout,
+                                    keep_macrofile, env, output_handler,
+                                    processes):
+    """Launch the AnyBody console and record its pid in `processes`."""
+    anybodycmd, subprocess_flags, macro_filename = _prepare_anybodycon(
+        macro, logfile, anybodycon_path)
+    reader = None
+    if output_handler is not None:
+        # Use a separate file handle to read what AnyBody writes to the log
+        reader = io.open(logfile.name, 'r')
+    try:
+        proc = await asyncio.create_subprocess_exec(
+            *anybodycmd, stdout=logfile, stderr=logfile,
+            creationflags=subprocess_flags, env=env)
+        processes.add(proc.pid)
+        try:
+            finished = aborted = False
+            deadline = _monotonic() + timeout
+            while True:
+                remaining = deadline - _monotonic()
+                if remaining <= 0:
+                    break
+                if reader is not None:
+                    remaining = min(remaining, _TAIL_INTERVAL)
+                try:
+                    await asyncio.wait_for(proc.wait(), remaining)
+                    finished = True
+                    break
+                except asyncio.TimeoutError:
+                    pass
+                if reader is not None and output_handler(reader.read()):
+                    aborted = True
+                    break
+            returncode = proc.returncode
+            if not finished:
+                _terminate(proc)
+                await proc.wait()
+                if aborted:
+                    _write_abort_message(logfile)
+                else:
+                    _write_timeout_message(logfile, timeout)
+                returncode = 0
+        except asyncio.CancelledError:
+            _terminate(proc)
+            # Reap the process, so it is not left as a zombie
+            await proc.wait()
+            raise
+        finally:
+            processes.remove(proc.pid)
+        retcode = ctypes.c_int32(returncode).value
+        _write_returncode_message(logfile, retcode)
+        if reader is not None:
+            logfile.flush()
+            output_handler(reader.read())
+    finally:
+        if reader is not None:
+            reader.close()
+        if not keep_macrofile:
+            silentremove(macro_filename)
+    return retcode
+
+
+def _terminate(proc):
+    try:
+        proc.terminate()
+    except ProcessLookupError:
+        pass
+
+
+async def _acquire_license_slot(throttle):
+    """Wait until the license throttle allows a new process."""
+    while True:
+        epoch = throttle.try_acquire()
+        if epoch is not None:
+            return epoch
+        await asyncio.sleep(_TAIL_INTERVAL)
+
+
+async def _wait_for_license(app, retry):
+    """Wait before a task is retried. Returns False if stopped."""
+    deadline = _monotonic() + _license_backoff(retry)
+    while _monotonic() < deadline:
+        if app._processes.stop_all:
+            return False
+        await asyncio.sleep(min(0.1, max(deadline - _monotonic(), 0)))
+    return not app._processes.stop_all
+
+
+async def _run_task(app, task, logfile):
+    """Run the macro of a task once, like `AnyPyProcess._run_task`."""
+    parser, output_handler = app._create_parser()
+    throttle = app._license_throttle if app.license_retries else None
+    epoch = await _acquire_license_slot(throttle) if throttle else None
+    retcode = None
+    starttime = _monotonic()
+    try:
+        retcode = await _execute_anybodycon_async(
+            macro=task.macro,
+            logfile=logfile,
+            anybodycon_path=app.anybodycon_path,
+            timeout=app.timeout,
+            keep_macrofile=app.keep_logfiles,
+            env=app.env,
+            output_handler=output_handler,
+            processes=app._processes)
+    finally:
+        task.processtime = _monotonic() - starttime
+        if throttle:
+            throttle.release(epoch, retcode != _NO_LICENSES_AVAILABLE)
+    return retcode, parser
+
+
+def _discard_parsed_output(future):
+    """Free the shared memory of a parsed log file which is not used."""
+    if not future.cancelled() and future.exception() is None:
+        _unpack_parsed_output(*future.result())
+
+
+async def _read_task_output(app, task, retcode, logfile, parser):
+    """Parse the output of a task without blocking the event loop."""
+    if parser is not None or not app.parse_processes:
+        app._read_task_output(task, retcode, logfile, parser)
+        return
+    if app._failed_to_run(task, retcode):
+        return
+    future = app._parse_in_pool(logfile)
+    try:
+        parsed = await asyncio.wrap_future(future)
+    except asyncio.CancelledError:
+        # The result arrives later if the parsing had already started
+        future.add_done_callback(_discard_parsed_output)
+        raise
+    task.output = _unpack_parsed_output(*parsed)
+
+
+async def _process_task(app, task):
+    """Process a task in the same way as `AnyPyProcess._worker`."""
+    with _thread_lock:
+        task.process_number = app.counter
+        app.counter += 1
+    if app._is_processed(task):
+        return task
+    try:
+        task._render_macro()
+        if not os.path.exists(task.folder):
+            task.add_error('Could not find folder: {}'.format(task.folder))
+            task.logfile = ""
+        elif not app._load_cached_result(task):
+            with app._create_logfile(task) as logfile:
+                log_start = logfile.tell()
+                for retry in itertools.count():
+                    retcode, parser = await _run_task(app, task, logfile)
+                    if (retcode != _NO_LICENSES_AVAILABLE or
+                            retry >= app.license_retries or
+                            not await _wait_for_license(app, retry)):
+                        break
+                    # Only keep the log of the last try
+                    logfile.seek(log_start)
+                    logfile.truncate()
+                task.retcode = retcode
+                await _read_task_output(app, task, retcode, logfile, parser)
+            app._record_runtime(task)
+            app._store_cached_result(task)
+    except asyncio.CancelledError:
+        # CancelledError is an Exception before Python 3.8
+        raise
+    except Exception as e:
+        app._add_exception_error(task, e)
+    finally:
+        app._remove_task_logfile(task)
+    return task
+
+
+async def process_tasks_async(app, tasklist):
+    """Process tasks concurrently and yield their output as they finish.
+
+    At most `app.num_processes` consoles run at the same time. Like
+    `AnyPyProcess._process_tasks` the batch is stopped after
+    `app.max_errors` failed tasks. Any unfinished tasks are cancelled if
+    the generator is closed early.
+    """
+    semaphore = asyncio.Semaphore(max(app.num_processes, 1))
+    app._processes.stop_all = False
+    n_errors = 0
+
+    async def run(task):
+        nonlocal n_errors
+        async with semaphore:
+            if app._processes.stop_all:
+                # The batch was stopped before the task started
+                return None
+            await _process_task(app, task)
+            # Count the error before the next task can start
+            if task.has_error and not app._processes.stop_all:
+                n_errors += 1
+                if app.max_errors is not None and n_errors >= app.max_errors:
+                    if not app.silent:
+                        _display('Stopping after {:d} errors'.format(n_errors))
+                    # Kill the running processes of the instance
+                    app._processes.stop_all = True
+            return task
+
+    pending = [asyncio.ensure_future(run(task)) for task in tasklist]
+    try:
+        for future in asyncio.as_completed(pending):
+            task = await future
+            if task is not None:
+                yield task.get_output(include_task_info=app.return_task_info)
+                task._release_macro()
+    finally:
+        for future in pending:
+            future.cancel()
+        # Wait for the cancelled tasks to stop their consoles
+        await asyncio.gather(*pending, return_exceptions=True)
+        app._processes.stop_all = False
+        app._close_parse_pool()
+        app.cleanup_logfiles(tasklist)
+        app.cached_tasklist = tasklist
@@ -0,0 +1,368 @@
+# -*- coding: utf-8 -*-
+"""
+Run AnyBody console applications on several computers.
+
+A worker agent is started on every computer which should run AnyBody models::
+
+    python -m anypytools.distributed --host 0.0.0.0 --port 6000 --authkey secret
+
+By default the agent only listens on the local computer (127.0.0.1). Use
+``--host`` to accept connections from other computers.
+
+The agents are then used by passing a `RemoteExecutor` to `AnyPyProcess`:
+
+>>> executor = RemoteExecutor([('node1', 6000), ('node2', 6000)],
+...                           authkey='secret')
+>>> app = AnyPyProcess(executor=executor)
+>>> app.start_macro(macrolist)
+
+The model folders must be accessible with the same path on all computers,
+e.g. on a shared network drive. The same applies to the folder of a
+`ResultCache` used by the `AnyPyProcess`, since the agents look up and
+store the results in the cache.
+
+.. warning::
+
+    The agent and the executor exchange pickled objects, and unpickling
+    data can run arbitrary code. The authkey only checks that the other
+    side knows the key, and the connection is not encrypted. Only run
+    agents on trusted networks, and keep the authkey secret.
+
+"""
+from __future__ import (absolute_import, division,
+                        print_function, unicode_literals)
+from builtins import object
+
+import sys
+import logging
+import argparse
+from threading import Thread, Lock, BoundedSemaphore
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client, Listener
+try:
+    from queue import Queue, Empty
+except ImportError:
+    from Queue import Queue, Empty
+
+from .abcutils import AnyPyProcess, get_ncpu
+
+logger = logging.getLogger('abt.anypytools')
+
+# Seconds between checks for a request to stop the running tasks
+_POLL_INTERVAL = 0.1
+
+# The settings of AnyPyProcess which are forwarded to the worker agents.
+_APP_SETTINGS = ('timeout', 'ignore_errors', 'warnings_to_include',
+                 'keep_logfiles', 'abort_on_error', 'license_retries',
+                 'result_cache')
+
+
+def _as_authkey(authkey):
+    if authkey is None or isinstance(authkey, bytes):
+        return authkey
+    return authkey.encode('utf-8')
+
+
+def _connect(address, authkey):
+    """Connect to a worker agent and return the connection and its slots."""
+    conn = Client(tuple(address), authkey=authkey)
+    num_slots = conn.recv()['num_processes']
+    return conn, num_slots
+
+
+def _close_all(connections):
+    for conn in connections:
+        try:
+            conn.close()
+        except (IOError, OSError):
+            pass
+
+
+class RemoteExecutor(object):
+    """Executor which runs the tasks on worker agents on other computers.
+
+    The executor opens one connection to the agent for every model the
+    agent can run in parallel. If a connection is lost, e.g. because the
+    remote computer was shut down, the task which ran on it is rescheduled
+    on one of the remaining agents. When the `AnyPyProcess` stops its
+    processes, e.g. after `max_errors` failed tasks, the agents are asked to
+    stop the running AnyBody processes as well.
+
+    Parameters
+    ----------
+    addresses : list of tuples
+        List with the (host, port) addresses of the worker agents.
+    authkey : str or bytes
+        Secret key shared with the worker agents.
+
+    """
+
+    def __init__(self, addresses, authkey):
+        self.addresses = list(addresses)
+        self.authkey = _as_authkey(authkey)
+        self.num_workers = 0
+        self._threads = []
+
+    def start(self, app):
+        """Connect to the worker agents and send them the settings of `app`."""
+        settings = dict((name, getattr(app, name)) for name in _APP_SETTINGS)
+        settings['logfile_prefix'] = app.logfile_prefix
+        self._pending = Queue()
+        self._done = Queue()
+        self._lock = Lock()
+        self._processes = app._processes
+        self._closing = False
+        connections = []
+        try:
+            for address in self.addresses:
+                agent_connections = []
+                try:
+                    conn, num_slots = _connect(address, self.authkey)
+                    agent_connections.append(conn)
+                    for _ in range(num_slots - 1):
+                        agent_connections.append(
+                            _connect(address, self.authkey)[0])
+                except (IOError, OSError, EOFError) as e:
+                    logger.warning('Could not connect to worker agent '
+                                   '{}: {}'.format(address, e))
+                    _close_all(agent_connections)
+                    continue
+                connections.extend(agent_connections)
+        except BaseException:
+            _close_all(connections)
+            raise
+        if not connections:
+            raise IOError('Could not connect to any worker agents')
+        self._n_alive = len(connections)
+        self.num_workers = len(connections)
+        self._threads = []
+        for conn in connections:
+            t = Thread(target=self._run, args=(conn, settings))
+            t.daemon = True
+            t.start()
+            self._threads.append(t)
+
+    def _run(self, conn, settings):
+        task = lost_task = None
+        try:
+            conn.send(settings)
+            while True:
+                task = self._pending.get()
+                if task is None:
+                    return
+                if self._stopped():
+                    # Don't start new tasks after the batch was stopped
+                    task.processtime = 0
+                    task.add_error('Error: Stopped by AnyPyTools')
+                    self._done.put(task)
+                    task = None
+                    continue
+                conn.send(task)
+                result = self._receive(conn)
+                # Update the original task object, since the caller
+                # holds a reference to it.
+                task.__dict__.update(result.__dict__)
+                self._done.put(task)
+                task = None
+        except (IOError, OSError, EOFError) as e:
+            logger.warning('Lost connection to worker agent: {}'.format(e))
+            # Run the task on one of the remaining agents
+            lost_task, task = task, None
+        except Exception as e:
+            # E.g. a task or result which can not be pickled. The state of
+            # the connection is unknown, so it is not used any more.
+            logger.warning('Error in connection to worker agent: '
+                           '{!r}'.format(e))
+            if task is not None:
+                task.add_error('Error: Could not run the task on a worker '
+                               'agent: {!r}'.format(e))
+                self._done.put(task)
+                task = None
+        finally:
+            conn.close()
+            self._connection_closed(lost_task)
+
+    def _receive(self, conn):
+        """Wait for the result of a task, and pass on requests to stop."""
+        stop_sent = False
+        while not conn.poll(_POLL_INTERVAL):
+            if self._stopped() and not stop_sent:
+                # Ask the agent to stop the AnyBody process
+                conn.send(None)
+                stop_sent = True
+        return conn.recv()
+
+    def _stopped(self):
+        return self._closing or self._processes.stop_all
+
+    def _connection_closed(self, task):
+        """Reschedule `task` when a connection was closed."""
+        with self._lock:
+            self._n_alive -= 1
+            if task is not None:
+                self._pending.put(task)
+            if self._n_alive == 0:
+                self._fail_pending()
+
+    def _fail_pending(self):
+        while True:
+            try:
+                task = self._pending.get_nowait()
+            except Empty:
+                return
+            if task is not None:
+                self._fail(task)
+
+    def _fail(self, task):
+        task.add_error('Error: Lost connection to all worker agents')
+        self._done.put(task)
+
+    def submit(self, task):
+        """Queue a task for processing on the worker agents."""
+        with self._lock:
+            if self._n_alive == 0:
+                self._fail(task)
+            else:
+                self._pending.put(task)
+
+    def get(self):
+        """Block until a task is processed and return it."""
+        while True:
+            try:
+                return self._done.get(timeout=1)
+            except Empty:
+                continue
+
+    def close(self):
+        """Stop any running tasks on the agents and close the connections.
+
+        The results of tasks which are still running are no longer needed,
+        e.g. when the caller stopped iterating over the results.
+        """
+        self._closing = True
+        for _ in self._threads:
+            self._pending.put(None)
+        self._threads = []
+
+
+class WorkerAgent(object):
+    """Agent which runs AnyBody models for a `RemoteExecutor`.
+
+    Parameters
+    ----------
+    address : tuple
+        The (host, port) address to listen on. Use port 0 to
+        let the operating system pick a free port. Use host '0.0.0.0' to
+        accept connections from other computers. The agent unpickles the
+        tasks it receives, so it must only be reachable from trusted
+        computers.
+    authkey : str or bytes
+        Secret key shared with the `RemoteExecutor`.
+    anybodycon_path : str, optional
+        Path to the AnyBody console application on this computer.
+    num_processes : int, optional
+        Number of models to run in parallel on this computer.
+
+    """
+
+    def __init__(self, address, authkey, anybodycon_path=None,
+                 num_processes=get_ncpu()):
+        self.anybodycon_path = anybodycon_path
+        self.num_processes = num_processes
+        self._slots = BoundedSemaphore(num_processes)
+        self._listener = Listener(tuple(address),
+                                  authkey=_as_authkey(authkey))
+
+    @property
+    def address(self):
+        """The address the agent listens on."""
+        return self._listener.address
+
+    def serve_forever(self):
+        """Accept connections from executors until the agent is closed."""
+        while True:
+            try:
+                conn = self._listener.accept()
+            except (IOError, OSError, EOFError, AuthenticationError) as e:
+                if self._listener is None:
+                    return
+                logger.warning('Rejected connection: {}'.format(e))
+                continue
+            t = Thread(target=self._serve_connection, args=(conn,))
+            t.daemon = True
+            t.start()
+
+    def close(self):
+        listener, self._listener = self._listener, None
+        listener.close()
+
+    def _serve_connection(self, conn):
+        try:
+            conn.send({'num_processes': self.num_processes})
+            settings = conn.recv()
+            logfile_prefix = settings.pop('logfile_prefix')
+            app = AnyPyProcess(num_processes=1,
+                               anybodycon_path=self.anybodycon_path,
+                               silent=True, **settings)
+            app.logfile_prefix = logfile_prefix
+            while True:
+                task = conn.recv()
+                if task is None:
+                    # A request to stop a task which has already finished
+                    continue
+                with self._slots:
+                    result = self._run_task(app, task, conn)
+                conn.send(result)
+        except (IOError, OSError, EOFError):
+            pass
+        finally:
+            conn.close()
+
+
+    @staticmethod
+    def _run_task(app, task, conn):
+        """Run a task, and stop it if the executor sends None."""
+        app._processes.stop_all = False
+        results = Queue()
+        worker = Thread(target=app._worker, args=(task, results))
+        worker.daemon = True
+        worker.start()
+        try:
+            while True:
+                try:
+                    return results.get(timeout=_POLL_INTERVAL)
+                except Empty:
+                    pass
+                if conn.poll() and conn.recv() is None:
+                    app._processes.stop_all = True
+        except (IOError, OSError, EOFError):
+            # The executor is gone, so the result is not needed
+            app._processes.stop_all = True
+            raise
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Worker agent which runs AnyBody models for AnyPyTools')
+    parser.add_argument('--host', default='127.0.0.1',
+                        help='Address to listen on. Use 0.0.0.0 to accept '
+                        'connections from other computers (only on trusted '
+                        'networks, since the agent unpickles the tasks)')
+    parser.add_argument('--port', type=int, default=6000)
+    parser.add_argument('--authkey', required=True)
+    parser.add_argument('--anybodycon', default=None,
+                        help='Path to the AnyBody console application')
+    parser.add_argument('--num-processes', type=int, default=get_ncpu())
+    args = parser.parse_args(argv)
+    agent = WorkerAgent((args.host, args.port), args.authkey,
+                        anybodycon_path=args.anybodycon,
+                        num_processes=args.num_processes)
+    print('Worker agent listening on {}:{}'.format(*agent.address))
+    try:
+        agent.serve_forever()
+    except KeyboardInterrupt:
+        agent.close()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
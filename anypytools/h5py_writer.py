@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+"""
+Write the results of AnyBody simulations to HDF5 files while they run.
+
+The `HDF5Writer` appends the output of each task to the file when the task
+finishes, so the results of a large study never have to fit in memory, and
+the finished results are kept if the study is interrupted.
+
+>>> with HDF5Writer('study.h5', group='batch1') as writer:
+...     for output in app.imap_macro(macros):
+...         writer.write(output)
+
+The file has the following layout for each group::
+
+    /batch1/task_index              Table with a row for each task.
+    /batch1/variables/<key>/values  The values of a variable from all tasks
+                                    concatenated along the first axis.
+    /batch1/variables/<key>/spans   Rows of (task row, start, stop), i.e.
+                                    the values from the task in row `i` of
+                                    the task index are
+                                    ``values[start:stop]``.
+
+Booleans, integers and floats are stored as 64 bit numbers of the same
+kind, and all other values as strings. Scalar values take up a single row
+in the values dataset. The values of a variable must have the same shape,
+apart from the first axis, and the same kind in all tasks.
+
+"""
+from __future__ import (absolute_import, division,
+                        print_function, unicode_literals)
+from builtins import (ascii, bytes, chr, dict, filter, hex, input,  # noqa
+                      int, map, next, oct, open, pow, range, round,
+                      str, super, zip)
+
+import logging
+
+import numpy as np
+import h5py
+from future.utils import text_to_native_str
+
+logger = logging.getLogger('abt.anypytools')
+
+_STRING_DTYPE = h5py.special_dtype(vlen=str)
+# Maximum number of values in a chunk
+_MAX_CHUNK_SIZE = 2 ** 17
+# The stored type of numbers of each dtype kind
+_NUMBER_DTYPES = {
+    'b': np.dtype(np.bool_),
+    'i': np.dtype(np.int64),
+    'u': np.dtype(np.uint64),
+    'f': np.dtype(np.float64),
+}
+
+TASK_INDEX_DTYPE = np.dtype([
+    (text_to_native_str('task_id'), np.int64),
+    (text_to_native_str('task_name'), _STRING_DTYPE),
+    (text_to_native_str('task_work_dir'), _STRING_DTYPE),
+    (text_to_native_str('task_processtime'), np.float64),
+    (text_to_native_str('has_error'), np.bool_),
+])
+
+
+def _as_rows(value):
+    """Convert a value to an array, where the first axis are the rows."""
+    try:
+        arr = np.asarray(value)
+    except ValueError:
+        # Ragged nested lists
+        arr = np.asarray(str(value), dtype=object)
+    if arr.dtype.kind in _NUMBER_DTYPES:
+        arr = arr.astype(_NUMBER_DTYPES[arr.dtype.kind])
+    else:
+        strings = np.empty(arr.shape, dtype=object)
+        strings.flat[:] = [str(v) for v in arr.flat]
+        arr = strings
+    if arr.ndim == 0:
+        arr = arr.reshape(1)
+    return arr
+
+
+class HDF5Writer(object):
+    """Append the output of AnyPyProcess tasks to an HDF5 file.
+
+    Parameters
+    ----------
+    filename : str
+        The HDF5 file. It is created if it does not exist. Existing data
+        in the file is kept, and new results are appended to the group.
+    group : str, optional
+        Name of the group in the HDF5 file where the results are stored.
+        (Defaults to 'results')
+    compression : str, optional
+        Compression filter for the datasets. (Defaults to 'gzip')
+    chunk_rows : int, optional
+        Number of rows in each chunk of the datasets. (Defaults to 1024)
+
+    """
+
+    def __init__(self, filename, group='results', compression='gzip',
+                 chunk_rows=1024):
+        self.compression = compression
+        self.chunk_rows = chunk_rows
+        self._file = h5py.File(text_to_native_str(filename), 'a')
+        self._group = self._file.require_group(text_to_native_str(group))
+        if 'task_index' in self._group:
+            self._task_index = self._group['task_index']
+        else:
+            self._task_index = self._group.create_dataset(
+                'task_index', shape=(0,), maxshape=(None,),
+                dtype=TASK_INDEX_DTYPE, chunks=(chunk_rows,),
+                compression=compression)
+        self._variables = self._group.require_group('variables')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self):
+        return len(self._task_index)
+
+    def write(self, output):
+        """Append the output of a single task to the file.
+
+        Parameters
+        ----------
+        output : AnyPyProcessOutput
+            Output of a task, e.g. from `AnyPyProcess.imap_macro`.
+
+        Returns
+        -------
+        int
+            The row of the task in the task index table.
+
+        Raises
+        ------
+        ValueError
+            If the shape or type of a value does not match the values of
+            the variable from earlier tasks. Nothing is written then.
+
+        """
+        variables = [(key, _as_rows(value)) for key, value in output.items()
+                     if key not in ('task_id', 'task_name', 'task_work_dir',
+                                    'task_processtime')]
+        for key, rows in variables:
+            self._check_variable(key, rows)
+        row = len(self._task_index)
+        entry = np.zeros(1, dtype=TASK_INDEX_DTYPE)
+        entry['task_id'] = output.get('task_id', row)
+        entry['task_name'] = str(output.get('task_name', ''))
+        entry['task_work_dir'] = str(output.get('task_work_dir', ''))
+        entry['task_processtime'] = output.get('task_processtime', 0)
+        entry['has_error'] = 'ERROR' in output
+        self._task_index.resize((row + 1,))
+        self._task_index[row] = entry[0]
+        for key, rows in variables:
+            self._append_variable(key, row, rows)
+        # Make sure finished results are on disk if the study is stopped.
+        self._file.flush()
+        return row
+
+    @staticmethod
+    def _variable_name(key):
+        return text_to_native_str(key.replace('/', '|'))
+
+    def _check_variable(self, key, rows):
+        """Raise ValueError if `rows` can not be appended to the variable."""
+        name = self._variable_name(key)
+        if name not in self._variables:
+            return
+        values = self._variables[name]['values']
+        if rows.shape[1:] != values.shape[1:]:
+            raise ValueError(
+                'The value of {} has shape {}, but the values from earlier '
+                'tasks have rows of shape {}'.format(
+                    key, rows.shape, values.shape[1:]))
+        if values.dtype.kind in _NUMBER_DTYPES:
+            compatible = (rows.dtype.kind in _NUMBER_DTYPES and
+                          np.can_cast(rows.dtype, values.dtype))
+        else:
+            compatible = rows.dtype.kind not in _NUMBER_DTYPES
+        if not compatible:
+            raise ValueError(
+                'The value of {} is {}, which can not be stored with the '
+                '{} values from earlier tasks'.format(
+                    key, rows.dtype, values.dtype))
+
+    def _append_variable(self, key, row, rows):
+        name = self._variable_name(key)
+        if name not in self._variables:
+            self._create_variable(name, rows)
+        var = self._variables[name]
+        values, spans = var['values'], var['spans']
+        start = len(values)
+        stop = start + len(rows)
+        values.resize((stop,) + values.shape[1:])
+        values[start:stop] = rows
+        n_spans = len(spans)
+        spans.resize((n_spans + 1, 3))
+        spans[n_spans] = (row, start, stop)
+
+    def _create_variable(self, name, rows):
+        var = self._variables.create_group(name)
+        dtype = _NUMBER_DTYPES.get(rows.dtype.kind, _STRING_DTYPE)
+        row_shape = rows.shape[1:]
+        # Keep the chunks below 1 MB for variables with wide rows
+        row_size = max(int(np.prod(row_shape)), 1)
+        chunk_rows = max(1, min(self.chunk_rows, _MAX_CHUNK_SIZE // row_size))
+        var.create_dataset(
+            'values', shape=(0,) + row_shape,
+            maxshape=(None,) + row_shape, dtype=dtype,
+            chunks=(chunk_rows,) + tuple(max(d, 1) for d in row_shape),
+            compression=self.compression)
+        var.create_dataset(
+            'spans', shape=(0, 3), maxshape=(None, 3), dtype=np.int64,
+            chunks=(self.chunk_rows, 3), compression=self.compression)
+
+    def close(self):
+        """Close the HDF5 file."""
+        self._file.close()
@@ -14,11 +14,15 @@ from builtins import (ascii, bytes, chr, dict, filter, hex, input,  # noqa
 import sys
 import types
 import logging
+import itertools
+from abc import ABCMeta, abstractmethod
 from copy import deepcopy
-from collections import MutableSequence
+from threading import Lock
+from collections import MutableSequence, Sequence
 
 import numpy as np
 from scipy.stats import distributions
+from future.utils import with_metaclass
 
 
 def is_python2():
@@ -59,10 +63,434 @@ def _isgenerator(x):
     return isinstance(x, types.GeneratorType)
 
 
+# Number of macros which are sampled together by the lazy macro sequences
+_CHUNK_SIZE = 1024
+# Commands which repeat at most this number of macros are rendered once
+# when a macro sequence is compiled.
+_MAX_PERIOD = 4096
+# Kinds of segments in a compiled macro sequence
+_CONSTANT, _COUNTER, _CYCLE, _COMMAND = range(4)
+
+
+def _new_seed():
+    """Return fresh entropy for seeding random generators."""
+    try:
+        return np.random.SeedSequence().entropy
+    except AttributeError:  # numpy < 1.17
+        return np.random.randint(2 ** 31)
+
+
+def _chunk_rng(seed, chunk):
+    """Return the random generator for a chunk of samples.
+
+    Every chunk gets an independent stream derived from `seed`, so the
+    samples of any macro can be drawn without drawing the macros before it.
+    The first chunk uses the generator seeded with `seed` itself, so small
+    studies get the same samples as when all samples were drawn at once.
+    """
+    if chunk == 0:
+        try:
+            return np.random.default_rng(seed)
+        except AttributeError:  # numpy < 1.17
+            return np.random.RandomState(seed)
+    try:
+        seed_sequence = np.random.SeedSequence(seed, spawn_key=(chunk,))
+    except AttributeError:  # numpy < 1.17
+        return np.random.RandomState(
+            np.append(np.atleast_1d(seed), chunk) % 2 ** 32)
+    return np.random.default_rng(seed_sequence)
+
+
+def _uniform(random_state, size):
+    """Draw uniform samples in [0, 1) from a Generator or RandomState."""
+    try:
+        return random_state.random(size)
+    except AttributeError:
+        return random_state.random_sample(size)
+
+
 def _batch(iterable, n=1):
-    l = len(iterable)
-    for ndx in range(0, l, n):
-        yield iterable[ndx:min(ndx + n, l)]
+    iterator = iter(iterable)
+    while True:
+        batch = list(itertools.islice(iterator, n))
+        if not batch:
+            return
+        yield batch
+
+
+def _sampled_macros(commands, samples, random_state=None):
+    """Create the `SetValue_random` commands for a matrix of samples.
+
+    Each row of `samples` holds the lower tail probabilities for all
+    `SetValue_random` commands of one macro. Returns a dictionary which
+    maps the position of each command to the list of its macros.
+    """
+    sampled_macros = {}
+    col = 0
+    for elem_idx, elem in enumerate(commands):
+        if isinstance(elem, SetValue_random):
+            values = elem.sample(samples[:, col:col + elem.n_factors],
+                                 random_state)
+            col += elem.n_factors
+            sampled_macros[elem_idx] = [elem._format_macro(val)
+                                        for val in values]
+    return sampled_macros
+
+
+def _parameter_key(value):
+    """Return a hashable key of the parameter of a command or sampler."""
+    if isinstance(value, np.ndarray):
+        return (value.dtype.str, value.shape, value.tobytes())
+    if isinstance(value, distributions.rv_frozen):
+        return (value.dist.name, _parameter_key(value.args),
+                _parameter_key(value.kwds))
+    if isinstance(value, dict):
+        return tuple(sorted((k, _parameter_key(v)) for k, v in value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(_parameter_key(v) for v in value)
+    return repr(value)
+
+
+def _split_macro(mcr):
+    """Split the output of a macro command into lines."""
+    if len(mcr) > 0:
+        return mcr.split('\n')
+    return []
+
+
+def _macro_period(command):
+    """Return how often the macro of a command repeats, or None if unknown.
+
+    A period of ``p`` means that the command creates the same macro for
+    index ``i`` and ``i % p``.
+    """
+    # Trust the period only if it is defined together with, or below, the
+    # get_macro method. Subclasses outside this module which override
+    # get_macro may create a new macro for every index. The commands of this
+    # module inherit the period of MacroCommand unless they override it.
+    for cls in type(command).__mro__:
+        if '_period' in vars(cls):
+            return command._period()
+        if 'get_macro' in vars(cls) and cls.__module__ != __name__:
+            return None
+    return None
+
+
+class _ChunkedSampler(with_metaclass(ABCMeta, object)):
+    """Sample the `SetValue_random` commands in chunks of macros.
+
+    Calling the sampler with a macro index returns a dictionary with the
+    sampled macro of each `SetValue_random` command, or an empty dictionary
+    for macros with default values. The chunks are sampled with a single
+    call to the distributions, and the last few chunks are kept.
+    """
+
+    def __init__(self, commands, number_of_samples, first_sample=0):
+        self.commands = commands
+        self.number_of_samples = number_of_samples
+        self.first_sample = first_sample
+        self.n_factors = sum([e.n_factors for e in commands
+                              if isinstance(e, SetValue_random)])
+        self._chunks = {}
+
+    @abstractmethod
+    def _samples(self, chunk, rows):
+        """Return the lower tail probabilities and random state of a chunk.
+
+        Parameters
+        ----------
+        chunk : int
+            The number of the chunk. The chunk holds the samples from
+            ``chunk * _CHUNK_SIZE`` and onwards.
+        rows : int
+            The number of samples in the chunk. It is only smaller than
+            `_CHUNK_SIZE` for the last chunk.
+
+        Returns
+        -------
+        samples : ndarray
+            Array of shape ``(rows, n_factors)`` with the lower tail
+            probabilities of the `SetValue_random` commands.
+        random_state : numpy.random.Generator or None
+            The random generator used for the samples, which is passed on to
+            `SetValue_random.sample`.
+
+        """
+
+    @abstractmethod
+    def _key(self):
+        """Return a hashable key of the parameters which define the samples."""
+
+    def __call__(self, index):
+        sample_idx = index - self.first_sample
+        if not 0 <= sample_idx < self.number_of_samples:
+            return {}
+        chunk, row = divmod(sample_idx, _CHUNK_SIZE)
+        if chunk not in self._chunks:
+            rows = min(_CHUNK_SIZE, self.number_of_samples - chunk * _CHUNK_SIZE)
+            samples, random_state = self._samples(chunk, rows)
+            if len(self._chunks) >= 2:
+                self._chunks.clear()
+            self._chunks[chunk] = _sampled_macros(self.commands, samples,
+                                                  random_state)
+        sampled_macros = self._chunks[chunk]
+        return dict((k, v[row]) for k, v in sampled_macros.items())
+
+
+class _MonteCarloSampler(_ChunkedSampler):
+    """Random samples for all macros after the first macro."""
+
+    def __init__(self, commands, number_of_macros, seed=None):
+        super(_MonteCarloSampler, self).__init__(
+            commands, max(number_of_macros - 1, 0), first_sample=1)
+        self.seed = _new_seed() if seed is None else seed
+
+    def _samples(self, chunk, rows):
+        random_state = _chunk_rng(self.seed, chunk)
+        return _uniform(random_state, (rows, self.n_factors)), random_state
+
+    def _key(self):
+        return ('MonteCarlo', self.number_of_samples, _parameter_key(self.seed))
+
+
+class _MatrixSampler(_ChunkedSampler):
+    """Samples from the rows of a matrix, e.g. from a LHS design."""
+
+    def __init__(self, commands, matrix):
+        super(_MatrixSampler, self).__init__(commands, len(matrix))
+        self.matrix = matrix
+
+    def _samples(self, chunk, rows):
+        start = chunk * _CHUNK_SIZE
+        return self.matrix[start:start + rows], None
+
+    def _key(self):
+        return ('Matrix', _parameter_key(np.asarray(self.matrix)))
+
+
+class _QMCSampler(_ChunkedSampler):
+    """Samples from a quasi-random sequence of scipy.stats.qmc."""
+
+    def __init__(self, commands, number_of_macros, engine, scramble=True,
+                 seed=None):
+        super(_QMCSampler, self).__init__(commands, number_of_macros)
+        self.engine = engine
+        self.scramble = scramble
+        self.seed = _new_seed() if seed is None else seed
+
+    def _samples(self, chunk, rows):
+        # A new engine is forwarded to the chunk, so the chunks can be
+        # drawn in any order. Whole chunks are drawn, since the balance of
+        # Sobol sequences requires a power of 2 points.
+        engine = self.engine(self.n_factors, scramble=self.scramble,
+                             seed=np.random.default_rng(self.seed))
+        if chunk > 0:
+            engine.fast_forward(chunk * _CHUNK_SIZE)
+        return engine.random(_CHUNK_SIZE)[:rows], None
+
+    def _key(self):
+        return ('QMC', self.engine.__name__, self.scramble,
+                self.number_of_samples, _parameter_key(self.seed))
+
+
+def _is_factor(command):
+    """Return True for `SetValue` commands with a list of values."""
+    return (isinstance(command, SetValue) and
+            not isinstance(command, SetValue_random) and
+            isinstance(command.value, list))
+
+
+class _FactorialSampler(object):
+    """Select the values of the `SetValue` commands in a full factorial design.
+
+    The last command varies fastest, like in ``itertools.product``.
+    """
+
+    def __init__(self, commands):
+        self.factors = []
+        self.number_of_macros = 1
+        for elem_idx, elem in enumerate(commands):
+            if _is_factor(elem):
+                macros = [elem.get_macro(i) for i in range(len(elem.value))]
+                self.factors.append((elem_idx, macros))
+                self.number_of_macros *= len(macros)
+
+    def _key(self):
+        return ('Factorial', _parameter_key(self.factors))
+
+    def __call__(self, index):
+        sampled = {}
+        for elem_idx, macros in reversed(self.factors):
+            index, value_idx = divmod(index, len(macros))
+            sampled[elem_idx] = macros[value_idx]
+        return sampled
+
+
+class MacroSequence(Sequence):
+    """Read-only sequence of macros, which are created when they are used.
+
+    The sequence is returned by the ``create_macros*`` methods of `AnyMacro`
+    with ``lazy=True``. Macros are rendered when they are indexed or
+    iterated, so the memory use does not depend on the number of macros.
+    Rendering the same index twice returns the same macro.
+
+    The commands are compiled when the sequence is created: Commands which
+    create the same macro for every index, e.g. `Load` and `OperationRun`,
+    are rendered once and joined in constant segments, and so are commands
+    which repeat a list of values. Creating a macro then only fills in the
+    counter token, the random samples and the commands which depend on the
+    index in other ways.
+
+    Examples
+    --------
+    >>> mg = AnyMacro(Load('model.main.any'), number_of_macros=10**6)
+    >>> macros = mg.create_macros(lazy=True)
+    >>> len(macros)
+    1000000
+    >>> macros[123456]
+    ['load "model.main.any"']
+
+    """
+
+    def __init__(self, commands, number_of_macros, counter_token=None,
+                 sampler=None):
+        self._commands = list(commands)
+        self._number_of_macros = number_of_macros
+        self._counter_token = counter_token
+        self._sampler = sampler
+        self._lock = Lock()
+        self._segments = self._compile()
+
+    def _compile(self):
+        """Split the commands into constant segments and variable slots.
+
+        Returns a list of ``(kind, elem_idx, data)`` tuples, where `data` is
+        the lines of a constant segment, the lines split at the counter
+        token, or the lines of each macro of a repeating command.
+        """
+        token = self._counter_token
+        segments = []
+        constant = []
+
+        def close_constant():
+            if not constant:
+                return
+            if token and any(token in line for line in constant):
+                parts = [line.split(token) for line in constant]
+                segments.append((_COUNTER, None, parts))
+            else:
+                segments.append((_CONSTANT, None, list(constant)))
+            del constant[:]
+
+        for elem_idx, elem in enumerate(self._commands):
+            period = _macro_period(elem)
+            # Sampled commands must stay slots, so the samples can be filled in
+            sampled = (self._sampler is not None and
+                       isinstance(elem, SetValue_random))
+            if period == 1 and not sampled:
+                constant.extend(_split_macro(elem.get_macro(0)))
+                continue
+            close_constant()
+            if period is not None:
+                # Only the macros of the sequence are rendered up front
+                period = min(period, max(self._number_of_macros, 1))
+            if period is not None and period <= _MAX_PERIOD:
+                cycle = [_split_macro(elem.get_macro(i)) for i in range(period)]
+                segments.append((_CYCLE, elem_idx, cycle))
+            else:
+                segments.append((_COMMAND, elem_idx, elem))
+        close_constant()
+        return segments
+
+    def __len__(self):
+        return self._number_of_macros
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('macro index out of range')
+        return self._render(index)
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self._render(index)
+
+    def __repr__(self):
+        return '<MacroSequence with {} macros>'.format(len(self))
+
+    def _key(self):
+        """Return a hashable key of the parameters which define the macros.
+
+        The constant segments are already rendered. The other commands and
+        the sampler are represented by their parameters, so the macros are
+        not rendered.
+        """
+        segments = []
+        for kind, elem_idx, data in self._segments:
+            if kind == _COMMAND:
+                data = (type(data).__name__, _parameter_key(vars(data)))
+            else:
+                data = _parameter_key(data)
+            segments.append((kind, elem_idx, data))
+        sampler = None if self._sampler is None else self._sampler._key()
+        return (len(self), self._counter_token, tuple(segments), sampler)
+
+    def __eq__(self, other):
+        if isinstance(other, MacroSequence):
+            return self._key() == other._key()
+        if not isinstance(other, list):
+            return NotImplemented
+        return (len(self) == len(other) and
+                all(a == b for a, b in zip(self, other)))
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        return equal if equal is NotImplemented else not equal
+
+    def __hash__(self):
+        # Hash the parameters, so AnyPyProcess recognizes a rerun of the
+        # same macros without rendering them all.
+        return hash(self._key())
+
+    def _render(self, index):
+        sampled = {}
+        if self._sampler is not None:
+            # Macros may be rendered from several worker threads
+            with self._lock:
+                sampled = self._sampler(index)
+        token = self._counter_token
+        counter = str(index)
+        macro = []
+        for kind, elem_idx, data in self._segments:
+            if kind == _CONSTANT:
+                macro.extend(data)
+                continue
+            if kind == _COUNTER:
+                macro.extend([counter.join(parts) for parts in data])
+                continue
+            mcr = sampled.get(elem_idx)
+            if mcr is not None:
+                lines = _split_macro(mcr)
+            elif kind == _CYCLE:
+                lines = data[index % len(data)]
+            else:
+                lines = _split_macro(data.get_macro(index))
+            if token:
+                lines = [line.replace(token, counter) for line in lines]
+            macro.extend(lines)
+        return macro
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = Lock()
 
 
 class MacroCommand(object):
@@ -105,6 +533,10 @@ class MacroCommand(object):
         """
         return '\n'.join(self.cmd)
 
+    def _period(self):
+        """Return the number of macros after which the command repeats."""
+        return 1
+
 
 class Load(MacroCommand):
     """Create a load macro command.
@@ -239,6 +671,11 @@ class SetValue(MacroCommand):
             val = self.value
         return self._format_macro(val)
 
+    def _period(self):
+        if isinstance(self.value, list):
+            return len(self.value)
+        return 1
+
     def _format_macro(self, val):
         if isinstance(val, np.ndarray):
             val = array2anyscript(val)
@@ -271,30 +708,29 @@ class SetValue_random(SetValue):
     Creating normal macros will use the default values. Usually the 50 percentile
     (mean values).
 
-    >>> np.random.seed(1)
     >>> from scipy.stats.distributions import logistic, norm
     >>> log_dist = logistic( loc= [1,3,4],scale = [0.1,0.5,1] )
     >>> norm_dist = norm( loc= [0,0,0],scale = [0.1,0.5,1] )
     >>> cmd = [SetValue_random('Main.MyVar1', log_dist), SetValue_random('Main.MyVar2', norm_dist) ]
-    >>> mg = AnyMacro(cmd, number_of_macros = 3)
+    >>> mg = AnyMacro(cmd, number_of_macros = 3, seed=1)
     >>> mg
-    [['classoperation Main.MyVar1 "Set Value" --value="{0,0,0}"',
-      'classoperation Main.MyVar2 "Set Value" --value="{1,3,4}"'],
-     ['classoperation Main.MyVar1 "Set Value" --value="{0,0,0}"',
-      'classoperation Main.MyVar2 "Set Value" --value="{1,3,4}"'],
-     ['classoperation Main.MyVar1 "Set Value" --value="{0,0,0}"',
-      'classoperation Main.MyVar2 "Set Value" --value="{1,3,4}"']]
+    [['classoperation Main.MyVar1 "Set Value" --value="{1,3,4}"',
+      'classoperation Main.MyVar2 "Set Value" --value="{0,0,0}"'],
+     ['classoperation Main.MyVar1 "Set Value" --value="{1,3,4}"',
+      'classoperation Main.MyVar2 "Set Value" --value="{0,0,0}"'],
+     ['classoperation Main.MyVar1 "Set Value" --value="{1,3,4}"',
+      'classoperation Main.MyVar2 "Set Value" --value="{0,0,0}"']]
 
     Values can be sampled randomly in a 'Monte Carlo' fashion. Note that the
     first value is still the defaut mean values
 
     >>> mg.create_macros_MonteCarlo()
-    [['classoperation Main.MyVar1 "Set Value" --value="{0,0,0}"',
-      'classoperation Main.MyVar2 "Set Value" --value="{1,3,4}"'],
-     ['classoperation Main.MyVar1 "Set Value" --value="{-0.0209517840916,0.291902872134,-3.68494766954}"',
-      'classoperation Main.MyVar2 "Set Value" --value="{0.916378512121,2.11986245798,1.71459079162}"'],
-     ['classoperation Main.MyVar1 "Set Value" --value="{-0.0891762169545,-0.198666812922,-0.261723075945}"',
-      'classoperation Main.MyVar2 "Set Value" --value="{1.01555799978,2.83695956934,4.7778636562}"']]
+    [['classoperation Main.MyVar1 "Set Value" --value="{1,3,4}"',
+      'classoperation Main.MyVar2 "Set Value" --value="{0,0,0}"'],
+     ['classoperation Main.MyVar1 "Set Value" --value="{1.00472953129,4.47712207929,2.2188372121}"',
+      'classoperation Main.MyVar2 "Set Value" --value="{0.163189738163,-0.245332854156,-0.193390828129}"'],
+     ['classoperation Main.MyVar1 "Set Value" --value="{1.15694318143,2.81636145554,4.19902916387}"',
+      'classoperation Main.MyVar2 "Set Value" --value="{-0.191794309929,0.342793340615,0.0957572465625}"']]
 
     Values can also be sampled with a Latin Hyper Cube sampler.
 
@@ -334,16 +770,46 @@ class SetValue_random(SetValue):
     def get_macro(self, index, lower_tail_probability=None, **kwarg):
         if lower_tail_probability is None:
             lower_tail_probability = self.default_lower_tail_probability
+        lower_tail_probability = np.reshape(lower_tail_probability, (1, -1))
+        val = self.sample(lower_tail_probability)[0]
+        return self._format_macro(val)
 
-        if self.shape is None and isinstance(lower_tail_probability, np.ndarray):
-            lower_tail_probability = lower_tail_probability[0]
+    def _period(self):
+        # Without samples, the macro has the default value
+        return 1
 
-        val = self.rv.ppf(lower_tail_probability).reshape(self.shape)
-        # Replace any nan from ppf function with actual sampled values.
-        if np.any(np.isnan(val)):
-            val[np.isnan(val)] = self.rv.rvs()[np.isnan(val)]
+    def sample(self, lower_tail_probability, random_state=None):
+        """Return the values for a matrix of lower tail probabilities.
+
+        Parameters
+        ----------
+        lower_tail_probability : ndarray
+            Array of shape (n, n_factors), where each row holds the lower
+            tail probabilities of one sample. All rows are passed to the
+            `ppf` function of the distribution in a single call.
+        random_state : numpy.random.Generator, optional
+            Used to sample values where the `ppf` function returns nan.
 
-        return self.format_macro(val)
+        Returns
+        -------
+        ndarray
+            Array with `n` samples of the variable.
+
+        """
+        lower_tail_probability = np.asarray(lower_tail_probability, dtype=float)
+        n_samples = lower_tail_probability.shape[0]
+        if self.shape is None:
+            lower_tail_probability = lower_tail_probability[:, 0]
+        else:
+            lower_tail_probability = lower_tail_probability.reshape(
+                (n_samples,) + self.shape)
+        val = np.array(self.rv.ppf(lower_tail_probability), dtype=float)
+        # Replace any nan from ppf function with actual sampled values.
+        nans = np.isnan(val)
+        if np.any(nans):
+            rvs = self.rv.rvs(size=val.shape, random_state=random_state)
+            val[nans] = np.asarray(rvs)[nans]
+        return val
 
 
 class Dump(MacroCommand):
@@ -391,6 +857,11 @@ class Dump(MacroCommand):
                 cmd.append('classoperation {0} "Dump"'.format(var))
         return '\n'.join(cmd)
 
+    def _period(self):
+        if self._include_in_macro is None:
+            return 1
+        return None
+
 
 class SaveDesign(MacroCommand):
     """Create a Save Design classoperation macro command.
@@ -674,7 +1145,7 @@ class AnyMacro(MutableSequence):
         list_idx = len(self._list)
         self.insert(list_idx, val)
 
-    def create_macros(self, number_of_macros=None, batch_size=None):
+    def create_macros(self, number_of_macros=None, batch_size=None, lazy=False):
         """Generate a given number of macros.
 
         The function return its output either as list (batch_size = None) or in batches
@@ -687,11 +1158,16 @@ class AnyMacro(MutableSequence):
         batch_size : int (Optional)
             If specified the function will return a generator which creates macros in
             batches.
+        lazy : bool (Optional)
+            If True a `MacroSequence` is returned, which creates each macro when
+            it is indexed or iterated. Use this for studies with too many macros
+            to keep in memory.
 
         Returns
         -------
-        list or generator
-            A list macros or a generator which creates macros in batches
+        list, generator or MacroSequence
+            A list macros, a generator which creates macros in batches or
+            a lazy sequence of macros.
 
         Examples
         --------
@@ -725,26 +1201,21 @@ class AnyMacro(MutableSequence):
         [['load "c:/Model.main.any"'], ['load "c:/Model.main.any"']]
 
         """
-        if batch_size is not None:
-            return _batch(self.create_macros(number_of_macros), n=batch_size)
-
         if number_of_macros is None:
             number_of_macros = self.number_of_macros
-        if self.seed is not None:
-            np.random.seed(self.seed)
-        macro_list = []
-        for macro_idx in range(number_of_macros):
-            macro = []
-            for elem in self:
-                mcr = elem.get_macro(macro_idx)
-                if self.counter_token:
-                    mcr = mcr.replace(self.counter_token, str(macro_idx))
-                if mcr is not '':
-                    macro.extend(mcr.split('\n'))
-            macro_list.append(macro)
-        return macro_list
-
-    def create_macros_MonteCarlo(self, number_of_macros=None, batch_size=None): # noqa
+        macros = MacroSequence(self, number_of_macros, self.counter_token)
+        return self._return_macros(macros, batch_size, lazy)
+
+    @staticmethod
+    def _return_macros(macros, batch_size, lazy):
+        if batch_size is not None:
+            return _batch(macros, n=batch_size)
+        if lazy:
+            return macros
+        return list(macros)
+
+    def create_macros_MonteCarlo(self, number_of_macros=None, batch_size=None, # noqa
+                                 lazy=False):
         """Generate AnyScript macros for monte carlos studies.
 
         The function returns macros for Monte Carlo parameter studies. This methods
@@ -753,7 +1224,10 @@ class AnyMacro(MutableSequence):
 
         Values added with `SetValue_random` class are sampled randomly in a
         'Monte Carlo' fashion. Note that the values of the first macro
-        is the defaut mean value.
+        is the defaut mean value. The samples are drawn in chunks of macros
+        from `numpy.random.Generator` streams derived from the `seed` of the
+        AnyMacro object, so the global numpy random state is not used, and
+        a macro has the same values whether it is created lazily or not.
 
         Parameters
         ----------
@@ -762,63 +1236,43 @@ class AnyMacro(MutableSequence):
         batch_size : int (Optional)
             If specified the function will return a generator which creates macros in
             batches.
+        lazy : bool (Optional)
+            If True a `MacroSequence` is returned, which creates each macro when
+            it is indexed or iterated. Use this for studies with too many macros
+            to keep in memory.
 
         Returns
         -------
-        list or generator
-            A list macros or a generator which creates macros in batches
+        list, generator or MacroSequence
+            A list macros, a generator which creates macros in batches or
+            a lazy sequence of macros.
 
         Examples
         --------
-        >>> np.random.seed(1)
         >>> from scipy.stats.distributions import logistic, norm
         >>> log_dist = logistic( loc= [1,3,4],scale = [0.1,0.5,1] )
         >>> norm_dist = norm( loc= [0,0,0],scale = [0.1,0.5,1] )
         >>> cmd = [SetValue_random('Main.MyVar1', log_dist), SetValue_random('Main.MyVar2', norm_dist) ]
-        >>> mg = AnyMacro(cmd, number_of_macros = 3)
+        >>> mg = AnyMacro(cmd, number_of_macros = 3, seed=1)
         >>> mg.create_macros_MonteCarlo()
-        [['classoperation Main.MyVar1 "Set Value" --value="{0,0,0}"',
-        'classoperation Main.MyVar2 "Set Value" --value="{1,3,4}"'],
-        ['classoperation Main.MyVar1 "Set Value" --value="{-0.0209517840916,0.291902872134,-3.68494766954}"',
-        'classoperation Main.MyVar2 "Set Value" --value="{0.916378512121,2.11986245798,1.71459079162}"'],
-        ['classoperation Main.MyVar1 "Set Value" --value="{-0.0891762169545,-0.198666812922,-0.261723075945}"',
-        'classoperation Main.MyVar2 "Set Value" --value="{1.01555799978,2.83695956934,4.7778636562}"']]
+        [['classoperation Main.MyVar1 "Set Value" --value="{1,3,4}"',
+        'classoperation Main.MyVar2 "Set Value" --value="{0,0,0}"'],
+        ['classoperation Main.MyVar1 "Set Value" --value="{1.00472953129,4.47712207929,2.2188372121}"',
+        'classoperation Main.MyVar2 "Set Value" --value="{0.163189738163,-0.245332854156,-0.193390828129}"'],
+        ['classoperation Main.MyVar1 "Set Value" --value="{1.15694318143,2.81636145554,4.19902916387}"',
+        'classoperation Main.MyVar2 "Set Value" --value="{-0.191794309929,0.342793340615,0.0957572465625}"']]
 
         """
-        if batch_size is not None:
-            return _batch(self.create_macros_MonteCarlo(number_of_macros), batch_size)
-
         if number_of_macros is None:
             number_of_macros = self.number_of_macros
-
-        if self.seed is not None:
-            np.random.seed(self.seed)
-
-        macro_list = []
-        for macro_idx in range(number_of_macros):
-            macro = []
-            lhs_idx = 0
-            for elem in self:
-                if isinstance(elem, SetValue_random):
-                    if macro_idx == 0:
-                        lower_tail_probability = None  # First macro get the default values
-                    else:
-                        lower_tail_probability = np.random.random(
-                            elem.n_factors)
-                    mcr = elem.get_macro(macro_idx, lower_tail_probability)
-                    lhs_idx += elem.n_factors
-                else:
-                    mcr = elem.get_macro(macro_idx)
-
-                if self.counter_token:
-                    mcr = mcr.replace(self.counter_token, str(macro_idx))
-                if mcr is not '':
-                    macro.extend(mcr.split('\n'))
-            macro_list.append(macro)
-        return macro_list
+        sampler = _MonteCarloSampler(self, number_of_macros, self.seed)
+        macros = MacroSequence(self, number_of_macros, self.counter_token,
+                               sampler)
+        return self._return_macros(macros, batch_size, lazy)
 
     def create_macros_LHS(self, number_of_macros=None, criterion=None, # noqa
-                          iterations=None, batch_size=None, append_default=False):
+                          iterations=None, batch_size=None, append_default=False,
+                          lazy=False):
         """Generate AnyScript macros for Latin Hyper Cube Studies studies.
 
         Generates AnyScript macros for parameter studies using Latin hyper cube
@@ -836,6 +1290,10 @@ class AnyMacro(MutableSequence):
         batch_size : int (Optional)
             If specified the function will return a generator which creates macros in
             batches.
+        lazy : bool (Optional)
+            If True a `MacroSequence` is returned, which creates each macro when
+            it is indexed or iterated. Use this for studies with too many macros
+            to keep in memory.
         criterion : {None, 'c', 'm', 'cm', 'corr'}
             A a string that specifies how points are sampled
             (see: http://pythonhosted.org/pyDOE/randomized.html)
@@ -854,8 +1312,9 @@ class AnyMacro(MutableSequence):
 
         Returns
         -------
-        list or generator
-            A list macros or a generator which creates macros in batches
+        list, generator or MacroSequence
+            A list macros, a generator which creates macros in batches or
+            a lazy sequence of macros.
 
         Examples
         --------
@@ -880,54 +1339,158 @@ class AnyMacro(MutableSequence):
             raise ImportError(
                 'The pyDOE package must be install to use this class')
 
-        if batch_size is not None:
-            return _batch(self.create_macros_LHS(number_of_macros,
-                                                 criterion,
-                                                 iterations), n=batch_size)
-
         if number_of_macros is None:
             number_of_macros = self.number_of_macros
 
-        if self.seed is not None:
-            np.random.seed(self.seed)
-
         factors = sum([e.n_factors for e in self
                        if isinstance(e, SetValue_random)])
-        lhs_matrix = pyDOE.lhs(factors, number_of_macros,
-                               criterion=criterion,
-                               iterations=iterations)
-
-        macro_list = []
-
-        for macro_idx in range(number_of_macros):
-            macro = []
-            lhs_idx = 0
-            for elem in self:
-                if isinstance(elem, SetValue_random):
-                    lhs_val = lhs_matrix[macro_idx, lhs_idx:lhs_idx +
-                                         elem.n_factors]
-                    mcr = elem.get_macro(macro_idx,
-                                         lower_tail_probability=lhs_val)
-                    lhs_idx += elem.n_factors
-                else:
-                    mcr = elem.get_macro(macro_idx)
-
-                if self.counter_token:
-                    mcr = mcr.replace(self.counter_token, str(macro_idx))
-                if len(mcr) > 0:
-                    macro.extend(mcr.split('\n'))
-            macro_list.append(macro)
-        if append_default:
-            macro = []
-            for elem in self:
-                mcr = elem.get_macro(number_of_macros)
-                if self.counter_token:
-                    mcr = mcr.replace(self.counter_token,
-                                      str(number_of_macros))
-                if len(mcr) > 0:
-                    macro.extend(mcr.split('\n'))
-            macro_list.append(macro)
-        return macro_list
+        # LHS needs all samples to stratify the parameter space, so the
+        # matrix is created here. The macros are still created lazily.
+        # pyDOE draws from the global numpy random state, which is seeded
+        # only for this call and then restored.
+        global_state = np.random.get_state()
+        try:
+            if self.seed is not None:
+                np.random.seed(self.seed)
+            lhs_matrix = pyDOE.lhs(factors, number_of_macros,
+                                   criterion=criterion,
+                                   iterations=iterations)
+        finally:
+            if self.seed is not None:
+                np.random.set_state(global_state)
+        sampler = _MatrixSampler(self, lhs_matrix)
+        # The appended macro has no samples and gets the default values
+        macros = MacroSequence(self, number_of_macros + int(append_default),
+                               self.counter_token, sampler)
+        return self._return_macros(macros, batch_size, lazy)
+
+    def create_macros_full_factorial(self, batch_size=None, lazy=False):
+        """Generate AnyScript macros for a full factorial parameter study.
+
+        The values of all `SetValue` commands with a list of values are
+        combined, so the macros cover every combination of the values. The
+        last command varies fastest. Other commands are created as in
+        `create_macros`, and `SetValue_random` commands get their default
+        values.
+
+        Parameters
+        ----------
+        batch_size : int (Optional)
+            If specified the function will return a generator which creates macros in
+            batches.
+        lazy : bool (Optional)
+            If True a `MacroSequence` is returned, which creates each macro when
+            it is indexed or iterated.
+
+        Returns
+        -------
+        list, generator or MacroSequence
+            A list macros, a generator which creates macros in batches or
+            a lazy sequence of macros.
+
+        Examples
+        --------
+        >>> mg = AnyMacro(SetValue('Main.x', [1, 2]), SetValue('Main.y', [3, 4, 5]))
+        >>> mg.create_macros_full_factorial()
+        [['classoperation Main.x "Set Value" --value="1"',
+          'classoperation Main.y "Set Value" --value="3"'],
+         ['classoperation Main.x "Set Value" --value="1"',
+          'classoperation Main.y "Set Value" --value="4"'],
+         ['classoperation Main.x "Set Value" --value="1"',
+          'classoperation Main.y "Set Value" --value="5"'],
+         ['classoperation Main.x "Set Value" --value="2"',
+          'classoperation Main.y "Set Value" --value="3"'],
+         ['classoperation Main.x "Set Value" --value="2"',
+          'classoperation Main.y "Set Value" --value="4"'],
+         ['classoperation Main.x "Set Value" --value="2"',
+          'classoperation Main.y "Set Value" --value="5"']]
+
+        """
+        sampler = _FactorialSampler(self)
+        macros = MacroSequence(self, sampler.number_of_macros,
+                               self.counter_token, sampler)
+        return self._return_macros(macros, batch_size, lazy)
+
+    def create_macros_sobol(self, number_of_macros=None, scramble=True,
+                            batch_size=None, lazy=False):
+        """Generate AnyScript macros from a Sobol sequence.
+
+        The values of the `SetValue_random` commands are sampled with the
+        quasi-random Sobol sequence from ``scipy.stats.qmc``, which covers
+        the parameter space more evenly than random samples. Use a power of 2
+        as the number of macros to keep the balance of the sequence.
+
+        Parameters
+        ----------
+        number_of_macros : int (Optional)
+            The number of macro to create.
+        scramble : bool (Optional)
+            Scramble the sequence randomly. The scrambling is seeded with the
+            `seed` of the AnyMacro object. An unscrambled sequence starts at
+            0, which gives the lower bound of the distributions.
+            (Defaults to True)
+        batch_size : int (Optional)
+            If specified the function will return a generator which creates macros in
+            batches.
+        lazy : bool (Optional)
+            If True a `MacroSequence` is returned, which creates each macro when
+            it is indexed or iterated.
+
+        Returns
+        -------
+        list, generator or MacroSequence
+            A list macros, a generator which creates macros in batches or
+            a lazy sequence of macros.
+
+        """
+        return self._create_macros_qmc('Sobol', number_of_macros, scramble,
+                                       batch_size, lazy)
+
+    def create_macros_halton(self, number_of_macros=None, scramble=True,
+                             batch_size=None, lazy=False):
+        """Generate AnyScript macros from a Halton sequence.
+
+        Like `create_macros_sobol`, but the `SetValue_random` commands are
+        sampled with the quasi-random Halton sequence, which has no
+        restrictions on the number of macros.
+
+        Parameters
+        ----------
+        number_of_macros : int (Optional)
+            The number of macro to create.
+        scramble : bool (Optional)
+            Scramble the sequence randomly. The scrambling is seeded with the
+            `seed` of the AnyMacro object. (Defaults to True)
+        batch_size : int (Optional)
+            If specified the function will return a generator which creates macros in
+            batches.
+        lazy : bool (Optional)
+            If True a `MacroSequence` is returned, which creates each macro when
+            it is indexed or iterated.
+
+        Returns
+        -------
+        list, generator or MacroSequence
+            A list macros, a generator which creates macros in batches or
+            a lazy sequence of macros.
+
+        """
+        return self._create_macros_qmc('Halton', number_of_macros, scramble,
+                                       batch_size, lazy)
+
+    def _create_macros_qmc(self, engine, number_of_macros, scramble,
+                           batch_size, lazy):
+        try:
+            from scipy.stats import qmc
+        except ImportError:
+            raise ImportError('Quasi-random designs require scipy 1.7 or newer')
+        if number_of_macros is None:
+            number_of_macros = self.number_of_macros
+        sampler = _QMCSampler(self, number_of_macros, getattr(qmc, engine),
+                              scramble, self.seed)
+        macros = MacroSequence(self, number_of_macros, self.counter_token,
+                               sampler)
+        return self._return_macros(macros, batch_size, lazy)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,304 @@
+# -*- coding: utf-8 -*-
+"""
+On-disk cache for the results of AnyBody simulations.
+
+The cache stores the output of every successful task under a key, which is
+computed from everything that determines the result of a simulation: The
+macro, the working folder, the version of the AnyBody console application,
+and the content of the model files loaded by the macro. Repeated
+simulations are then served from the cache without starting AnyBody.
+
+>>> cache = ResultCache('C:/cache/anypytools', max_size=2e9)
+>>> app = AnyPyProcess(result_cache=cache)
+>>> app.start_macro(macrolist)
+>>> cache.stats()
+{'hits': 60, 'misses': 40, 'entries': 140, 'size': 1203941}
+
+"""
+from __future__ import (absolute_import, division,
+                        print_function, unicode_literals)
+from builtins import (ascii, bytes, chr, dict, filter, hex, input,  # noqa
+                      int, map, next, oct, open, pow, range, round,
+                      str, super, zip)
+
+import os
+import re
+import errno
+import pickle
+import hashlib
+import logging
+from tempfile import NamedTemporaryFile
+from threading import RLock
+
+from .tools import anybodycon_version, AnyPyProcessOutput, _without_exit
+
+logger = logging.getLogger('abt.anypytools')
+
+LOAD_COMMAND_RE = re.compile(r'^\s*load\s+"(?P<path>[^"]+)"', re.IGNORECASE)
+INCLUDE_RE = re.compile(r'^\s*#(?:include|import)\s+"(?P<path>[^"]+)"',
+                        re.MULTILINE)
+
+_PICKLE_PROTOCOL = 2
+# When the cache is full, results are removed until it is this fraction of
+# the maximum size. The cache folder is then only scanned now and then.
+_LOW_WATER_MARK = 0.8
+
+
+def _sha1(*parts):
+    digest = hashlib.sha1()
+    for part in parts:
+        digest.update(repr(part).encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+def _replace(src, dst):
+    try:
+        os.replace(src, dst)
+    except AttributeError:  # Python 2
+        if os.path.exists(dst):
+            os.remove(dst)
+        os.rename(src, dst)
+
+
+class ResultCache(object):
+    """Content addressed on-disk cache of task outputs.
+
+    Parameters
+    ----------
+    directory : str
+        Folder where the results are stored. It is created if it does
+        not exist.
+    max_size : int, optional
+        Maximum size of the cache in bytes. When the cache grows larger, the
+        least recently used results are removed until it is 80% of the
+        maximum size. (Defaults to 1 GB)
+
+    Notes
+    -----
+    The model files are found by following ``#include`` and ``#import``
+    statements from the file in the ``load`` command of the macro. Include
+    paths which depend on path variables (e.g. ``<ANYBODY_PATH_AMMR>``)
+    are hashed by name only, so changes to such files (e.g. in the AMMR)
+    are not detected.
+
+    """
+
+    def __init__(self, directory, max_size=1e9):
+        self.directory = os.path.abspath(directory)
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._size = None
+        self._versions = {}
+        self._file_digests = {}
+        self._lock = RLock()
+        try:
+            os.makedirs(self.directory)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+
+    def key(self, macro, folder, anybodycon_path=None, options=None):
+        """Return the cache key of a macro executed in `folder`.
+
+        Parameters
+        ----------
+        macro : list of str
+            The macro commands of the task.
+        folder : str
+            The working folder of the task.
+        anybodycon_path : str, optional
+            The AnyBody console application used to run the task.
+        options : optional
+            Any other settings which change the output, e.g.
+            the list of errors to ignore.
+
+        """
+        # The console is always closed with an exit command, which
+        # is added to the macro when the task runs.
+        macro = _without_exit(macro)
+        folder = os.path.abspath(folder)
+        model_digests = []
+        for line in macro:
+            match = LOAD_COMMAND_RE.match(line)
+            if match:
+                path = os.path.join(folder, match.group('path'))
+                model_digests.append(self._model_digest(path))
+        return _sha1(macro, os.path.normcase(folder),
+                     self._anybodycon_version(anybodycon_path),
+                     model_digests, options)
+
+    def _anybodycon_version(self, anybodycon_path):
+        with self._lock:
+            if anybodycon_path not in self._versions:
+                self._versions[anybodycon_path] = anybodycon_version(
+                    anybodycon_path)
+            return self._versions[anybodycon_path]
+
+    def _model_digest(self, main_file):
+        """Digest of a model file and all the files it includes."""
+        digests = []
+        seen = set()
+        stack = [os.path.normpath(main_file)]
+        while stack:
+            path = stack.pop()
+            if path in seen:
+                continue
+            seen.add(path)
+            digest, includes = self._file_digest(path)
+            digests.append((path, digest))
+            dirname = os.path.dirname(path)
+            for include in includes:
+                if '<' in include:
+                    # Path variables can not be resolved here
+                    digests.append((include, None))
+                else:
+                    stack.append(os.path.normpath(
+                        os.path.join(dirname, include)))
+        return sorted(digests)
+
+    def _file_digest(self, path):
+        """Return the digest and included files of a single file.
+
+        The result is memoized as long as the size and modification
+        time of the file are unchanged.
+        """
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None, []
+        stamp = (st.st_mtime, st.st_size)
+        with self._lock:
+            cached = self._file_digests.get(path)
+        if cached is not None and cached[0] == stamp:
+            return cached[1:]
+        with open(path, 'rb') as f:
+            content = f.read()
+        digest = hashlib.sha1(content).hexdigest()
+        text = content.decode('utf-8', 'replace')
+        includes = INCLUDE_RE.findall(text)
+        with self._lock:
+            self._file_digests[path] = (stamp, digest, includes)
+        return digest, includes
+
+    def _entry_path(self, key):
+        return os.path.join(self.directory, key[:2], key + '.pkl')
+
+    def __contains__(self, key):
+        """Check for a result without loading it or counting a hit."""
+        return os.path.exists(self._entry_path(key))
+
+    def get(self, key):
+        """Return the stored ``(output, processtime)`` or None."""
+        filename = self._entry_path(key)
+        try:
+            with open(filename, 'rb') as f:
+                entry = pickle.load(f)
+            # Mark the result as recently used
+            os.utime(filename, None)
+        except (IOError, OSError, EOFError, pickle.UnpicklingError):
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return entry['output'], entry['processtime']
+
+    def put(self, key, output, processtime=0):
+        """Store the output of a task in the cache."""
+        output = AnyPyProcessOutput(
+            (k, v) for k, v in output.items() if not k.startswith('task_'))
+        filename = self._entry_path(key)
+        dirname = os.path.dirname(filename)
+        try:
+            os.makedirs(dirname)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+        # Write to a temporary file first, so other processes never
+        # read a partially written result.
+        with NamedTemporaryFile('wb', dir=dirname, suffix='.tmp',
+                                delete=False) as f:
+            pickle.dump(dict(output=output, processtime=processtime),
+                        f, protocol=_PICKLE_PROTOCOL)
+        size = os.path.getsize(f.name)
+        try:
+            old_size = os.path.getsize(filename)
+        except OSError:
+            old_size = 0
+        _replace(f.name, filename)
+        with self._lock:
+            if self._size is None:
+                self._size = sum(s for _, s, _ in self._entries())
+            else:
+                self._size += size - old_size
+            if self._size > self.max_size:
+                self._evict()
+
+    def _entries(self):
+        """List the (filename, size, mtime) of all stored results."""
+        entries = []
+        for dirpath, _, filenames in os.walk(self.directory):
+            for name in filenames:
+                if not name.endswith('.pkl'):
+                    continue
+                filename = os.path.join(dirpath, name)
+                try:
+                    st = os.stat(filename)
+                except OSError:
+                    continue
+                entries.append((filename, st.st_size, st.st_mtime))
+        return entries
+
+    def _evict(self):
+        """Remove the least recently used results until the cache fits.
+
+        The cache is reduced to the low water mark, so the files of the
+        cache are not listed again for every result which is stored.
+        """
+        entries = sorted(self._entries(), key=lambda e: e[2])
+        self._size = sum(size for _, size, _ in entries)
+        if self._size <= self.max_size:
+            return
+        for filename, size, _ in entries:
+            if self._size <= _LOW_WATER_MARK * self.max_size:
+                break
+            try:
+                os.remove(filename)
+            except OSError:
+                continue
+            self._size -= size
+
+    def stats(self):
+        """Return a dictionary with cache statistics.
+
+        The statistics include the number of cache hits and misses since
+        the cache object was created, and the number of entries and size
+        in bytes of the cache on disk.
+        """
+        with self._lock:
+            entries = self._entries()
+            self._size = sum(size for _, size, _ in entries)
+            return dict(hits=self.hits, misses=self.misses,
+                        entries=len(entries), size=self._size)
+
+    def clear(self):
+        """Remove all results from the cache."""
+        with self._lock:
+            for filename, _, _ in self._entries():
+                try:
+                    os.remove(filename)
+                except OSError:
+                    pass
+            self._size = 0
+            self.hits = self.misses = 0
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = RLock()
@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+"""
+Append-only file store for the results of AnyPyProcess tasks.
+
+The store is used by `AnyPyProcess.save_results` and
+`AnyPyProcess.load_results`, but can also be used directly to read
+single tasks from large result files without loading everything:
+
+>>> with ResultStore('saved_results.db', mode='r') as store:
+...     task = store[42]   # the task saved with key 42
+...     for task in store:
+...         process(task.get_output())
+
+The data file starts with a magic header followed by records. Each record
+is a 16 byte header with the length of the payload and the record key,
+followed by the pickled object. A sidecar file (``<filename>.idx``) holds
+the key and file offset of every record. It is rebuilt from the data file
+if it is missing or does not match the data file.
+
+"""
+from __future__ import (absolute_import, division,
+                        print_function, unicode_literals)
+from builtins import (ascii, bytes, chr, dict, filter, hex, input,  # noqa
+                      int, map, next, oct, open, pow, range, round,
+                      str, super, zip)
+
+import os
+import pickle
+import struct
+import logging
+
+import numpy as np
+
+logger = logging.getLogger('abt.anypytools')
+
+MAGIC = b'ANYPYRS1'
+_RECORD_HEADER = struct.Struct(str('<qq'))
+_INDEX_DTYPE = np.dtype([(str('key'), '<i8'), (str('offset'), '<i8')])
+# Pickle protocol which can be read by both Python 2 and 3
+_PICKLE_PROTOCOL = 2
+
+
+def is_result_store(filename):
+    """Return True if `filename` is a `ResultStore` file."""
+    try:
+        with open(filename, 'rb') as f:
+            return f.read(len(MAGIC)) == MAGIC
+    except (IOError, OSError):
+        return False
+
+
+class ResultStore(object):
+    """Append-only store of pickled objects with integer keys.
+
+    Parameters
+    ----------
+    filename : str
+        The file of the store.
+    mode : str, optional
+        'r' to read an existing store, 'a' to read and append to a store
+        which is created if it does not exist, or 'w' to create a new empty
+        store. (Defaults to 'a')
+
+    Notes
+    -----
+    Appending an object only writes the new record to the end of the file
+    and adds an entry to an index array with spare capacity, so the time to
+    save does not depend on the amount of data already in the store. If the same key is appended several times, lookup by key
+    returns the latest object, while iteration returns all of them.
+
+    """
+
+    def __init__(self, filename, mode='a'):
+        if mode not in ('r', 'a', 'w'):
+            raise ValueError("mode must be 'r', 'a' or 'w'")
+        self.filename = filename
+        self.index_filename = filename + '.idx'
+        self.mode = mode
+        if mode == 'w' or (mode == 'a' and not os.path.exists(filename)):
+            with open(filename, 'wb') as f:
+                f.write(MAGIC)
+            with open(self.index_filename, 'wb'):
+                pass
+        elif not is_result_store(filename):
+            raise IOError('{} is not a result store'.format(filename))
+        self._reader = open(filename, 'rb')
+        self._index = self._load_index()
+        self._size = len(self._index)
+        self._positions = dict((int(k), i)
+                               for i, k in enumerate(self._index['key']))
+        self._writer = self._index_writer = None
+        if mode != 'r':
+            self._writer = open(filename, 'r+b')
+            self._writer.seek(self._end)
+            self._writer.truncate()
+            self._index_writer = open(self.index_filename, 'ab')
+
+    def _load_index(self):
+        """Load the index and check that it matches the data file."""
+        size = os.path.getsize(self.filename)
+        try:
+            index = np.fromfile(self.index_filename, dtype=_INDEX_DTYPE)
+        except (IOError, OSError, ValueError):
+            index = None
+        if index is not None:
+            if len(index) == 0:
+                end = len(MAGIC)
+            else:
+                self._reader.seek(index['offset'][-1])
+                header = self._reader.read(_RECORD_HEADER.size)
+                if len(header) == _RECORD_HEADER.size:
+                    length, key = _RECORD_HEADER.unpack(header)
+                    end = index['offset'][-1] + _RECORD_HEADER.size + length
+                else:
+                    end = None
+            if end == size:
+                self._end = int(end)
+                return index
+        logger.warning('Rebuilding the index of {}'.format(self.filename))
+        index = self._scan(size)
+        if self.mode != 'r':
+            index.tofile(self.index_filename)
+        return index
+
+    def _scan(self, size):
+        """Build the index by reading the record headers of the data file."""
+        entries = []
+        offset = len(MAGIC)
+        while offset + _RECORD_HEADER.size <= size:
+            self._reader.seek(offset)
+            length, key = _RECORD_HEADER.unpack(
+                self._reader.read(_RECORD_HEADER.size))
+            end = offset + _RECORD_HEADER.size + length
+            if length < 0 or end > size:
+                break  # Incomplete record from an interrupted write
+            entries.append((key, offset))
+            offset = end
+        self._end = offset
+        return np.array(entries, dtype=_INDEX_DTYPE)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self):
+        return self._size
+
+    def __contains__(self, key):
+        return key in self._positions
+
+    def keys(self):
+        """Return the keys of all records in the order they were added."""
+        return [int(k) for k in self._index['key'][:self._size]]
+
+    def next_key(self):
+        """Return a key which is larger than all keys in the store."""
+        if not self._size:
+            return 0
+        return max(int(self._index['key'][:self._size].max()) + 1, 0)
+
+    def append(self, key, obj):
+        """Append an object to the store."""
+        if self._writer is None:
+            raise IOError('The result store is opened read-only')
+        payload = pickle.dumps(obj, protocol=_PICKLE_PROTOCOL)
+        offset = self._end
+        self._writer.write(_RECORD_HEADER.pack(len(payload), key))
+        self._writer.write(payload)
+        self._end = offset + _RECORD_HEADER.size + len(payload)
+        entry = np.array([(key, offset)], dtype=_INDEX_DTYPE)
+        self._index_writer.write(entry.tobytes())
+        if self._size == len(self._index):
+            # Grow the index geometrically, so appending is amortized O(1)
+            index = np.zeros(max(16, 2 * self._size), dtype=_INDEX_DTYPE)
+            index[:self._size] = self._index
+            self._index = index
+        self._index[self._size] = entry[0]
+        self._positions[key] = self._size
+        self._size += 1
+
+    def flush(self, fsync=False):
+        """Write buffered records to the file.
+
+        With ``fsync=True`` the records are also forced to the disk.
+        """
+        for f in (self._writer, self._index_writer):
+            if f is not None:
+                f.flush()
+                if fsync:
+                    os.fsync(f.fileno())
+
+    def _read(self, offset):
+        self.flush()
+        self._reader.seek(offset)
+        length, key = _RECORD_HEADER.unpack(
+            self._reader.read(_RECORD_HEADER.size))
+        return pickle.loads(self._reader.read(length))
+
+    def __getitem__(self, key):
+        try:
+            position = self._positions[key]
+        except KeyError:
+            raise KeyError(key)
+        return self._read(self._index['offset'][position])
+
+    def get(self, key, default=None):
+        if key in self._positions:
+            return self[key]
+        return default
+
+    def __iter__(self):
+        """Iterate lazily over all objects in the order they were added."""
+        for position in range(self._size):
+            yield self._read(self._index['offset'][position])
+
+    def close(self):
+        for f in (self._writer, self._index_writer, self._reader):
+            if f is not None:
+                f.close()
+        self._writer = self._index_writer = None
@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+"""
+History of the run times of AnyBody simulations.
+
+`AnyPyProcess` uses the history to start the tasks which are expected to
+run longest first. This avoids that a study ends with a single long model
+running alone while the other processors are idle.
+
+>>> history = RuntimeHistory('C:/cache/runtimes.sqlite')
+>>> app = AnyPyProcess(runtime_history=history)
+>>> app.start_macro(macrolist)
+>>> app.last_makespan
+{'predicted': 1512.3, 'actual': 1498.7}
+
+The run times are stored in a small SQLite database as exponentially
+weighted moving averages. Each task is recorded both under its exact macro
+and under its configuration, where the values of ``Set Value`` commands
+are removed. Tasks which have not been run before, e.g. a new sample of a
+Monte Carlo study, are then predicted from other tasks of the same study.
+
+"""
+from __future__ import (absolute_import, division,
+                        print_function, unicode_literals)
+from builtins import (ascii, bytes, chr, dict, filter, hex, input,  # noqa
+                      int, map, next, oct, open, pow, range, round,
+                      str, super, zip)
+
+import os
+import re
+import heapq
+import sqlite3
+import logging
+from threading import RLock
+
+from .tools import _without_exit
+from .resultcache import _sha1
+
+logger = logging.getLogger('abt.anypytools')
+
+# The value of Set Value commands, which does not change the configuration
+_SET_VALUE_RE = re.compile(r'(?P<command>"Set ?Value"\s+--value=).*$',
+                           re.IGNORECASE)
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS runtimes (
+    key TEXT PRIMARY KEY,
+    mean REAL NOT NULL,
+    count INTEGER NOT NULL
+)
+'''
+
+
+def predict_makespan(durations, num_workers):
+    """Return the makespan of tasks started in the given order.
+
+    Each task is started on the first worker which becomes available,
+    like `AnyPyProcess` does it.
+
+    Parameters
+    ----------
+    durations : iterable of float
+        The run times of the tasks in the order they are started.
+    num_workers : int
+        The number of tasks which run at the same time.
+
+    """
+    finish_times = [0.0] * max(num_workers, 1)
+    for duration in durations:
+        heapq.heapreplace(finish_times, finish_times[0] + duration)
+    return max(finish_times)
+
+
+class RuntimeHistory(object):
+    """Database with the run times of earlier simulations.
+
+    Parameters
+    ----------
+    filename : str
+        The SQLite database file. It is created if it does not exist.
+    alpha : float, optional
+        Weight of a new run time in the moving average. Higher values
+        follow changes of the models faster. (Defaults to 0.3)
+
+    """
+
+    def __init__(self, filename, alpha=0.3):
+        if not 0 < alpha <= 1:
+            raise ValueError('alpha must be in the range (0, 1]')
+        self.filename = os.path.abspath(filename)
+        self.alpha = alpha
+        self._lock = RLock()
+        self._connect()
+
+    def _connect(self):
+        # The tasks are recorded from the worker threads
+        self._db = sqlite3.connect(self.filename, check_same_thread=False)
+        with self._db:
+            self._db.execute(_SCHEMA)
+
+    def keys(self, macro, folder):
+        """Return the keys of a macro executed in `folder`.
+
+        Returns
+        -------
+        tuple
+            The key of the exact macro, and the key of its configuration,
+            where the values of ``Set Value`` commands are removed.
+
+        """
+        macro = _without_exit(macro)
+        folder = os.path.normcase(os.path.abspath(folder))
+        configuration = [_SET_VALUE_RE.sub(r'\g<command>', line)
+                         for line in macro]
+        return (_sha1('macro', macro, folder),
+                _sha1('configuration', configuration, folder))
+
+    def predict(self, macro, folder):
+        """Return the expected run time of a macro in seconds.
+
+        Returns None if neither the macro nor its configuration has been run.
+        """
+        for key in self.keys(macro, folder):
+            with self._lock:
+                row = self._db.execute(
+                    'SELECT mean FROM runtimes WHERE key = ?',
+                    (key,)).fetchone()
+            if row is not None:
+                return row[0]
+        return None
+
+    def record(self, macro, folder, processtime):
+        """Add the run time of a macro to the history."""
+        with self._lock, self._db:
+            for key in self.keys(macro, folder):
+                row = self._db.execute(
+                    'SELECT mean, count FROM runtimes WHERE key = ?',
+                    (key,)).fetchone()
+                if row is None:
+                    mean, count = processtime, 1
+                else:
+                    mean = row[0] + self.alpha * (processtime - row[0])
+                    count = row[1] + 1
+                self._db.execute(
+                    'INSERT OR REPLACE INTO runtimes (key, mean, count) '
+                    'VALUES (?, ?, ?)', (key, mean, count))
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute(
+                'SELECT COUNT(*) FROM runtimes').fetchone()[0]
+
+    def clear(self):
+        """Remove all run times from the history."""
+        with self._lock, self._db:
+            self._db.execute('DELETE FROM runtimes')
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_lock']
+        del state['_db']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = RLock()
+        self._connect()
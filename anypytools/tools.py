@@ -19,11 +19,14 @@ import os
 import re
 import sys
 import xml
+import types
 import copy
 import errno
+import hashlib
 import pprint as _pprint
 import logging
 import datetime
+import weakref
 import warnings
 import platform
 import subprocess
@@ -249,18 +252,240 @@ def _get_first_key_match(key, names):
     return matching[0]
 
 
+class _KeyIndex(object):
+    """Memoized partial key matching for a fixed set of keys.
+
+    The outputs from the same study usually have the same keys. They share
+    a single index, so a partial key is only matched against the keys
+    once, and later lookups are dictionary lookups.
+    """
+
+    _registry = {}
+    _max_registry_size = 256
+
+    def __init__(self, keys):
+        self.keys = keys
+        self._keyset = frozenset(keys)
+        self._matches = {}
+
+    @classmethod
+    def for_keys(cls, keys):
+        """Return the shared index of the keys."""
+        keys = tuple(keys)
+        index = cls._registry.get(keys)
+        if index is None:
+            if len(cls._registry) >= cls._max_registry_size:
+                cls._registry.clear()
+            index = cls._registry[keys] = cls(keys)
+        return index
+
+    def match(self, key):
+        """Return the first key which contains `key`.
+
+        Same as `_get_first_key_match`, but the warning about
+        ambiguous keys is only printed the first time.
+        """
+        if key in self._keyset:
+            return key
+        try:
+            return self._matches[key]
+        except KeyError:
+            match = self._matches[key] = _get_first_key_match(key, self.keys)
+            return match
+
+
+def _match_key(output, key):
+    """Find the full key of `key` in an element of an output list."""
+    if isinstance(output, AnyPyProcessOutput):
+        return output._get_key_index().match(key)
+    return _get_first_key_match(key, output)
+
+
+def _numeric_array(value):
+    """Return a dumped value as an array, or None if it is not numeric."""
+    if not isinstance(value, (np.ndarray, np.number, np.bool_,
+                              bool, int, float)):
+        return None
+    array = np.asarray(value)
+    if array.dtype.kind not in 'biuf':
+        return None
+    return array
+
+
+def _object_array(values):
+    """Return the values in an array of objects, without converting them."""
+    result = np.empty(len(values), dtype=object)
+    for i, value in enumerate(values):
+        result[i] = value
+    return result
+
+
+def _capacity(size):
+    return max(16, 2 * size)
+
+
+class _Column(object):
+    """Numeric values of one variable from all elements of an output list.
+
+    The values are stored in a single preallocated numpy array, which grows
+    as elements are appended. Values with a varying length of the first
+    (time) dimension are concatenated, and an offsets array marks where the
+    value from each element starts and ends.
+    """
+
+    def __init__(self, data, offsets, n):
+        self._data = data
+        self._offsets = offsets
+        self.n = n
+        self._ragged_result = None
+
+    @classmethod
+    def stack(cls, arrays):
+        """Create a column from a list of numeric arrays.
+
+        Returns None if the arrays have different shapes, which are not
+        only different in the length of the first dimension.
+        """
+        n = len(arrays)
+        dtype = arrays[0].dtype
+        for array in arrays[1:]:
+            dtype = np.promote_types(dtype, array.dtype)
+        shapes = set(a.shape for a in arrays)
+        if len(shapes) == 1:
+            data = np.empty((_capacity(n),) + shapes.pop(), dtype=dtype)
+            for i, array in enumerate(arrays):
+                data[i] = array
+            return cls(data, None, n)
+        if (any(a.ndim == 0 for a in arrays) or
+                len(set(a.shape[1:] for a in arrays)) != 1):
+            return None
+        offsets = np.zeros(_capacity(n + 1), dtype=int)
+        offsets[1:n + 1] = np.cumsum([len(a) for a in arrays])
+        data = np.empty((_capacity(offsets[n]),) + arrays[0].shape[1:],
+                        dtype=dtype)
+        for i, array in enumerate(arrays):
+            data[offsets[i]:offsets[i + 1]] = array
+        return cls(data, offsets, n)
+
+    @property
+    def is_ragged(self):
+        return self._offsets is not None
+
+    @property
+    def holds_scalars(self):
+        return not self.is_ragged and self._data.ndim == 1
+
+    @property
+    def values(self):
+        """The stacked values, or for ragged columns the concatenated values."""
+        if self.is_ragged:
+            return self._data[:self._offsets[self.n]]
+        return self._data[:self.n]
+
+    @property
+    def offsets(self):
+        offsets = self._offsets[:self.n + 1].view()
+        offsets.flags.writeable = False
+        return offsets
+
+    def view(self, i):
+        """Return the value of element `i` as a view into the column."""
+        if self.is_ragged:
+            return self._data[self._offsets[i]:self._offsets[i + 1]]
+        return self._data[i]
+
+    def as_array(self):
+        """Return the column like ``np.array()`` of the list of values."""
+        if not self.is_ragged:
+            return self.values
+        if self._ragged_result is None:
+            result = np.empty(self.n, dtype=object)
+            for i in range(self.n):
+                result[i] = self.view(i)
+            self._ragged_result = result
+        return self._ragged_result.copy()
+
+    def _fits(self, array):
+        """Return True if the column can hold `array`, and widen its dtype."""
+        if self.is_ragged:
+            if array.ndim == 0 or array.shape[1:] != self._data.shape[1:]:
+                return False
+        elif array.shape != self._data.shape[1:]:
+            return False
+        dtype = np.promote_types(self._data.dtype, array.dtype)
+        if dtype != self._data.dtype:
+            self._data = self._data.astype(dtype)
+        return True
+
+    def _reserve(self, array, size):
+        """Return `array` or a larger copy of it with room for `size` rows."""
+        if size <= len(array):
+            return array
+        new = np.empty((_capacity(size),) + array.shape[1:], dtype=array.dtype)
+        new[:len(array)] = array
+        return new
+
+    def append(self, array):
+        """Append a value. Returns False if the column must be rebuilt."""
+        if not self._fits(array):
+            return False
+        if self.is_ragged:
+            start = self._offsets[self.n]
+            stop = start + len(array)
+            self._data = self._reserve(self._data, stop)
+            self._offsets = self._reserve(self._offsets, self.n + 2)
+            self._data[start:stop] = array
+            self._offsets[self.n + 1] = stop
+        else:
+            self._data = self._reserve(self._data, self.n + 1)
+            self._data[self.n] = array
+        self.n += 1
+        self._ragged_result = None
+        return True
+
+    def set(self, i, array):
+        """Replace the value of element `i`. Returns False if impossible."""
+        if self.is_ragged and (
+                array.ndim == 0 or
+                len(array) != self._offsets[i + 1] - self._offsets[i]):
+            return False
+        if not self._fits(array):
+            return False
+        if self.is_ragged:
+            self._data[self._offsets[i]:self._offsets[i + 1]] = array
+        else:
+            self._data[i] = array
+        return True
+
+
 class AnyPyProcessOutputList(collections.MutableSequence):
     """List like class to wrap the output of model simulations.
 
     The class behaves as a normal list but provide
     extra function to easily access data.
+
+    The values of a numeric variable are stored in a single array the first
+    time the variable is accessed, e.g. ``output['Main.Study.Output.t']``.
+    The array is returned without copying, and grows as elements are
+    appended. The arrays in the elements become views into it, so changes
+    to the elements and to the returned array are shared.
     """
 
     def __init__(self, *args):
         self.list = list()
+        self._columns = {}
         for elem in args:
             self.extend(list(elem))
 
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_columns'] = {}
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.__dict__.setdefault('_columns', {})
+
     def check(self, v):
         if not isinstance(v, collections.MutableSequence):
             v = [v]
@@ -271,42 +496,183 @@ class AnyPyProcessOutputList(collections.MutableSequence):
     def __len__(self):
         return len(self.list)
 
+    def _values(self, key):
+        try:
+            return [super(AnyPyProcessOutput, e).__getitem__(key)
+                    for e in self.list]
+        except KeyError as e:
+            msg = " The key: '{}' is not present in all elements of the output."
+            raise_from(KeyError(msg.format(key)), None)
+
+    def _check_columns(self):
+        """Remove the columns if the underlying list was modified directly."""
+        if any(c.n != len(self.list) for c in self._columns.values()):
+            self._columns = {}
+
+    def _get_column(self, key):
+        """Return the column of a variable, or None if it is not numeric."""
+        self._check_columns()
+        column = self._columns.get(key)
+        if column is not None:
+            return column
+        arrays = [_numeric_array(value) for value in self._values(key)]
+        if any(a is None for a in arrays):
+            return None
+        column = _Column.stack(arrays)
+        if (column is not None and
+                all(isinstance(e, AnyPyProcessOutput) for e in self.list) and
+                len(set(map(id, self.list))) == len(self.list)):
+            # The elements report their changes, so the column can be kept
+            for i, element in enumerate(self.list):
+                self._claim(i, element)
+            self._columns[key] = column
+            self._bind(key, column, range(column.n))
+        return column
+
+    def _claim(self, i, element):
+        """Register the list as the owner of element `i`."""
+        owner = element.__dict__.get('_column_owner')
+        if owner is not None:
+            other = owner[0]()
+            if other is not None and other is not self:
+                # The element can only hold views into one list
+                other._columns = {}
+        element.__dict__['_column_owner'] = (weakref.ref(self), i)
+
+    def _is_listed(self, element, i):
+        """Return True if `element` is already in the list, but not at `i`."""
+        owner = element.__dict__.get('_column_owner')
+        if owner is None or owner[0]() is not self:
+            return False
+        j = owner[1]
+        return j != i and j < len(self.list) and self.list[j] is element
+
+    def _bind(self, key, column, indices):
+        """Replace the values of elements with views into the column."""
+        if column.holds_scalars:
+            # Scalars can not be modified in place
+            return
+        for i in indices:
+            super(AnyPyProcessOutput, self.list[i]).__setitem__(
+                key, column.view(i))
+
+    def _update_columns(self, i, keys=None):
+        """Store the values of element `i` in the columns."""
+        element = self.list[i]
+        for key in list(self._columns if keys is None else keys):
+            column = self._columns[key]
+            try:
+                array = _numeric_array(
+                    super(AnyPyProcessOutput, element).__getitem__(key))
+            except KeyError:
+                array = None
+            data = column._data
+            if array is None:
+                updated = False
+            elif i == column.n:
+                updated = column.append(array)
+            else:
+                updated = column.set(i, array)
+            if not updated:
+                del self._columns[key]
+            elif column._data is data:
+                self._bind(key, column, [i])
+            else:
+                # The column was reallocated
+                self._bind(key, column, range(column.n))
+
+    def _element_changed(self, i, element, key):
+        """Update the columns after element `i` has been modified."""
+        if i >= len(self.list) or self.list[i] is not element:
+            return
+        if key is None:
+            self._columns = {}
+        elif key in self._columns:
+            self._check_columns()
+            self._update_columns(i, [key])
+
+    def get_ragged(self, key):
+        """Return the values of a variable as a flat array and offsets.
+
+        The values from all elements are concatenated along the first (time)
+        dimension. The values from element ``i`` are
+        ``values[offsets[i]:offsets[i+1]]``. This works both when the length
+        of the time dimension is the same for all elements and when it varies.
+
+        Returns
+        -------
+        values : ndarray
+            The concatenated values.
+        offsets : ndarray
+            Array with the start index of the values of every element, and the
+            total number of values as the last entry.
+
+        """
+        key = _match_key(self.list[0], key)
+        column = self._get_column(key)
+        if column is not None and column.is_ragged:
+            return column.values, column.offsets
+        if column is None or column.values.ndim < 2:
+            raise ValueError('The values of {} do not have a time '
+                             'dimension'.format(key))
+        values = column.values
+        offsets = np.arange(len(values) + 1) * values.shape[1]
+        return values.reshape((-1,) + values.shape[2:]), offsets
+
     def __getitem__(self, i):
         if isinstance(i, string_types):
             # Find the entries where i matches the keys
-            key = _get_first_key_match(i, self.list[0])
-            try:
-                data = np.array(
-                    [super(AnyPyProcessOutput, e).__getitem__(key)
-                     for e in self.list]
-                )
-            except KeyError as e:
-                msg = " The key: '{}' is not present in all elements of the output."
-                raise_from(KeyError(msg.format(key)), None)
-            if data.dtype == np.dtype('O'):
+            key = _match_key(self.list[0], i)
+            column = self._get_column(key)
+            if column is None:
+                return _object_array(self._values(key))
+            if column.is_ragged:
                 # Data will be stacked as an array of objects, if the length of the
                 # time dimension is not consistant across simulations. Warn that some numpy
                 # featurs will not be avaiable.
                 warnings.warn('\n\The length of the time variable varies across macros. '
                               'Numpy does not support ragged arrays. Data is returned  '
                               'as an array of array objects')
-            return data
+            return column.as_array()
         else:
             return type(self)(self.list[i]) if isinstance(i, slice) else self.list[i]
 
     def __delitem__(self, i):
         del self.list[i]
+        self._columns = {}
 
     def __setitem__(self, i, v):
         self.check(v)
         if isinstance(i, slice):
             self.list[i] = v
-        else:
-            self.list[i] = v
+            self._columns = {}
+            return
+        self.list[i] = v
+        if not self._columns:
+            return
+        i = range(len(self.list))[i]
+        if not isinstance(v, AnyPyProcessOutput) or self._is_listed(v, i):
+            self._columns = {}
+            return
+        self._check_columns()
+        self._claim(i, v)
+        self._update_columns(i)
 
     def insert(self, i, v):
         self.check(v)
-        self.list.insert(i, v)
+        n = len(self.list)
+        if i < n or not self._columns:
+            self.list.insert(i, v)
+            self._columns = {}
+            return
+        # Appending. Add the new element to the existing columns.
+        self._check_columns()
+        self.list.append(v)
+        if not isinstance(v, AnyPyProcessOutput) or self._is_listed(v, n):
+            self._columns = {}
+            return
+        self._claim(n, v)
+        self._update_columns(n)
 
     def __str__(self):
         return str(self.list)
@@ -463,8 +829,42 @@ def getsubdirs(toppath, search_string="."):
     return uniqueList
 
 
+# Format of a single element in array2anyscript for each numpy dtype kind
+_ELEMENT_FORMATS = {'b': '%.12g', 'i': '%.12g', 'u': '%.12g', 'f': '%.12g',
+                    'U': '"%s"'}
+# Format strings are memoized for small arrays, which are formatted often,
+# e.g. when many macros set the same variable.
+_ARRAY_TEMPLATES = {}
+_MAX_ARRAY_TEMPLATES = 256
+_MAX_TEMPLATE_SIZE = 4096
+
+
+def _array_template(shape, element):
+    """Return a format string for an array with the given shape."""
+    key = (shape, element)
+    template = _ARRAY_TEMPLATES.get(key)
+    if template is None:
+        template = element
+        for n in reversed(shape):
+            template = '{' + ','.join([template] * n) + '}'
+        if np.prod(shape) <= _MAX_TEMPLATE_SIZE:
+            if len(_ARRAY_TEMPLATES) >= _MAX_ARRAY_TEMPLATES:
+                _ARRAY_TEMPLATES.clear()
+            _ARRAY_TEMPLATES[key] = template
+    return template
+
+
 def array2anyscript(arr):
-    """Format a numpy array as an anyscript variable."""
+    """Format a numpy array as an anyscript variable.
+
+    Numeric and string arrays are formatted in a single pass with a format
+    string, which has the nested braces of the array shape. Other values are
+    formatted element by element.
+    """
+    if isinstance(arr, np.ndarray) and arr.dtype.kind in _ELEMENT_FORMATS:
+        template = _array_template(arr.shape, _ELEMENT_FORMATS[arr.dtype.kind])
+        return template % tuple(arr.ravel().tolist())
+
     def tostr(v):
         if np.isreal(v):
             return '{:.12g}'.format(v)
@@ -497,11 +897,55 @@ def array2anyscript(arr):
 class AnyPyProcessOutput(collections.OrderedDict):
     """Subclassed OrderedDict which supports partial key access."""
 
+    def _mutated(self, key=None):
+        self.__dict__.pop('_key_index', None)
+        # Update the columns of the output list the element belongs to
+        owner = self.__dict__.get('_column_owner')
+        if owner is not None:
+            output_list = owner[0]()
+            if output_list is not None:
+                output_list._element_changed(owner[1], self, key)
+
+    def _get_key_index(self):
+        try:
+            return self.__dict__['_key_index']
+        except KeyError:
+            index = _KeyIndex.for_keys(super(AnyPyProcessOutput, self).keys())
+            self.__dict__['_key_index'] = index
+            return index
+
+    def __setitem__(self, key, value):
+        super(AnyPyProcessOutput, self).__setitem__(key, value)
+        self._mutated(key)
+
+    def __delitem__(self, key):
+        super(AnyPyProcessOutput, self).__delitem__(key)
+        self._mutated(key)
+
+    def pop(self, key, *args):
+        value = super(AnyPyProcessOutput, self).pop(key, *args)
+        self._mutated(key)
+        return value
+
+    def popitem(self, *args, **kwargs):
+        item = super(AnyPyProcessOutput, self).popitem(*args, **kwargs)
+        self._mutated(item[0])
+        return item
+
+    def clear(self):
+        self._mutated()
+        super(AnyPyProcessOutput, self).clear()
+
+    def __reduce__(self):
+        # Don't pickle the column owner and key index
+        reduced = super(AnyPyProcessOutput, self).__reduce__()
+        return reduced[:2] + (None,) + reduced[3:]
+
     def __getitem__(self, key):
         try:
             return super(AnyPyProcessOutput, self).__getitem__(key)
         except KeyError as e:
-            key = _get_first_key_match(key, super(AnyPyProcessOutput, self).keys())
+            key = self._get_key_index().match(key)
 
         try:
             return super(AnyPyProcessOutput, self).__getitem__(key)
@@ -549,82 +993,225 @@ class AnyPyProcessOutput(collections.OrderedDict):
 
 dump_pattern = re.compile(r'Main.*=.*;$')
 
+# Characters of the numbers in AnyScript blocks like {{1.0,2e-3},{3,4}}
+_NUMBER_CHARS = b'0123456789.eE+- \t'
+_BLOCK_CHARS = _NUMBER_CHARS + b'{},'
+_NUMBER = r'\s*[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?\s*'
+# Comma separated numbers, i.e. a block without the braces
+_NUMBER_LIST_RE = re.compile(_NUMBER + '(?:,' + _NUMBER + r')*\Z')
+# Integers with more digits may not fit in np.int_
+_LONG_INTEGER_RE = re.compile(
+    r'\d{{{:d},}}'.format(len(str(np.iinfo(np.int_).max))))
 
-def parse_anybodycon_output(strvar, errors_to_ignore=None,
-                            warnings_to_include=None):
-    if errors_to_ignore is None:
-        errors_to_ignore = []
-    if warnings_to_include is None:
-        warnings_to_include = []
 
-    out = AnyPyProcessOutput()
-    out['ERROR'] = []
-    out['WARNING'] = []
+def _compile_any_of(strings):
+    """Compile a regex which matches any of the strings, or return None."""
+    if not strings:
+        return None
+    return re.compile('|'.join(re.escape(s) for s in strings))
+
+
+def _block_skeleton(shape):
+    """Return the braces and commas of a block with the given shape."""
+    skeleton = ''
+    for size in reversed(shape):
+        skeleton = '{' + ','.join([skeleton] * size) + '}'
+    return skeleton
+
 
-    dump_path = None
-    for line in strvar.splitlines():
+def _parse_numeric_block(value_str):
+    """Parse a numeric AnyScript block directly into a numpy array.
+
+    Returns None if the value is not a rectangular block of numbers. The
+    result is the same as converting the ``literal_eval`` result of the
+    value to an array, but much faster for large blocks.
+    """
+    try:
+        block = value_str.encode('ascii')
+    except UnicodeEncodeError:
+        return None
+    if block.translate(None, _BLOCK_CHARS):
+        # Contains other characters than numbers
+        return None
+    skeleton = block.translate(None, _NUMBER_CHARS).decode('ascii')
+    depth = len(skeleton) - len(skeleton.lstrip('{'))
+    # Find the shape from the first block on every level, and check that
+    # the whole value has that shape.
+    shape = []
+    for level in range(depth):
+        closing = '}' * (depth - level)
+        first_block = skeleton[:skeleton.find(closing)]
+        shape.append(first_block.count(closing[1:] + ',') + 1)
+    if skeleton != _block_skeleton(shape):
+        return None
+    numbers = value_str.replace('{', '').replace('}', '')
+    if not _NUMBER_LIST_RE.match(numbers):
+        return None
+    if '.' in value_str or 'e' in value_str or 'E' in value_str:
+        dtype = float
+    elif _LONG_INTEGER_RE.search(numbers):
+        # np.fromstring saturates integers which overflow
+        return None
+    else:
+        dtype = np.int_
+    values = np.fromstring(numbers, dtype=dtype, sep=',')
+    if values.size != np.prod(shape):
+        return None
+    return values.reshape(shape)
+
+
+def _parse_dump_value(value_str, line):
+    """Parse the value of a dumped variable."""
+    last = value_str
+    if value_str.startswith('{') and value_str.endswith('}'):
+        value = _parse_numeric_block(value_str)
+        if value is not None:
+            return value
+        value_str = value_str.replace('{', '[').replace('}', ']')
+    try:
+        return literal_eval(value_str)
+    except (SyntaxError, ValueError):
+        pass
+    if value_str == '[...]':
+        value_str = '...'
+    value_str, nrep = re.subn(
+        r'([^\[\]",\s]+)', r"'''\1'''", value_str)
+    if value_str == '':
+        value_str = 'None'
+    if value_str.startswith('"') and value_str.endswith('"'):
+        value_str = "'''" + value_str[1:-1] + r"'''"
+    try:
+        return literal_eval(value_str)
+    except (SyntaxError, ValueError):
+        warnings.warn('\n\nCould not parse console output:\n' + line)
+        return last
+
+
+class AnyBodyConOutputParser(object):
+    """Incremental parser for the output of the AnyBody console application.
+
+    The output can be fed to the parser in chunks as it is written by the
+    console application. Lines are parsed as soon as they are complete,
+    so errors can be detected while the model is still running.
+
+    Parameters
+    ----------
+    errors_to_ignore : list of str, optional
+        Error lines containing any of these strings are not reported.
+    warnings_to_include : list of str, optional
+        Warning lines containing any of these strings are reported.
+
+    Examples
+    --------
+    >>> parser = AnyBodyConOutputParser()
+    >>> parser.feed('Main.MyStudy.nStep = 1')
+    >>> parser.feed('00;\\n')
+    >>> parser.close()
+    {'Main.MyStudy.nStep': 100}
+
+    """
+
+    def __init__(self, errors_to_ignore=None, warnings_to_include=None):
+        self._ignore_re = _compile_any_of(errors_to_ignore)
+        self._include_re = _compile_any_of(warnings_to_include)
+        self._out = AnyPyProcessOutput()
+        self._out['ERROR'] = []
+        self._out['WARNING'] = []
+        self._dump_path = None
+        self._pending = []
+
+    @property
+    def errors(self):
+        """The error lines found so far."""
+        return self._out['ERROR']
+
+    @property
+    def has_error(self):
+        return len(self._out['ERROR']) > 0
+
+    def feed(self, text):
+        """Parse a chunk of the output."""
+        if not text:
+            return
+        self._pending.append(text)
+        if '\n' not in text and '\r' not in text:
+            # Wait for the rest of the line
+            return
+        lines = ''.join(self._pending).splitlines(True)
+        self._pending = []
+        last = lines[-1]
+        if last.splitlines() == [last]:
+            # The last line is not complete yet
+            self._pending.append(lines.pop())
+        for line in lines:
+            if line.endswith('\r\n'):
+                self._parse_line(line[:-2])
+            else:
+                self._parse_line(line[:-1])
+
+    def feed_lines(self, lines):
+        """Parse complete lines without line break characters."""
+        for line in lines:
+            self._parse_line(line)
+
+    def _parse_line(self, line):
+        out = self._out
+        if line.startswith(('ERROR', 'Error', 'Model loading skipped')):
+            if self._ignore_re is None or not self._ignore_re.search(line):
+                out['ERROR'].append(line)
+            return
+        if line.startswith(('WARNING', 'Failed')):
+            if self._include_re is not None and self._include_re.search(line):
+                out['WARNING'].append(line)
+            return
         if '#### Macro command' in line and "Dump" in line:
             me = re.search('Main[^ \"]*', line)
             if me:
-                dump_path = me.group(0)
-        if dump_pattern.match(line):
+                self._dump_path = me.group(0)
+        # Same as dump_pattern.match(line), but faster for long lines
+        if line.startswith('Main') and line.endswith(';') and '=' in line:
             (first, last) = line.split('=', 1)
-            last = last.strip(' ;')
             var_name = first.strip()
-            value_str = last
-            if value_str.startswith('{') and value_str.endswith('}'):
-                value_str = value_str.replace('{', '[').replace('}', ']')
-            if dump_path:
-                var_name = dump_path
-                dump_path = None
-            try:
-                out[var_name.strip()] = literal_eval(value_str)
-            except (SyntaxError, ValueError):
-                if value_str == '[...]':
-                    value_str = '...'
-                value_str, nrep = re.subn(
-                    r'([^\[\]",\s]+)', r"'''\1'''", value_str)
-                if value_str == '':
-                    value_str = 'None'
-                if value_str.startswith('"') and value_str.endswith('"'):
-                    value_str = "'''" + value_str[1:-1] + r"'''"
-                try:
-                    out[var_name.strip()] = literal_eval(value_str)
-                except (SyntaxError, ValueError):
-                    out[var_name.strip()] = last
-                    warnings.warn(
-                        '\n\nCould not parse console output:\n' + line)
-        line_has_errors = (line.startswith('ERROR') or line.startswith('Error') or
-                           line.startswith('Model loading skipped'))
-        if line_has_errors:
-            for err_str in errors_to_ignore:
-                if err_str in line:
-                    break
-            else:
-                # This is run if we never break,
-                # i.e. err was not in the list of errors_to_ignore
-                out['ERROR'].append(line)
-        line_has_warning = line.startswith(('WARNING', 'Failed'))
-        if line_has_warning:
-            for warn_str in warnings_to_include:
-                if warn_str in line:
-                    out['WARNING'].append(line)
-                    break
-    # Convert all list object to numpy arrays
-    for k, v in out.items():
-        if isinstance(v, list):
-            out[k] = np.array(v)
-
-    # Move 'ERROR' and 'WARNING' entry to the last position in the ordered dict
-    out['WARNING'] = out.pop('WARNING').tolist()
-    out['ERROR'] = out.pop('ERROR').tolist()
-
-    # Remove the ERROR/WARNING key if it does not have any entries
-    if len(out['ERROR']) == 0:
-        del out['ERROR']
-    if len(out['WARNING']) == 0:
-        del out['WARNING']
-    return out
+            if self._dump_path:
+                var_name = self._dump_path
+                self._dump_path = None
+            out[var_name.strip()] = _parse_dump_value(last.strip(' ;'), line)
+
+    def close(self):
+        """Parse any remaining output and return the results.
+
+        Returns
+        -------
+        AnyPyProcessOutput
+            The dumped variables and any errors and warnings.
+
+        """
+        if self._pending:
+            self.feed_lines(''.join(self._pending).splitlines())
+            self._pending = []
+        out = self._out
+        # Convert all list object to numpy arrays
+        for k, v in out.items():
+            if isinstance(v, list):
+                out[k] = np.array(v)
+
+        # Move 'ERROR' and 'WARNING' entry to the last position in the ordered dict
+        out['WARNING'] = out.pop('WARNING').tolist()
+        out['ERROR'] = out.pop('ERROR').tolist()
+
+        # Remove the ERROR/WARNING key if it does not have any entries
+        if len(out['ERROR']) == 0:
+            del out['ERROR']
+        if len(out['WARNING']) == 0:
+            del out['WARNING']
+        return out
+
+
+def parse_anybodycon_output(strvar, errors_to_ignore=None,
+                            warnings_to_include=None):
+    parser = AnyBodyConOutputParser(errors_to_ignore, warnings_to_include)
+    parser.feed_lines(strvar.splitlines())
+    return parser.close()
 
 
 def get_ncpu():
@@ -633,6 +1220,24 @@ def get_ncpu():
     return cpu_count()
 
 
+def _with_exit(macro):
+    """Append the exit command, which ends the console, to a macro list.
+
+    The list is changed in place, so the tasks keep the macro as it was run.
+    """
+    if macro and macro[-1] != 'exit':
+        macro.append('exit')
+    return macro
+
+
+def _without_exit(macro):
+    """Return the macro as a list without the exit command added to run it."""
+    macro = list(macro)
+    if macro and macro[-1] == 'exit':
+        macro = macro[:-1]
+    return macro
+
+
 def silentremove(filename):
     """Remove a file ignoring cases where the file does not exits."""
     try:
@@ -675,6 +1280,39 @@ def make_hash(o):
     return hash(tuple(frozenset(sorted(new_o.items()))))
 
 
+def make_digest(o):
+    """Make a stable digest of a dictionary, list, tuple or set.
+
+    Unlike `make_hash`, which uses the built-in ``hash()``, the digest is
+    the same in every Python process. It can therefore be stored in files
+    and compared when a script is run again.
+    """
+    digest = hashlib.sha1()
+    _update_digest(digest, o)
+    return digest.hexdigest()
+
+
+def _update_digest(digest, o):
+    # Generators are digested like lists, e.g. to digest many macros
+    # without creating them all at once.
+    if isinstance(o, (list, tuple, types.GeneratorType)):
+        digest.update(b'[')
+        for e in o:
+            _update_digest(digest, e)
+        digest.update(b']')
+    elif isinstance(o, (set, frozenset)):
+        digest.update(b'{')
+        for e in sorted(make_digest(e) for e in o):
+            digest.update(e.encode('ascii'))
+        digest.update(b'}')
+    elif isinstance(o, dict):
+        _update_digest(digest, set((make_digest(k), make_digest(v))
+                                   for k, v in o.items()))
+    else:
+        digest.update(repr(o).encode('utf-8'))
+        digest.update(b',')
+
+
 _BM_CONSTANTS_AMMR1 = {
     'ON': '1',
     'OFF': '0',
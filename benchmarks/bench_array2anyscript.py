@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark of ``array2anyscript`` against the previous implementation.
+
+Run with::
+
+    python benchmarks/bench_array2anyscript.py
+
+"""
+from __future__ import (absolute_import, division,
+                        print_function, unicode_literals)
+
+import timeit
+
+import numpy as np
+from past.builtins import basestring as string_types
+
+from anypytools.tools import array2anyscript
+
+
+def legacy_array2anyscript(arr):
+    """The implementation of array2anyscript from AnyPyTools 0.10."""
+    def tostr(v):
+        if np.isreal(v):
+            return '{:.12g}'.format(v)
+        elif isinstance(v, (string_types, np.str_)):
+            return '"{}"'.format(v)
+
+    def createsubarr(arr):
+        outstr = ""
+        if isinstance(arr, np.ndarray):
+            if len(arr) == 1 and not isinstance(arr[0], np.ndarray):
+                return '{' + tostr(arr[0]) + '},'
+            outstr += '{'
+            for row in arr:
+                outstr += createsubarr(row)
+            outstr = outstr.strip(',') + '},'
+            return outstr
+        else:
+            return outstr + tostr(arr) + ','
+
+    if isinstance(arr, np.ndarray) and not arr.shape:
+        return tostr(arr.tolist())
+    elif isinstance(arr, np.ndarray):
+        return createsubarr(arr).strip(',')
+    elif isinstance(arr, float):
+        return tostr(arr)
+    else:
+        return str(arr)
+
+
+def main():
+    rng = np.random.RandomState(0)
+    for shape in [(3,), (3, 3), (1000, 3), (100, 100), (20000, 3)]:
+        arr = rng.normal(size=shape)
+        assert array2anyscript(arr) == legacy_array2anyscript(arr)
+        n = max(1, 30000 // arr.size)
+        t_old = timeit.timeit(lambda: legacy_array2anyscript(arr),
+                              number=n) / n
+        t_new = timeit.timeit(lambda: array2anyscript(arr), number=n) / n
+        print('{:>12}: legacy {:12,.0f} elem/s, new {:12,.0f} elem/s, '
+              'speedup {:5.1f}x'.format(str(shape), arr.size / t_old,
+                                        arr.size / t_new, t_old / t_new))
+
+
+if __name__ == '__main__':
+    main()
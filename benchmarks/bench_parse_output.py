@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark of ``parse_anybodycon_output`` against the previous implementation.
+
+Run with::
+
+    python benchmarks/bench_parse_output.py
+
+"""
+from __future__ import (absolute_import, division,
+                        print_function, unicode_literals)
+
+import re
+import timeit
+import warnings
+from ast import literal_eval
+
+import numpy as np
+
+from anypytools.tools import AnyPyProcessOutput, parse_anybodycon_output
+
+
+dump_pattern = re.compile(r'Main.*=.*;$')
+
+
+def legacy_parse_anybodycon_output(strvar, errors_to_ignore=None,
+                                   warnings_to_include=None):
+    """The implementation of parse_anybodycon_output from AnyPyTools 0.10."""
+    if errors_to_ignore is None:
+        errors_to_ignore = []
+    if warnings_to_include is None:
+        warnings_to_include = []
+
+    out = AnyPyProcessOutput()
+    out['ERROR'] = []
+    out['WARNING'] = []
+
+    dump_path = None
+    for line in strvar.splitlines():
+        if '#### Macro command' in line and "Dump" in line:
+            me = re.search('Main[^ \"]*', line)
+            if me:
+                dump_path = me.group(0)
+        if dump_pattern.match(line):
+            (first, last) = line.split('=', 1)
+            last = last.strip(' ;')
+            var_name = first.strip()
+            value_str = last
+            if value_str.startswith('{') and value_str.endswith('}'):
+                value_str = value_str.replace('{', '[').replace('}', ']')
+            if dump_path:
+                var_name = dump_path
+                dump_path = None
+            try:
+                out[var_name.strip()] = literal_eval(value_str)
+            except (SyntaxError, ValueError):
+                if value_str == '[...]':
+                    value_str = '...'
+                value_str, nrep = re.subn(
+                    r'([^\[\]",\s]+)', r"'''\1'''", value_str)
+                if value_str == '':
+                    value_str = 'None'
+                if value_str.startswith('"') and value_str.endswith('"'):
+                    value_str = "'''" + value_str[1:-1] + r"'''"
+                try:
+                    out[var_name.strip()] = literal_eval(value_str)
+                except (SyntaxError, ValueError):
+                    out[var_name.strip()] = last
+                    warnings.warn(
+                        '\n\nCould not parse console output:\n' + line)
+        line_has_errors = (line.startswith('ERROR') or
+                           line.startswith('Error') or
+                           line.startswith('Model loading skipped'))
+        if line_has_errors:
+            for err_str in errors_to_ignore:
+                if err_str in line:
+                    break
+            else:
+                out['ERROR'].append(line)
+        line_has_warning = line.startswith(('WARNING', 'Failed'))
+        if line_has_warning:
+            for warn_str in warnings_to_include:
+                if warn_str in line:
+                    out['WARNING'].append(line)
+                    break
+    for k, v in out.items():
+        if isinstance(v, list):
+            out[k] = np.array(v)
+    out['WARNING'] = out.pop('WARNING').tolist()
+    out['ERROR'] = out.pop('ERROR').tolist()
+    if len(out['ERROR']) == 0:
+        del out['ERROR']
+    if len(out['WARNING']) == 0:
+        del out['WARNING']
+    return out
+
+
+def array2str(arr):
+    if arr.ndim == 1:
+        return '{' + ','.join(repr(float(v)) for v in arr) + '}'
+    return '{' + ','.join(array2str(row) for row in arr) + '}'
+
+
+def make_console_output(n_variables, n_steps, n_columns):
+    """Create console output similar to dumping a long simulation."""
+    rng = np.random.RandomState(0)
+    lines = ['#### Macro command > load "model.main.any"',
+             'Loading Main : "model.main.any"',
+             'WARNING(OBJ.MCH.KIN6): model.main.any(12): Close to singular',
+             'Error : C:/model.main.any(3) : Missing file (ignored)']
+    for i in range(n_variables):
+        name = 'Main.Study.Output.Var{}'.format(i)
+        lines.append('#### Macro command > classoperation {} "Dump"'.format(name))
+        lines.append('{} = {};'.format(name,
+                                       array2str(rng.rand(n_steps, n_columns))))
+    lines.append('Main.Study.nStep = {};'.format(n_steps))
+    return '\n'.join(lines)
+
+
+def main():
+    for n_variables, n_steps, n_columns in [(20, 100, 3), (20, 1000, 3),
+                                            (50, 5000, 3)]:
+        output = make_console_output(n_variables, n_steps, n_columns)
+        kwargs = dict(errors_to_ignore=['Missing file', 'Not used'],
+                      warnings_to_include=['OBJ.MCH.KIN6', 'OBJ1'])
+        new = parse_anybodycon_output(output, **kwargs)
+        old = legacy_parse_anybodycon_output(output, **kwargs)
+        assert list(new) == list(old)
+        for key in new:
+            np.testing.assert_array_equal(new[key], old[key])
+        n = 3
+        t_old = timeit.timeit(
+            lambda: legacy_parse_anybodycon_output(output, **kwargs),
+            number=n) / n
+        t_new = timeit.timeit(
+            lambda: parse_anybodycon_output(output, **kwargs), number=n) / n
+        print('{:6.1f} MB: legacy {:8.3f} s, new {:8.3f} s, '
+              'speedup {:5.1f}x'.format(len(output) / 1e6, t_old, t_new,
+                                        t_old / t_new))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+"""Minimal stand-in for the AnyBody console application.
+
+Used by the tests which do not need a real AnyBody installation. The
+macro commands are echoed like the real console does it, and a few
+commands are understood:
+
+* ``classoperation <var> "Set Value" --value="<value>"`` stores a value.
+* ``classoperation <var> "Dump"`` prints the stored value (default 0.5).
+* ``sleep <seconds>`` pauses the console.
+* ``error`` prints an AnyBody error message.
+* ``load "<file>"`` forgets the stored values.
+
+Without a ``--macro=`` argument the commands are read from stdin, like
+the console does in interactive mode.
+
+"""
+import re
+import sys
+import time
+
+
+def write(line):
+    # AnyBody writes the log line by line
+    sys.stdout.write(line + '\n')
+    sys.stdout.flush()
+
+
+def run_macro(lines, values):
+    for line in lines:
+        write('#### Macro command > ' + line)
+        m = re.match(r'classoperation (\S+) "Set Value" --value="(.*)"', line)
+        if m:
+            values[m.group(1)] = m.group(2)
+        m = re.match(r'classoperation (\S+) "Dump"', line)
+        if m:
+            write('{} = {};'.format(m.group(1), values.get(m.group(1), '0.5')))
+        m = re.match(r'sleep (\S+)', line)
+        if m:
+            time.sleep(float(m.group(1)))
+        if line.startswith('error'):
+            write('ERROR : fake error')
+        if line.startswith('load '):
+            values.clear()
+        if line == 'exit':
+            return True
+    return False
+
+
+def main(args):
+    if args == ['-ni']:
+        write('AnyBody Console Application version : '
+              '7. 1. 0. 4563 (64-bit version)')
+        return 0
+    if '--macro=' not in args:
+        values = {}
+        for line in iter(sys.stdin.readline, ''):
+            if run_macro([line.rstrip('\n')], values):
+                break
+        return 0
+    macrofile = args[args.index('--macro=') + 1]
+    with open(macrofile) as f:
+        run_macro(f.read().splitlines(), {})
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
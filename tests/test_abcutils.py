@@ -9,12 +9,22 @@ from __future__ import (absolute_import, division,
 
 
 import os
+import sys
+import time
 import shutil
+import threading
 import pytest
+import numpy as np
 
 
-from anypytools.abcutils import AnyPyProcess
+from anypytools.abcutils import AnyPyProcess, execute_anybodycon
 from anypytools.abcutils import AnyPyProcessOutputList
+from anypytools.abcutils import _LicenseThrottle
+from anypytools import abcutils
+from anypytools.runtimehistory import RuntimeHistory
+from anypytools.resultcache import ResultCache
+from anypytools import AnyMacro
+from anypytools.macro_commands import SetValue, Dump
 
 demo_model_path = os.path.join(os.path.dirname(__file__), 'Demo.Arm2D.any')
 
@@ -109,6 +119,43 @@ class TestAnyPyProcess():
         assert 'task_logfile' in output[0]
 
 
+    def test_imap_macro(self, init_simple_model, default_macro):
+        n_macros = 5
+        def generate_macros():
+            for i in range(n_macros):
+                yield default_macro[0]
+
+        app = AnyPyProcess(silent=True, return_task_info=True)
+        outputs = list(app.imap_macro(generate_macros()))
+
+        assert len(outputs) == n_macros
+        assert sorted(out['task_id'] for out in outputs) == list(range(n_macros))
+        for result in outputs:
+            assert 'ERROR' not in result
+
+    @pytest.mark.skipif(sys.version_info < (3, 6), reason="requires python3.6")
+    def test_start_macro_async(self, init_simple_model, default_macro):
+        import asyncio
+        app = AnyPyProcess(silent=True, return_task_info=True)
+        macro = default_macro*3
+
+        outputs = []
+        agen = app.start_macro_async(macro)
+        loop = asyncio.new_event_loop()
+        try:
+            while True:
+                try:
+                    outputs.append(loop.run_until_complete(agen.__anext__()))
+                except StopAsyncIteration:
+                    break
+        finally:
+            loop.close()
+
+        assert len(outputs) == 3
+        assert sorted(out['task_id'] for out in outputs) == [0, 1, 2]
+        for result in outputs:
+            assert 'ERROR' not in result
+
     def test_start_macro_subdirs(self, tmpdir, default_macro ):
         number_of_models = 5
         setup_models_in_subdirs(tmpdir, number_of_models)
@@ -249,5 +296,492 @@ class TestAnyPyProcess():
 
 
 
-if __name__ == '__main__':
-    pytest.main(str( 'test_abcutils.py'))
+fake_anybodycon = os.path.join(os.path.dirname(__file__), 'fake_anybodycon.py')
+skip_on_windows = pytest.mark.skipif(sys.platform.startswith('win'),
+                                     reason='Uses a python script as console')
+
+
+class TestAnyPyProcessWithFakeConsole():
+    """Tests which run a python script instead of the AnyBody console."""
+
+    @skip_on_windows
+    def test_execute_anybodycon_output_handler(self, tmpdir):
+        chunks = []
+        logfile = tmpdir.join('test.log')
+        with open(str(logfile), 'a+') as f:
+            execute_anybodycon(['sleep 0.5', 'classoperation Main.x "Dump"'],
+                               logfile=f, anybodycon_path=fake_anybodycon,
+                               output_handler=chunks.append)
+        assert len(chunks) > 1
+        assert ''.join(chunks) == logfile.read()
+
+    @skip_on_windows
+    def test_abort_on_error(self, tmpdir):
+        macro = [['error', 'sleep 10', 'classoperation Main.x "Dump"']]
+        app = AnyPyProcess(anybodycon_path=fake_anybodycon, silent=True,
+                           abort_on_error=True, return_task_info=True)
+        with tmpdir.as_cwd():
+            output = app.start_macro(macro)
+        assert output[0]['ERROR'] == ['ERROR : fake error']
+        assert 'Main.x' not in output[0]
+        assert output[0]['task_processtime'] < 5
+
+    @skip_on_windows
+    def test_max_errors(self, tmpdir):
+        macro = [['error'], ['sleep 10'], ['sleep 10'], ['sleep 10']]
+        app = AnyPyProcess(anybodycon_path=fake_anybodycon, silent=True,
+                           num_processes=2, max_errors=1)
+        with tmpdir.as_cwd():
+            output = app.start_macro(macro)
+        assert len(output) == 4
+        assert 'ERROR' in output[0]
+        # The running task was killed and the last tasks never started
+        assert 'ERROR' in output[1]
+        assert len(output[2]) == 0 and len(output[3]) == 0
+        assert [t.processtime for t in app.cached_tasklist[2:]] == [0, 0]
+
+    @skip_on_windows
+    def test_max_errors_counts_fused_tasks(self, tmpdir):
+        macros = [['load "model.any"'] + (['error'] if i < 2 else []) +
+                  ['classoperation Main.x "Set Value" --value="{}"'.format(i),
+                   'classoperation Main.x "Dump"'] for i in range(6)]
+        app = AnyPyProcess(anybodycon_path=fake_anybodycon, silent=True,
+                           num_processes=1, fuse_tasks=3, max_errors=2)
+        with tmpdir.as_cwd():
+            output = app.start_macro(macros)
+        assert ['ERROR' in o for o in output[:3]] == [True, True, False]
+        # The two errors of the first fused task stop the batch
+        assert all(len(o) == 0 for o in output[3:])
+
+    @skip_on_windows
+    def test_imap_macro_stops_consoles_when_closed(self, tmpdir):
+        app = AnyPyProcess(anybodycon_path=fake_anybodycon, silent=True,
+                           num_processes=2)
+        with tmpdir.as_cwd():
+            outputs = app.imap_macro([['classoperation Main.x "Dump"'],
+                                      ['sleep 10'], ['sleep 10']])
+            starttime = time.time()
+            next(outputs)
+            outputs.close()
+            while app._processes._pids and time.time() - starttime < 5:
+                time.sleep(0.1)
+        assert not app._processes._pids
+        assert time.time() - starttime < 5
+
+    @skip_on_windows
+    def test_max_errors_only_stops_own_processes(self, tmpdir):
+        other = AnyPyProcess(anybodycon_path=fake_anybodycon, silent=True)
+        results = []
+        with tmpdir.as_cwd():
+            thread = threading.Thread(target=lambda: results.extend(
+                other.start_macro([['sleep 2', 'classoperation Main.x "Dump"']])))
+            thread.start()
+            time.sleep(0.5)
+            app = AnyPyProcess(anybodycon_path=fake_anybodycon, silent=True,
+                               num_processes=2, max_errors=1)
+            app.start_macro([['error'], ['sleep 10']])
+            thread.join()
+        assert 'ERROR' not in results[0]
+        assert 'Main.x' in results[0]
+
+    @skip_on_windows
+    def test_journal(self, tmpdir):
+        journal = str(tmpdir.join('journal.db'))
+        macro = [['classoperation Main.x "Set Value" --value="{}"'.format(i),
+                  'classoperation Main.x "Dump"'] for i in range(3)]
+        app = AnyPyProcess(anybodycon_path=fake_anybodycon, silent=True,
+                           journal=journal, return_task_info=True)
+        with tmpdir.as_cwd():
+            first = app.start_macro(macro)
+            # A new process, e.g. after a crash, resumes from the journal
+            app = AnyPyProcess(anybodycon_path=fake_anybodycon, silent=True,
+                               journal=journal, return_task_info=True)
+            second = app.start_macro(macro)
+            assert len(app.load_results(journal)) == 3
+            third = app.start_macro(macro[:2])
+        assert ([o['task_processtime'] for o in first] ==
+                [o['task_processtime'] for o in second])
+        assert [int(o['Main.x']) for o in second] == [0, 1, 2]
+        assert third[0]['task_processtime'] != first[0]['task_processtime']
+
+    @skip_on_windows
+    def test_start_macro_with_lazy_macros(self, tmpdir):
+        mcr = AnyMacro([SetValue('Main.x', list(range(6))), Dump('Main.x')],
+                       number_of_macros=6)
+        app = AnyPyProcess(anybodycon_path=fake_anybodycon, silent=True,
+                           num_processes=2, return_task_info=True)
+        with tmpdir.as_cwd():
+            output = app.start_macro(mcr)
+        assert [int(o['Main.x']) for o in output] == list(range(6))
+        assert output[4]['task_macro'][0] == 'classoperation Main.x "Set Value" --value="4"'
+        # The tasks refer to the lazy macro sequence instead of keeping the macros
+        assert app.cached_tasklist[4]._macro is None
+        # The task info is the same as when the macros are created up front
+        with tmpdir.as_cwd():
+            eager = app.start_macro(mcr.create_macros())
+        assert ([o['task_macro'] for o in output] ==
+                [o['task_macro'] for o in eager])
+        assert ([o['task_macro_hash'] for o in output] ==
+                [o['task_macro_hash'] for o in eager])
+
+    @skip_on_windows
+    def test_lazy_macros_are_rendered_once(self, tmpdir, monkeypatch):
+        from anypytools.macroutils import MacroSequence
+        render = MacroSequence._render
+        rendered = []
+
+        def counting_render(self, index):
+            rendered.append(index)
+            return render(self, index)
+
+        monkeypatch.setattr(MacroSequence, '_render', counting_render)
+        mcr = AnyMacro([SetValue('Main.x', list(range(6))), Dump('Main.x')],
+                       number_of_macros=6)
+        cache = ResultCache(str(tmpdir.join('cache')))
+        app = AnyPyProcess(anybodycon_path=fake_anybodycon, silent=True,
+                           num_processes=2, result_cache=cache,
+                           return_task_info=True)
+        with tmpdir.as_cwd():
+            app.start_macro(mcr)
+        # Once when the task is processed, and once for the output
+        assert sorted(rendered) == sorted(list(range(6)) * 2)
+
+    @skip_on_windows
+    def test_open_pool(self, tmpdir):
+        def macro(i, delay):
+            return ['sleep {}'.format(delay),
+                    'classoperation Main.x "Set Value" --value="{}"'.format(i),
+                    'classoperation Main.x "Dump"']
+
+        app = AnyPyProcess(anybodycon_path=fake_anybodycon, silent=True,
+                           num_processes=2, return_task_info=True)
+        with tmpdir.as_cwd():
+            with app.open_pool() as pool:
+                assert pool.num_workers == 2
+                slow = pool.submit(macro(0, 2))
+                fast = pool.submit(macro(1, 0))
+                assert pool.free_workers == 0
+                # Ask for a new point while the slow task is still running
+                task_id, output = pool.get()
+                assert task_id == fast and int(output['Main.x']) == 1
+                # The finished task is not counted as running
+                assert pool.free_workers == 1
+                third = pool.submit(macro(2, 0))
+                task_id, output = pool.get()
+                assert task_id == third and int(output['Main.x']) == 2
+                task_id, output = pool.get()
+                assert task_id == slow and int(output['Main.x']) == 0
+                assert pool.n_running == 0
+
+            results = {}
+            mcr = AnyMacro(Dump('Main.x'))
+            with app.open_pool(callback=results.__setitem__) as pool:
+                for _ in range(3):
+                    pool.submit(mcr)
+                pool.wait()
+                assert sorted(results) == [0, 1, 2]
+
+            def resubmit(task_id, output):
+                # Tell the result and ask for a new macro from the callback
+                free_workers.append(pool.free_workers)
+                if task_id < 3:
+                    pool.submit(mcr)
+
+            free_workers = []
+            with app.open_pool(callback=resubmit) as pool:
+                pool.submit(mcr)
+                pool.wait()
+            assert free_workers == [2, 2, 2, 2]
+        assert all(float(o['Main.x']) == 0.5 for o in results.values())
+        with pytest.raises(ValueError):
+            pool.submit(mcr)
+
+    @skip_on_windows
+    def test_parse_processes(self, tmpdir):
+        macro = [['classoperation Main.x "Set Value" --value="{{{0},1.5,2}}"'.format(i),
+                  'classoperation Main.x "Dump"',
+                  'classoperation Main.name "Set Value" --value="\'abc\'"',
+                  'classoperation Main.name "Dump"'] for i in range(4)]
+        with tmpdir.as_cwd():
+            expected = AnyPyProcess(anybodycon_path=fake_anybodycon, silent=True,
+                                    num_processes=2).start_macro(macro)
+            app = AnyPyProcess(anybodycon_path=fake_anybodycon, silent=True,
+                               num_processes=2, parse_processes=2)
+            output = app.start_macro(macro)
+        assert app._parse_pool is None
+        for o, e in zip(output, expected):
+            assert list(o.keys()) == list(e.keys())
+            assert np.all(o['Main.x'] == e['Main.x'])
+            assert o['Main.name'] == e['Main.name']
+        assert output['Main.x'].shape == (4, 3)
+        with pytest.raises(ValueError):
+            AnyPyProcess(anybodycon_path=fake_anybodycon, parse_processes=2,
+                         abort_on_error=True)
+
+    def test_license_throttle(self):
+        throttle = _LicenseThrottle(8)
+        epochs = [throttle.acquire() for _ in range(8)]
+        # Failures from the same overload only lower the limit once
+        throttle.release(epochs[0], got_license=False)
+        throttle.release(epochs[1], got_license=False)
+        assert throttle.limit == 4
+        for epoch in epochs[2:]:
+            throttle.release(epoch, got_license=True)
+        assert throttle.limit == 5
+        for _ in range(5):
+            throttle.release(throttle.acquire(), got_license=True)
+        assert throttle.limit == 6
+
+    def test_license_retries(self, tmpdir, monkeypatch):
+        lock = threading.Lock()
+        licenses = {'free': 2, 'denied': 0}
+
+        def execute_with_two_licenses(macro, logfile, output_handler, **kwargs):
+            with lock:
+                got_license = licenses['free'] > 0
+                if got_license:
+                    licenses['free'] -= 1
+                else:
+                    licenses['denied'] += 1
+            if not got_license:
+                return abcutils._NO_LICENSES_AVAILABLE
+            time.sleep(0.05)
+            output_handler('Main.x = 1;\n')
+            with lock:
+                licenses['free'] += 1
+            return 0
+
+        monkeypatch.setattr(abcutils, '_execute_anybodycon',
+                            execute_with_two_licenses)
+        monkeypatch.setattr(abcutils, '_LICENSE_BACKOFF', 0.01)
+        macro = [['classoperation Main.x "Dump"']] * 12
+        with tmpdir.as_cwd():
+            app = AnyPyProcess(silent=True, num_processes=4, license_retries=20,
+                               anybodycon_path=fake_anybodycon)
+            output = app.start_macro(macro)
+            assert licenses['denied'] > 0
+            assert all('ERROR' not in o for o in output)
+            assert all(t.retcode == 0 for t in app.cached_tasklist)
+
+            app = AnyPyProcess(silent=True, num_processes=4,
+                               anybodycon_path=fake_anybodycon)
+            output = app.start_macro(macro)
+        assert any('ERROR' in o for o in output)
+        assert abcutils._NO_LICENSES_AVAILABLE in [t.retcode for t in app.cached_tasklist]
+
+    @skip_on_windows
+    def test_runtime_history(self, tmpdir):
+        macro = [['sleep 0.01'], ['sleep 0.3'], ['sleep 0.1']]
+        history = RuntimeHistory(str(tmpdir.join('runtimes.sqlite')))
+        app = AnyPyProcess(anybodycon_path=fake_anybodycon, silent=True,
+                           num_processes=1, runtime_history=history)
+        with tmpdir.as_cwd():
+            app.start_macro(macro)
+            assert len(history) == 6
+            assert app.last_makespan['predicted'] is None
+            durations = [t.processtime for t in app.cached_tasklist]
+            app.start_macro(macro)
+        # The longest task is started first, but the output keeps the order
+        order = sorted(app.cached_tasklist, key=lambda t: t.process_number)
+        assert [t.macro[0] for t in order] == ['sleep 0.3', 'sleep 0.1', 'sleep 0.01']
+        assert [t.macro[0] for t in app.cached_tasklist] == [m[0] for m in macro]
+        # With one process the predicted makespan is the sum of the recorded
+        # durations of the first run
+        assert app.last_makespan['predicted'] == pytest.approx(sum(durations))
+
+    @skip_on_windows
+    @pytest.mark.skipif(sys.version_info < (3, 6), reason="requires python3.6")
+    def test_runtime_history_async(self, tmpdir):
+        import asyncio
+        macro = [['sleep 0.01'], ['sleep 0.1']]
+        history = RuntimeHistory(str(tmpdir.join('runtimes.sqlite')))
+        app = AnyPyProcess(anybodycon_path=fake_anybodycon, silent=True,
+                           runtime_history=history)
+        agen = app.start_macro_async(macro)
+        loop = asyncio.new_event_loop()
+        try:
+            with tmpdir.as_cwd():
+                while True:
+                    try:
+                        loop.run_until_complete(agen.__anext__())
+                    except StopAsyncIteration:
+                        break
+        finally:
+            loop.close()
+        assert len(history) == 4
+        for task in app.cached_tasklist:
+            assert history.predict(task.macro, task.folder) == task.processtime
+
+    @skip_on_windows
+    @pytest.mark.skipif(sys.version_info < (3, 6), reason="requires python3.6")
+    def test_start_macro_async_options(self, tmpdir):
+        import asyncio
+
+        def run(app, macro):
+            outputs = []
+            agen = app.start_macro_async(macro)
+            loop = asyncio.new_event_loop()
+            try:
+                while True:
+                    try:
+                        outputs.append(loop.run_until_complete(agen.__anext__()))
+                    except StopAsyncIteration:
+                        break
+            finally:
+                loop.close()
+            return sorted(outputs, key=lambda o: o['task_id'])
+
+        macro = [['classoperation Main.x "Set Value" --value="{{{0},1.5}}"'.format(i),
+                  'classoperation Main.x "Dump"'] for i in range(4)]
+        with tmpdir.as_cwd():
+            # Parsing in the process pool does not block the event loop
+            app = AnyPyProcess(anybodycon_path=fake_anybodycon, silent=True,
+                               num_processes=2, parse_processes=2,
+                               return_task_info=True)
+            output = run(app, macro)
+            assert app._parse_pool is None
+            assert [o['Main.x'][0] for o in output] == [0, 1, 2, 3]
+            app = AnyPyProcess(anybodycon_path=fake_anybodycon, silent=True,
+                               abort_on_error=True, return_task_info=True)
+            output = run(app, [['error', 'sleep 10']])
+            assert output[0]['ERROR'] == ['ERROR : fake error']
+            assert output[0]['task_processtime'] < 5
+            # The running console of the instance is killed after max_errors
+            start = time.time()
+            app = AnyPyProcess(anybodycon_path=fake_anybodycon, silent=True,
+                               num_processes=2, max_errors=1,
+                               return_task_info=True)
+            output = run(app, [['error'], ['sleep 10'], ['sleep 10']])
+            assert time.time() - start < 5
+            assert len(output) == 2 and all('ERROR' in o for o in output)
+            assert app.cached_tasklist[2].processtime == 0
+        app = AnyPyProcess(anybodycon_path=fake_anybodycon, session_tasks=2)
+        with pytest.raises(ValueError):
+            app.start_macro_async(macro)
+
+    @skip_on_windows
+    def test_session_tasks(self, tmpdir):
+        def macro(i, commands=()):
+            return (['load "model.any"'] + list(commands) +
+                    ['classoperation Main.x "Set Value" --value="{}"'.format(i),
+                     'classoperation Main.x "Dump"',
+                     'classoperation Main.y "Dump"'])
+
+        macros = [macro(0, ['classoperation Main.y "Set Value" --value="7"']),
+                  macro(1), macro(2, ['error']), macro(3), macro(4), macro(5)]
+        app = AnyPyProcess(anybodycon_path=fake_anybodycon, silent=True,
+                           num_processes=1, session_tasks=2)
+        with tmpdir.as_cwd():
+            output = app.start_macro(macros)
+        assert app._idle_sessions == []
+        assert [int(o['Main.x']) for o in output] == list(range(6))
+        # Main.y is kept from the first task in the session. The session is
+        # recycled after two tasks and after the error.
+        assert [float(o['Main.y']) for o in output] == [7, 7, 0.5, 0.5, 0.5, 0.5]
+        assert ['ERROR' in o for o in output] == [False, False, True,
+                                                   False, False, False]
+
+    @skip_on_windows
+    def test_session_timeout_and_abort(self, tmpdir):
+        app = AnyPyProcess(anybodycon_path=fake_anybodycon, silent=True,
+                           num_processes=2, session_tasks=10, timeout=1,
+                           abort_on_error=True, return_task_info=True)
+        macros = [['load "model.any"', 'sleep 5'],
+                  ['load "model.any"', 'error', 'sleep 5'],
+                  ['load "model.any"', 'classoperation Main.x "Dump"']]
+        with tmpdir.as_cwd():
+            output = app.start_macro(macros)
+        assert 'Timeout' in output[0]['ERROR'][0]
+        assert output[1]['ERROR'] == ['ERROR : fake error']
+        assert output[1]['task_processtime'] < 1
+        assert float(output[2]['Main.x']) == 0.5
+
+    @skip_on_windows
+    def test_session_ignore_errors_and_deadline(self, tmpdir):
+        app = AnyPyProcess(anybodycon_path=fake_anybodycon, silent=True,
+                           num_processes=1, session_tasks=5,
+                           ignore_errors=['fake error'])
+        macros = [['load "model.any"', 'error',
+                   'classoperation Main.x "Set Value" --value="7"'],
+                  ['load "model.any"', 'classoperation Main.x "Dump"']]
+        with tmpdir.as_cwd():
+            output = app.start_macro(macros)
+            # The ignored error does not recycle the session, so the value
+            # set by the first task is kept
+            assert 'ERROR' not in output[0]
+            assert float(output[1]['Main.x']) == 7
+            # Loading the model and the commands share the timeout
+            app = AnyPyProcess(anybodycon_path=fake_anybodycon, silent=True,
+                               num_processes=1, session_tasks=5, timeout=1)
+            output = app.start_macro([['sleep 0.7', 'load "model.any"',
+                                       'sleep 0.7']])
+        assert 'Timeout' in output[0]['ERROR'][0]
+
+    @skip_on_windows
+    def test_fuse_tasks(self, tmpdir):
+        def macro(i, commands=()):
+            return (['load "model.any"'] + list(commands) +
+                    ['classoperation Main.x "Set Value" --value="{}"'.format(i),
+                     'classoperation Main.x "Dump"'])
+
+        macros = [macro(0), macro(1, ['error']), macro(2), macro(3), macro(4),
+                  ['classoperation Main.x "Dump"']]
+        app = AnyPyProcess(anybodycon_path=fake_anybodycon, silent=True,
+                           num_processes=2, fuse_tasks=2, return_task_info=True)
+        with tmpdir.as_cwd():
+            output = app.start_macro(macros)
+        assert [float(o['Main.x']) for o in output] == [0, 1, 2, 3, 4, 0.5]
+        # The error is only reported for the task where it happened
+        assert ['ERROR' in o for o in output] == [False, True, False,
+                                                   False, False, False]
+        assert output[1]['task_logfile'] != ''
+        assert output[0]['task_processtime'] == output[1]['task_processtime'] > 0
+        assert output[2]['task_processtime'] != output[1]['task_processtime']
+        assert output[4]['task_macro'] == macros[4]
+        with pytest.raises(ValueError):
+            AnyPyProcess(anybodycon_path=fake_anybodycon, fuse_tasks=2,
+                         abort_on_error=True)
+
+    @skip_on_windows
+    def test_fuse_tasks_cache_and_history(self, tmpdir):
+        macros = [['load "model.any"',
+                   'classoperation Main.x "Set Value" --value="{}"'.format(i),
+                   'classoperation Main.x "Dump"'] for i in range(4)]
+        tmpdir.join('model.any').write('Main = {};')
+        cache = ResultCache(str(tmpdir.join('cache')))
+        history = RuntimeHistory(str(tmpdir.join('runtimes.sqlite')))
+        with tmpdir.as_cwd():
+            app = AnyPyProcess(anybodycon_path=fake_anybodycon, silent=True,
+                               num_processes=2, fuse_tasks=2, result_cache=cache,
+                               runtime_history=history)
+            first = app.start_macro(macros)
+            # Fusing only checks if the tasks are cached, and the run times of
+            # fused tasks are not recorded
+            assert cache.misses == 0 and cache.stats()['entries'] == 4
+            assert len(history) == 0
+            app = AnyPyProcess(anybodycon_path=fake_anybodycon, silent=True,
+                               num_processes=2, fuse_tasks=2, result_cache=cache)
+            second = app.start_macro(macros)
+        assert cache.hits == 4
+        assert [float(o['Main.x']) for o in second] == [0, 1, 2, 3]
+        assert [float(o['Main.x']) for o in first] == [0, 1, 2, 3]
+
+    def test_fused_task_split_output(self):
+        tasks = [abcutils._Task('.', ['load "model.any"', 'step {}'.format(i)],
+                                number=i) for i in range(3)]
+        fused = abcutils._FusedTask(tasks, ('load "model.any"',))
+        assert fused.macro[0] == 'load "model.any"'
+        assert fused.macro[2::2] == ['step 0', 'step 1', 'step 2']
+        fused.processtime = 3.0
+        log = ['#### Macro command > ' + line for line in fused.macro[:4]]
+        log[2:2] = ['Main.x = 1;']
+        log += ['ERROR: AnyPyTools : anybodycon.exe exited unexpectedly.']
+        fused.split_output('\n'.join(log), retcode=1)
+        assert int(tasks[0].output['Main.x']) == 1
+        assert tasks[1].output['ERROR'] == [log[-1]]
+        assert 'was not run' in tasks[2].output['ERROR'][0]
+        assert [t.processtime for t in tasks] == [1.0, 1.0, 1.0]
+        assert fused.has_error
+
+    if __name__ == '__main__':
+        pytest.main(str( 'test_abcutils.py'))
@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+from __future__ import (absolute_import, division,
+                        print_function, unicode_literals)
+
+import os
+import sys
+import time
+from threading import Thread
+from multiprocessing.connection import Listener
+
+import pytest
+
+from anypytools.abcutils import AnyPyProcess
+from anypytools.distributed import RemoteExecutor, WorkerAgent
+
+fake_anybodycon = os.path.join(os.path.dirname(__file__), 'fake_anybodycon.py')
+
+pytestmark = pytest.mark.skipif(sys.platform.startswith('win'),
+                                reason='Uses a python script as console')
+
+AUTHKEY = b'anypytools'
+
+
+def start_agent(num_processes=2):
+    agent = WorkerAgent(('localhost', 0), AUTHKEY,
+                        anybodycon_path=fake_anybodycon,
+                        num_processes=num_processes)
+    t = Thread(target=agent.serve_forever)
+    t.daemon = True
+    t.start()
+    return agent
+
+
+def start_broken_agent():
+    """Agent which drops the connection when it receives a task."""
+    listener = Listener(('localhost', 0), authkey=AUTHKEY)
+
+    def serve():
+        conn = listener.accept()
+        conn.send({'num_processes': 1})
+        conn.recv()  # settings
+        conn.recv()  # task
+        conn.close()
+        listener.close()
+
+    t = Thread(target=serve)
+    t.daemon = True
+    t.start()
+    return listener.address
+
+
+def make_macros(n):
+    return [['classoperation Main.x "Set Value" --value="{}"'.format(i),
+             'classoperation Main.x "Dump"'] for i in range(n)]
+
+
+def test_remote_executor(tmpdir):
+    agents = [start_agent(), start_agent()]
+    executor = RemoteExecutor([a.address for a in agents], AUTHKEY)
+    app = AnyPyProcess(anybodycon_path=fake_anybodycon, executor=executor,
+                       silent=True)
+    with tmpdir.as_cwd():
+        output = app.start_macro(make_macros(6))
+    assert executor.num_workers == 4
+    assert len(output) == 6
+    assert [int(o['Main.x']) for o in output] == list(range(6))
+    assert all('ERROR' not in o for o in output)
+    for agent in agents:
+        agent.close()
+
+
+def test_remote_executor_reschedules_lost_tasks(tmpdir):
+    agent = start_agent(num_processes=1)
+    addresses = [start_broken_agent(), agent.address]
+    executor = RemoteExecutor(addresses, AUTHKEY)
+    app = AnyPyProcess(anybodycon_path=fake_anybodycon, executor=executor,
+                       silent=True)
+    with tmpdir.as_cwd():
+        output = app.start_macro(make_macros(3))
+    assert [int(o['Main.x']) for o in output] == list(range(3))
+    assert all('ERROR' not in o for o in output)
+    agent.close()
+
+
+def test_remote_executor_closes_connections_on_failure():
+    listener = Listener(('localhost', 0), authkey=AUTHKEY)
+    closed = []
+
+    def serve():
+        # Report three slots, but refuse the extra connections
+        conn = listener.accept()
+        conn.send({'num_processes': 3})
+        listener.close()
+        try:
+            conn.recv()
+        except EOFError:
+            closed.append(True)
+
+    t = Thread(target=serve)
+    t.daemon = True
+    t.start()
+    executor = RemoteExecutor([listener.address], AUTHKEY)
+    with pytest.raises(IOError):
+        executor.start(AnyPyProcess(anybodycon_path=fake_anybodycon))
+    t.join(5)
+    assert closed == [True]
+
+
+def start_garbling_agent():
+    """Agent which answers a task with data that can not be unpickled."""
+    listener = Listener(('localhost', 0), authkey=AUTHKEY)
+
+    def serve():
+        conn = listener.accept()
+        conn.send({'num_processes': 1})
+        conn.recv()  # settings
+        conn.recv()  # task
+        conn.send_bytes(b'not a pickle')
+        listener.close()
+
+    t = Thread(target=serve)
+    t.daemon = True
+    t.start()
+    return listener.address
+
+
+def test_remote_executor_fails_task_on_other_errors(tmpdir):
+    executor = RemoteExecutor([start_garbling_agent()], AUTHKEY)
+    app = AnyPyProcess(anybodycon_path=fake_anybodycon, executor=executor,
+                       silent=True)
+    with tmpdir.as_cwd():
+        output = app.start_macro(make_macros(2))
+    assert 'worker agent' in output[0]['ERROR'][0]
+    assert 'Lost connection' in output[1]['ERROR'][0]
+
+
+def test_remote_executor_stops_remote_processes(tmpdir):
+    agent = start_agent(num_processes=2)
+    executor = RemoteExecutor([agent.address], AUTHKEY)
+    app = AnyPyProcess(anybodycon_path=fake_anybodycon, executor=executor,
+                       silent=True, max_errors=1)
+    start = time.time()
+    with tmpdir.as_cwd():
+        output = app.start_macro([['error'], ['sleep 10'], ['sleep 10']])
+    assert time.time() - start < 5
+    assert 'ERROR' in output[0] and 'ERROR' in output[1]
+    assert len(output[2]) == 0
+    agent.close()
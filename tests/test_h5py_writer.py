@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+from __future__ import (absolute_import, division,
+                        print_function, unicode_literals)
+
+import numpy as np
+import pytest
+
+h5py = pytest.importorskip('h5py')
+
+from anypytools.tools import AnyPyProcessOutput
+from anypytools.h5py_writer import HDF5Writer
+
+
+def make_output(task_id, n_steps):
+    return AnyPyProcessOutput([
+        ('Main.Study.t', np.linspace(0, 1, n_steps)),
+        ('Main.Study.r', np.ones((n_steps, 3)) * task_id),
+        ('Main.Study.nStep', n_steps),
+        ('task_id', task_id),
+        ('task_name', 'model/{}'.format(task_id)),
+    ])
+
+
+def test_hdf5_writer(tmpdir):
+    filename = str(tmpdir.join('results.h5'))
+    with HDF5Writer(filename, group='batch') as writer:
+        for task_id in range(3):
+            writer.write(make_output(task_id, 5 + task_id))
+    # Appending to an existing file keeps the earlier results
+    with HDF5Writer(filename, group='batch') as writer:
+        out = make_output(3, 2)
+        out['ERROR'] = ['ERROR : Something']
+        writer.write(out)
+        assert len(writer) == 4
+
+    with h5py.File(filename, 'r') as f:
+        index = f['batch/task_index'][:]
+        assert list(index['task_id']) == [0, 1, 2, 3]
+        assert list(index['has_error']) == [False, False, False, True]
+        values = f['batch/variables/Main.Study.r/values'][:]
+        spans = f['batch/variables/Main.Study.r/spans'][:]
+        assert values.shape == (5 + 6 + 7 + 2, 3)
+        row, start, stop = spans[2]
+        assert row == 2
+        np.testing.assert_array_equal(values[start:stop], 2)
+        assert list(f['batch/variables/Main.Study.nStep/values']) == [5, 6, 7, 2]
+        errors = f['batch/variables/ERROR/spans'][:]
+        assert errors.tolist() == [[3, 0, 1]]
+
+
+def test_hdf5_writer_types_and_shapes(tmpdir):
+    filename = str(tmpdir.join('results.h5'))
+    with HDF5Writer(filename) as writer:
+        writer.write(AnyPyProcessOutput([('n', 3), ('flag', True),
+                                         ('r', np.zeros((2, 3)))]))
+        writer.write(AnyPyProcessOutput([('n', 4), ('flag', False),
+                                         ('r', np.ones((1, 3)))]))
+        # Nothing is written when a value does not match earlier tasks
+        with pytest.raises(ValueError):
+            writer.write(AnyPyProcessOutput([('n', 5), ('r', np.ones(2))]))
+        with pytest.raises(ValueError):
+            writer.write(AnyPyProcessOutput([('n', 0.5)]))
+        assert len(writer) == 2
+
+    with h5py.File(filename, 'r') as f:
+        n = f['results/variables/n/values']
+        assert n.dtype == np.int64
+        assert list(n[:]) == [3, 4]
+        assert f['results/variables/flag/values'].dtype == np.bool_
+        assert len(f['results/variables/r/values']) == 3
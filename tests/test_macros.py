@@ -14,6 +14,7 @@ from scipy.stats.distributions import norm
 
 from anypytools import AnyMacro
 import anypytools.macro_commands as mc 
+from anypytools.macroutils import _macro_period
 
 #@pytest.yield_fixture()
 #def fixture():
@@ -110,6 +111,145 @@ def test_macros():
     assert macros[1][0] == 'load "main.any"'
     assert len(macros) == 10
 
+
+def test_setvalue_random():
+    cmd = mc.SetValue_random('Main.x', norm(loc=1, scale=0.1))
+    assert cmd.get_macro(0) == 'classoperation Main.x "Set Value" --value="1"'
+    values = cmd.sample(np.array([[0.5], [0.975]]))
+    assert values.shape == (2,)
+    assert values[0] == 1
+    assert np.isclose(values[1], norm(loc=1, scale=0.1).ppf(0.975))
+
+
+def test_create_macros_montecarlo():
+    dist = norm(loc=[0, 10, 20], scale=[1, 1, 1])
+    mcr = AnyMacro([mc.SetValue_random('Main.x', dist),
+                    mc.SetValue_random('Main.y', norm(loc=5))],
+                   number_of_macros=200, seed=1)
+    macros = mcr.create_macros_MonteCarlo()
+    assert len(macros) == 200
+    assert macros[0] == ['classoperation Main.x "Set Value" --value="{0,10,20}"',
+                         'classoperation Main.y "Set Value" --value="5"']
+    assert macros == mcr.create_macros_MonteCarlo()
+    assert len(set(m[1] for m in macros)) == 200
+    # The seed is used instead of the global random state
+    np.random.seed(0)
+    assert macros == mcr.create_macros_MonteCarlo()
+    mcr.seed = 2
+    assert macros[1:] != mcr.create_macros_MonteCarlo()[1:]
+    # Creating macros does not reseed the global random state
+    np.random.seed(0)
+    expected = np.random.random_sample(3)
+    np.random.seed(0)
+    mcr.create_macros()
+    mcr.create_macros_MonteCarlo(lazy=True)[5]
+    assert np.all(np.random.random_sample(3) == expected)
+
+def test_lazy_macros():
+    mcr = AnyMacro([mc.Load('main_{N}.any'),
+                    mc.SetValue_random('Main.x', norm(loc=[1, 2]))],
+                   number_of_macros=3000, counter_token='{N}', seed=3)
+    macros = mcr.create_macros_MonteCarlo()
+    lazy = mcr.create_macros_MonteCarlo(lazy=True)
+    assert len(lazy) == 3000
+    assert lazy[2999] == macros[2999]
+    assert lazy[-1] == macros[-1]
+    assert lazy[10:12] == macros[10:12]
+    assert lazy == macros
+    with pytest.raises(IndexError):
+        lazy[3000]
+    batches = list(mcr.create_macros(number_of_macros=5, batch_size=2))
+    assert [len(b) for b in batches] == [2, 2, 1]
+    assert batches[2][0] == ['load "main_4.any"',
+                             'classoperation Main.x "Set Value" --value="{1,2}"']
+    assert hash(mcr.create_macros(lazy=True)) == hash(mcr.create_macros(lazy=True))
+    # The hash is computed from the parameters without rendering the macros
+    again = mcr.create_macros_MonteCarlo(lazy=True)
+    again._render = None
+    assert hash(again) == hash(lazy) and again == lazy
+    mcr.seed = 4
+    assert mcr.create_macros_MonteCarlo(lazy=True) != lazy
+
+def test_compiled_macros():
+    class IndexCommand(mc.MacroCommand):
+        def get_macro(self, index, **kwarg):
+            return 'classoperation Main.i "Set Value" --value="{}"'.format(index)
+
+    mcr = AnyMacro([mc.Load('model_{N}.any'),
+                    mc.OperationRun('Main.Study'),
+                    mc.SetValue('Main.x', [1, 2, 3]),
+                    IndexCommand('unused'),
+                    mc.Dump('Main.x', include_in_macro=[1]),
+                    mc.MacroCommand('classoperation Main.y "Dump"')],
+                   number_of_macros=5, counter_token='{N}')
+    macros = mcr.create_macros()
+    assert macros[4] == ['load "model_4.any"',
+                         'operation Main.Study', 'run',
+                         'classoperation Main.x "Set Value" --value="2"',
+                         'classoperation Main.i "Set Value" --value="4"',
+                         'classoperation Main.y "Dump"']
+    assert macros[1][-2:] == ['classoperation Main.x "Dump"',
+                              'classoperation Main.y "Dump"']
+    # Changing a macro does not change the compiled segments
+    lazy = mcr.create_macros(lazy=True)
+    lazy[0].append('exit')
+    assert lazy[0] == macros[0]
+    # The built-in commands share the period of MacroCommand
+    assert _macro_period(mc.OperationRun('Main.Study')) == 1
+    assert _macro_period(IndexCommand('unused')) is None
+
+
+def test_compiled_macros_render_only_used_values():
+    rendered = []
+
+    class CountingSetValue(mc.SetValue):
+        def get_macro(self, index, **kwarg):
+            rendered.append(index)
+            return super(CountingSetValue, self).get_macro(index, **kwarg)
+
+        def _period(self):
+            return super(CountingSetValue, self)._period()
+
+    mcr = AnyMacro([CountingSetValue('Main.x', list(range(4000)))],
+                   number_of_macros=3)
+    lazy = mcr.create_macros(lazy=True)
+    assert rendered == [0, 1, 2]
+    assert lazy[2] == ['classoperation Main.x "Set Value" --value="2"']
+
+
+def test_full_factorial():
+    mcr = AnyMacro([mc.Load('model_{N}.any'),
+                    mc.SetValue('Main.x', [1, 2]),
+                    mc.SetValue('Main.y', [3, 4, 5]),
+                    mc.SetValue('Main.z', 6)], counter_token='{N}')
+    macros = mcr.create_macros_full_factorial()
+    assert len(macros) == 6
+    values = [(m[1][-2], m[2][-2]) for m in macros]
+    assert values == [('1', '3'), ('1', '4'), ('1', '5'),
+                      ('2', '3'), ('2', '4'), ('2', '5')]
+    assert macros[5][0] == 'load "model_5.any"'
+    assert all(m[3] == 'classoperation Main.z "Set Value" --value="6"'
+               for m in macros)
+    batches = list(mcr.create_macros_full_factorial(batch_size=4))
+    assert batches == [macros[:4], macros[4:]]
+
+
+def test_quasi_random_designs():
+    pytest.importorskip('scipy.stats.qmc')
+    mcr = AnyMacro([mc.SetValue_random('Main.x', norm(loc=[1, 2])),
+                    mc.SetValue_random('Main.y', norm())],
+                   number_of_macros=2048, seed=4)
+    for create_macros in (mcr.create_macros_sobol, mcr.create_macros_halton):
+        macros = create_macros()
+        assert len(macros) == 2048
+        assert macros == create_macros(lazy=True)
+        y = np.array([float(m[1].split('"')[-2]) for m in macros])
+        # Quasi-random samples are balanced much better than random samples
+        assert abs(y.mean()) < 0.01
+        assert abs(y.std() - 1) < 0.02
+    assert macros != mcr.create_macros_sobol()
+
+
 # def test_macro2():
     # mcr = AnyMacro([
                     # mc.Load('main.any'),
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+from __future__ import (absolute_import, division,
+                        print_function, unicode_literals)
+
+import os
+import sys
+
+import pytest
+
+from anypytools.abcutils import AnyPyProcess
+from anypytools.resultcache import ResultCache
+
+fake_anybodycon = os.path.join(os.path.dirname(__file__), 'fake_anybodycon.py')
+
+
+def write_model(tmpdir, value):
+    tmpdir.join('model.main.any').write('#include "include.any"\n')
+    tmpdir.join('include.any').write('AnyVar x = {};\n'.format(value))
+
+
+def make_macros(n):
+    return [['load "model.main.any"',
+             'classoperation Main.x "Set Value" --value="{}"'.format(i),
+             'classoperation Main.x "Dump"'] for i in range(n)]
+
+
+def test_cache_key_depends_on_model_files(tmpdir):
+    write_model(tmpdir, 1)
+    cache = ResultCache(str(tmpdir.join('cache')))
+    macro = make_macros(1)[0]
+    key = cache.key(macro, str(tmpdir))
+    assert key == cache.key(list(macro), str(tmpdir))
+    assert key != cache.key(macro + ['run'], str(tmpdir))
+    assert key != cache.key(macro, str(tmpdir.mkdir('other')))
+    write_model(tmpdir, 22)
+    assert key != cache.key(macro, str(tmpdir))
+
+
+def test_cache_eviction(tmpdir):
+    cache = ResultCache(str(tmpdir), max_size=2000)
+    for i in range(10):
+        cache.put('key{}'.format(i), {'Main.x': 'x' * 500}, 1.0)
+    stats = cache.stats()
+    assert stats['size'] <= 2000
+    assert 0 < stats['entries'] < 10
+    assert cache.get('key9') is not None
+    assert cache.get('key0') is None
+    assert cache.stats()['hits'] == 1
+    assert cache.stats()['misses'] == 1
+
+
+@pytest.mark.skipif(sys.platform.startswith('win'),
+                    reason='Uses a python script as console')
+def test_start_macro_with_cache(tmpdir):
+    write_model(tmpdir, 1)
+    cache = ResultCache(str(tmpdir.join('cache')))
+    app = AnyPyProcess(anybodycon_path=fake_anybodycon, result_cache=cache,
+                       silent=True)
+    with tmpdir.as_cwd():
+        first = app.start_macro(make_macros(3))
+        second = app.start_macro(make_macros(4))
+    assert cache.stats()['hits'] == 3
+    assert cache.stats()['misses'] == 4
+    assert [int(o['Main.x']) for o in second] == list(range(4))
+    assert 'ERROR' not in second[0]
+    assert first[2]['Main.x'] == second[2]['Main.x']
+
+
+def test_cache_eviction_scans_rarely(tmpdir, monkeypatch):
+    cache = ResultCache(str(tmpdir), max_size=10000)
+    calls = []
+    entries = cache._entries
+    monkeypatch.setattr(cache, '_entries', lambda: calls.append(1) or entries())
+    for i in range(100):
+        cache.put('key{}'.format(i), {'Main.x': 'x' * 500}, 1.0)
+    # The cache is scanned once to find its size, and then only when it has
+    # grown from the low water mark to the maximum size again
+    assert len(calls) < 30
+    assert cache.stats()['size'] <= 10000
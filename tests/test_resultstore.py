@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+from __future__ import (absolute_import, division,
+                        print_function, unicode_literals)
+
+import shelve
+
+import numpy as np
+import pytest
+from future.utils import text_to_native_str
+
+from anypytools.abcutils import AnyPyProcess, _Task
+from anypytools.tools import AnyPyProcessOutput
+from anypytools.resultstore import ResultStore, is_result_store
+
+
+def make_tasks(n):
+    tasks = []
+    for i in range(n):
+        task = _Task('.', ['load "model.any"'], number=i)
+        task.output = AnyPyProcessOutput([('Main.x', np.arange(i + 1.0))])
+        tasks.append(task)
+    return tasks
+
+
+def test_append_and_random_access(tmpdir):
+    filename = str(tmpdir.join('store.db'))
+    with ResultStore(filename) as store:
+        for i in range(5):
+            store.append(i, {'value': i})
+        assert store[3] == {'value': 3}
+        assert store.next_key() == 5
+    with ResultStore(filename, 'r') as store:
+        assert len(store) == 5
+        assert store.keys() == list(range(5))
+        assert [obj['value'] for obj in store] == list(range(5))
+        assert store[4] == {'value': 4}
+        assert 7 not in store
+        with pytest.raises(KeyError):
+            store[7]
+        with pytest.raises(IOError):
+            store.append(5, None)
+    # The index grows beyond its initial capacity
+    with ResultStore(filename) as store:
+        for i in range(5, 40):
+            store.append(i, {'value': i})
+        assert store[20] == {'value': 20}
+    with ResultStore(filename, 'r') as store:
+        assert store.keys() == list(range(40))
+        assert store[39] == {'value': 39}
+
+
+def test_rebuild_index(tmpdir):
+    filename = str(tmpdir.join('store.db'))
+    with ResultStore(filename) as store:
+        for i in range(3):
+            store.append(i, 'x' * 100)
+    tmpdir.join('store.db.idx').remove()
+    # Simulate a write which was interrupted in the middle of a record
+    with open(filename, 'ab') as f:
+        f.write(b'\x80\x00\x00\x00\x00\x00\x00\x00\x03')
+    with ResultStore(filename) as store:
+        assert store.keys() == [0, 1, 2]
+        store.append(3, 'y')
+    with ResultStore(filename, 'r') as store:
+        assert list(store) == ['x' * 100] * 3 + ['y']
+
+
+def test_save_and_load_results(tmpdir):
+    filename = str(tmpdir.join('results.db'))
+    app = AnyPyProcess(silent=True)
+    app.cached_tasklist = make_tasks(2)
+    app.save_results(filename)
+    app.cached_tasklist = make_tasks(3)
+    app.save_results(filename, append=True)
+    assert is_result_store(filename)
+    # The task numbers of the batches are offset to get unique keys
+    with ResultStore(filename, 'r') as store:
+        assert store.keys() == list(range(5))
+        assert np.all(store[4].output['Main.x'] == np.arange(3.0))
+
+    results = AnyPyProcess(silent=True).load_results(filename)
+    assert len(results) == 5
+    assert [r['task_id'] for r in results] == [0, 1, 0, 1, 2]
+    assert np.all(results[4]['Main.x'] == np.arange(3.0))
+
+    app.save_results(filename)
+    assert len(app.load_results(filename)) == 3
+
+
+def test_load_legacy_results(tmpdir):
+    filename = str(tmpdir.join('legacy.db'))
+    db = shelve.open(text_to_native_str(filename))
+    db[text_to_native_str('processed_tasks')] = make_tasks(2)
+    db.close()
+    app = AnyPyProcess(silent=True)
+    results = app.load_results(filename)
+    assert [r['task_id'] for r in results] == [0, 1]
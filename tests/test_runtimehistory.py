@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+from __future__ import (absolute_import, division,
+                        print_function, unicode_literals)
+
+import pickle
+
+import pytest
+
+from anypytools.runtimehistory import RuntimeHistory, predict_makespan
+
+
+def set_value(value):
+    return ['load "model.any"',
+            'classoperation Main.x "Set Value" --value="{}"'.format(value),
+            'operation Main.Study.InverseDynamics', 'run']
+
+
+def test_record_and_predict(tmpdir):
+    filename = str(tmpdir.join('runtimes.sqlite'))
+    history = RuntimeHistory(filename, alpha=0.5)
+    assert history.predict(set_value(1), str(tmpdir)) is None
+    history.record(set_value(1), str(tmpdir), 10.0)
+    history.record(set_value(1) + ['exit'], str(tmpdir), 20.0)
+    assert history.predict(set_value(1), str(tmpdir)) == 15.0
+    # Other values of the same configuration are predicted from it
+    history.record(set_value(2), str(tmpdir), 2.0)
+    assert history.predict(set_value(3), str(tmpdir)) == 8.5
+    assert history.predict(set_value(2), str(tmpdir)) == 2.0
+    assert history.predict(set_value(1), str(tmpdir.mkdir('sub'))) is None
+    history.close()
+
+    history = pickle.loads(pickle.dumps(RuntimeHistory(filename)))
+    assert len(history) == 3
+    history.clear()
+    assert len(history) == 0
+    with pytest.raises(ValueError):
+        RuntimeHistory(filename, alpha=0)
+
+
+def test_predict_makespan():
+    assert predict_makespan([], 4) == 0
+    assert predict_makespan([1, 1, 1, 1], 2) == 2
+    # A long task last is worse than a long task first
+    assert predict_makespan([1, 1, 4], 2) == 5
+    assert predict_makespan([4, 1, 1], 2) == 4
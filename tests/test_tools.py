@@ -15,7 +15,8 @@ import numpy as np
 
 from anypytools.tools import (array2anyscript, get_anybodycon_path,
                               define2str, path2str,
-                              AnyPyProcessOutput, AnyPyProcessOutputList)
+                              AnyPyProcessOutput, AnyPyProcessOutputList,
+                              make_digest)
 
 
 
@@ -51,6 +52,12 @@ def test_array2anyscript():
     str2 = array2anyscript( np.array(['hallo', 'world']) )
     assert str2 == '{"hallo","world"}'
 
+    assert array2anyscript(np.arange(8).reshape(2, 2, 2)) == '{{{0,1},{2,3}},{{4,5},{6,7}}}'
+    assert array2anyscript(np.zeros((2, 0))) == '{{},{}}'
+    assert array2anyscript(np.array([True, False])) == '{1,0}'
+    assert array2anyscript(np.array(1.5)) == '1.5'
+    assert array2anyscript(np.array([1e-20, 1.5e300])) == '{1e-20,1.5e+300}'
+
 
 def test_AnyPyProcessOutput():
     out = AnyPyProcessOutputList( [ AnyPyProcessOutput({'AAAA':1}),
@@ -85,5 +92,162 @@ def test_get_anybodycon_path():
 
 
 
+@pytest.mark.parametrize('value_str, expected', [
+    ('{1, 2, 3}', np.array([1, 2, 3])),
+    ('{0.1, -2.5e-3, 3E2}', np.array([0.1, -2.5e-3, 3e2])),
+    ('{{1.0, 2.0}, {3.0, 4.0}}', np.array([[1.0, 2.0], [3.0, 4.0]])),
+    ('{{{1,2},{3,4}},{{5,6},{7,8}}}', np.arange(1, 9).reshape(2, 2, 2)),
+    ('{}', np.array([])),
+    ('{"a", "b"}', np.array(['a', 'b'])),
+    ('{1.0, nan}', np.array(['1.0', 'nan'])),
+    ('{1, 98765432109876543210}', np.array([1, 98765432109876543210])),
+    ('2.5', 2.5),
+])
+def test_parse_anybodycon_output_values(value_str, expected):
+    from anypytools.tools import parse_anybodycon_output
+    out = parse_anybodycon_output(
+        '#### Macro command > classoperation Main.x "Dump"\n'
+        'Main.x = {};\n'.format(value_str))
+    assert list(out) == ['Main.x']
+    np.testing.assert_array_equal(out['Main.x'], expected)
+    if isinstance(expected, np.ndarray):
+        assert out['Main.x'].dtype == expected.dtype
+
+
+def test_parse_anybodycon_output_ragged_block():
+    from anypytools.tools import _parse_numeric_block
+    assert _parse_numeric_block('{{1,2},{3}}') is None
+    assert _parse_numeric_block('{1,,2}') is None
+    assert _parse_numeric_block('{1.2.3}') is None
+    assert _parse_numeric_block('{1e, 2}') is None
+    assert _parse_numeric_block('{-, 2}') is None
+    # Integers which may overflow are left to literal_eval
+    assert _parse_numeric_block('{1, 98765432109876543210}') is None
+    np.testing.assert_array_equal(_parse_numeric_block('{ -1e3,+.5 }'),
+                                  [-1e3, 0.5])
+
+
+def test_parse_anybodycon_output_errors_and_warnings():
+    from anypytools.tools import parse_anybodycon_output
+    output = ('ERROR : Some error\n'
+              'ERROR : Missing file\n'
+              'WARNING(OBJ1) : Something\n'
+              'WARNING(OBJ2) : Something else\n')
+    out = parse_anybodycon_output(output, errors_to_ignore=['Missing file'],
+                                  warnings_to_include=['OBJ1'])
+    assert out['ERROR'] == ['ERROR : Some error']
+    assert out['WARNING'] == ['WARNING(OBJ1) : Something']
+
+
+def test_AnyBodyConOutputParser_chunks():
+    from anypytools.tools import (AnyBodyConOutputParser,
+                                  parse_anybodycon_output)
+    output = ('#### Macro command > classoperation Main.x "Dump"\r\n'
+              'Main.x = {{1.0, 2.0}, {3.0, 4.0}};\r\n'
+              'ERROR : Some error\n'
+              'Main.y = "a string";\n'
+              'Main.z = 3;')
+    expected = parse_anybodycon_output(output)
+    for chunk_size in [1, 2, 7, 1000]:
+        parser = AnyBodyConOutputParser()
+        for i in range(0, len(output), chunk_size):
+            parser.feed(output[i:i + chunk_size])
+        out = parser.close()
+        assert list(out) == list(expected)
+        for key in expected:
+            np.testing.assert_array_equal(out[key], expected[key])
+
+
+def test_AnyPyProcessOutputList_columns():
+    out = AnyPyProcessOutputList([AnyPyProcessOutput(t=np.arange(3) + i, n=i)
+                                  for i in range(4)])
+    assert out['t'].shape == (4, 3)
+    # Repeated access returns the same data without copying, and the
+    # elements share the data with the column
+    t = out['t']
+    assert np.shares_memory(t, out['t'])
+    assert np.shares_memory(t, out[1]['t'])
+    t -= 1
+    assert out[0]['t'][0] == -1
+    out[2]['t'][0] = 99
+    assert out['t'][2, 0] == 99
+    # The columns are updated with appended and modified elements
+    out.append(AnyPyProcessOutput(t=np.arange(3) + 4, n=4))
+    np.testing.assert_array_equal(out['n'], [0, 1, 2, 3, 4])
+    np.testing.assert_array_equal(out['t'][4], [4, 5, 6])
+    out[1]['n'] = 10.5
+    np.testing.assert_array_equal(out['n'], [0, 10.5, 2, 3, 4])
+    out[3] = AnyPyProcessOutput(t=np.zeros(3), n=30)
+    np.testing.assert_array_equal(out['n'], [0, 10.5, 2, 30, 4])
+    np.testing.assert_array_equal(out['t'][3], 0)
+    del out[0]
+    np.testing.assert_array_equal(out['n'], [10.5, 2, 30, 4])
+    values, offsets = out.get_ragged('t')
+    assert values.shape == (12,)
+    np.testing.assert_array_equal(offsets, [0, 3, 6, 9, 12])
+    # Many appends keep the elements and the column in sync
+    for i in range(100):
+        out.append(AnyPyProcessOutput(t=np.full(3, i), n=i))
+    out[50]['t'][1] = -5
+    assert out['t'][50, 1] == -5
+    assert np.shares_memory(out['t'], out[0]['t'])
+    # Elements without the variable remove the column
+    out.append(AnyPyProcessOutput(n=0))
+    with pytest.raises(KeyError):
+        out['t']
+
+
+def test_AnyPyProcessOutputList_objects():
+    out = AnyPyProcessOutputList([
+        AnyPyProcessOutput(ERROR=['Some error'], name='a'),
+        AnyPyProcessOutput(ERROR=[], name='b')])
+    errors = out['ERROR']
+    assert errors.dtype == object
+    assert list(errors) == [['Some error'], []]
+    assert list(out['name']) == ['a', 'b']
+
+
+def test_AnyPyProcessOutputList_ragged():
+    out = AnyPyProcessOutputList([AnyPyProcessOutput(t=np.ones((i, 2)))
+                                  for i in range(1, 4)])
+    with pytest.warns(UserWarning):
+        data = out['t']
+    assert data.dtype == object
+    assert [d.shape for d in data] == [(1, 2), (2, 2), (3, 2)]
+    out.append(AnyPyProcessOutput(t=np.zeros((2, 2))))
+    values, offsets = out.get_ragged('t')
+    assert values.shape == (8, 2)
+    np.testing.assert_array_equal(offsets, [0, 1, 3, 6, 8])
+    np.testing.assert_array_equal(values[6:], 0)
+    # The elements are views into the concatenated values
+    out[1]['t'][0, 0] = 7
+    assert out.get_ragged('t')[0][1, 0] == 7
+
+
+def test_AnyPyProcessOutput_partial_keys(capsys):
+    from anypytools.tools import _KeyIndex
+    keys = ['Main.Study.Output.Muscle{}.Fm'.format(i) for i in range(12)]
+    outputs = [AnyPyProcessOutput((k, i) for k in keys) for i in range(3)]
+    assert outputs[2]['Muscle11.Fm'] == 2
+    assert outputs[0]._get_key_index() is outputs[1]._get_key_index()
+    # Ambiguous keys use the first match and only warn once
+    assert [o['Muscle1'] for o in outputs] == [0, 1, 2]
+    assert capsys.readouterr().err.count('WARNING') == 1
+    out = AnyPyProcessOutputList(outputs)
+    np.testing.assert_array_equal(out['Muscle3.Fm'], [0, 1, 2])
+    # New keys are found after the output is modified
+    outputs[0]['Main.Other'] = 5
+    assert outputs[0]['Other'] == 5
+    assert isinstance(outputs[0]._get_key_index(), _KeyIndex)
+
+
+def test_make_digest():
+    macros = [['load "model.any"', 'operation Main.Study'], {'a': 1, 'b': (2, 3)}]
+    digest = make_digest(macros)
+    assert digest == make_digest([list(macros[0]), {'b': (2, 3), 'a': 1}])
+    assert digest != make_digest([macros[0], {'a': 1, 'b': (2, 4)}])
+    assert make_digest(['a', 'b']) != make_digest([['a'], 'b'])
+
+
 if __name__ == '__main__':
-    test_array2anyscript()
\ No newline at end of file
+    test_array2anyscript()